@@ -10,9 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import sys
 from pathlib import Path
 
 import environ
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -50,12 +52,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'quisapi.metrics.MetricsMiddleware',
+    'quisapi.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'quisapi.authentication.TokenAwareSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
+    'quisapi.authentication.TokenAwareCsrfViewMiddleware',
+    'quisapi.authentication.TokenAwareAuthenticationMiddleware',
+    'quisapi.authentication.TokenAwareMessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -86,6 +90,85 @@ DATABASES = {
     'default': env.db(),
 }
 
+# 読み取り専用のレプリカ (カンマ区切りの URL)
+# 安全なメソッドのリクエストの読み取りを振り分ける (quisapi.routers.ReplicaRouter)
+# テストではプライマリを使う
+QUISAPI_DB_REPLICAS = []
+for i, url in enumerate(env.list('QUISAPI_DB_REPLICA_URLS', default=[]), 1):
+    alias = 'replica%d' % i
+    DATABASES[alias] = {
+        **env.db_url_config(url),
+        'TEST': {'MIRROR': 'default'},
+    }
+    QUISAPI_DB_REPLICAS.append(alias)
+# 書き込みの後、プライマリから読む秒数 (レプリカの遅延より長くする)
+QUISAPI_DB_REPLICA_STICKY_SECONDS = env.int('QUISAPI_DB_REPLICA_STICKY_SECONDS', default=10)
+# トークン認証のクライアント (Cookie を保持しない) の書き込みの記録先
+QUISAPI_DB_REPLICA_PIN_CACHE_ALIAS = env('QUISAPI_DB_REPLICA_PIN_CACHE_ALIAS', default='default')
+
+DATABASE_ROUTERS = ['quisapi.routers.ReplicaRouter']
+
+# データベースの接続の扱い
+# 'persistent': 接続を QUISAPI_DB_CONN_MAX_AGE 秒まで使い回し、リクエストの開始時に死活を確認する
+# 'pool': プロセス内の接続プール (PostgreSQL・psycopg[pool] のみ)
+#         ASGI ではリクエストごとに接続が閉じられるため、ワーカ内のリクエストで接続を共有するにはこちらを使う
+#         (Dockerfile の ASGI の構成ではこちらを指定している)
+# 'none': リクエストごとに接続する
+QUISAPI_DB_CONNECTION_MODE = env('QUISAPI_DB_CONNECTION_MODE', default='persistent')
+QUISAPI_DB_CONN_MAX_AGE = env.int('QUISAPI_DB_CONN_MAX_AGE', default=60)
+# 接続プールの最小・最大の接続数と、空きを待つ秒数
+QUISAPI_DB_POOL_MIN_SIZE = env.int('QUISAPI_DB_POOL_MIN_SIZE', default=2)
+QUISAPI_DB_POOL_MAX_SIZE = env.int('QUISAPI_DB_POOL_MAX_SIZE', default=10)
+QUISAPI_DB_POOL_TIMEOUT = env.int('QUISAPI_DB_POOL_TIMEOUT', default=10)
+
+for database in DATABASES.values():
+    if QUISAPI_DB_CONNECTION_MODE == 'persistent':
+        database['CONN_MAX_AGE'] = QUISAPI_DB_CONN_MAX_AGE
+        database['CONN_HEALTH_CHECKS'] = True
+    elif QUISAPI_DB_CONNECTION_MODE == 'pool':
+        if database['ENGINE'] != 'django.db.backends.postgresql':
+            raise ImproperlyConfigured('QUISAPI_DB_CONNECTION_MODE=pool requires PostgreSQL.')
+        # プールは持続的な接続と併用できない (プールから取り出す時に死活を確認する)
+        database['CONN_MAX_AGE'] = 0
+        database['CONN_HEALTH_CHECKS'] = True
+        database['OPTIONS'] = {
+            **database.get('OPTIONS', {}),
+            'pool': {
+                'min_size': QUISAPI_DB_POOL_MIN_SIZE,
+                'max_size': QUISAPI_DB_POOL_MAX_SIZE,
+                'timeout': QUISAPI_DB_POOL_TIMEOUT,
+            },
+        }
+    elif QUISAPI_DB_CONNECTION_MODE != 'none':
+        raise ImproperlyConfigured('QUISAPI_DB_CONNECTION_MODE must be persistent, pool or none.')
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+# 共有のキャッシュ (Redis など) か
+# ローカルメモリのキャッシュはワーカーごとに別になり、ログアウト・パスワードの変更が他のワーカーに伝わらない
+SHARED_CACHE = CACHES['default']['BACKEND'] != 'django.core.cache.backends.locmem.LocMemCache'
+
+# セッション
+# 共有のキャッシュがある場合は、キャッシュから読んでデータベースにも書き込む
+SESSION_ENGINE = env(
+    'SESSION_ENGINE',
+    default='django.contrib.sessions.backends.cached_db' if SHARED_CACHE else 'django.contrib.sessions.backends.db',
+)
+
+# 認証
+# ログイン中のユーザ・権限をキャッシュから読む (秒数が 0 の場合は無効、既定では共有のキャッシュがある場合のみ)
+# 既定のローカルメモリのキャッシュ (CACHE_URL 未指定) では無効で、認証済みのリクエストごとに
+# ユーザ・セッションの読み込み (2回のクエリ) が残る。減らすには Redis・memcached を CACHE_URL に指定する
+# 1プロセスだけで動かす場合 (runserver・ワーカー1つ) は、秒数を指定すればローカルメモリでも有効にできる
+# (無効化は同じプロセス内にしか伝わらないため、Dockerfile のように複数ワーカーで動かす場合は指定しない)
+AUTHENTICATION_BACKENDS = ['quisapi.backends.CachedModelBackend']
+QUISAPI_USER_CACHE_ALIAS = env('QUISAPI_USER_CACHE_ALIAS', default='default')
+QUISAPI_USER_CACHE_TIMEOUT = env.int('QUISAPI_USER_CACHE_TIMEOUT', default=300 if SHARED_CACHE else 0)
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -130,23 +213,98 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # rest_frameworkの設定
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'quisapi.renderers.FastJSONRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        # 先頭のクラスが未認証時の WWW-Authenticate を決める (トークンの期限切れ・失効は 401)
+        'quisapi.authentication.SignedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle'
+        'quisapi.throttling.GCRAThrottle',
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '100/day',
-        'user': '1000/day'
+        'read': '1000/day',
+        'write': '300/day',
+        'follow': '100/day',
+        'bulk': '50/day',
     }
 }
+
+# QuizGroup.followings の更新方法
+# 0 の場合は直接加算し、1以上の場合はシャードテーブルに分散して
+# rollup_followings コマンドで定期的に集約する
+QUISAPI_FOLLOWINGS_SHARDS = env.int('QUISAPI_FOLLOWINGS_SHARDS', default=0)
+
+# 未ログインユーザ向けの公開データのレスポンスキャッシュ
+# 秒数が 0 の場合は無効
+QUISAPI_RESPONSE_CACHE_ALIAS = env('QUISAPI_RESPONSE_CACHE_ALIAS', default='default')
+QUISAPI_RESPONSE_CACHE_TIMEOUT = env.int('QUISAPI_RESPONSE_CACHE_TIMEOUT', default=300)
+
+# フィードのタイムライン
+# フォロー数がこの値以上のユーザは、クイズの作成時にタイムラインへ書き込む (0 の場合は無効)
+QUISAPI_FEED_MATERIALIZE_FOLLOWS = env.int('QUISAPI_FEED_MATERIALIZE_FOLLOWS', default=0)
+# タイムラインの作成・フォロー時に取り込むクイズの件数
+QUISAPI_FEED_BACKFILL = env.int('QUISAPI_FEED_BACKFILL', default=1000)
+
+# スロットリング
+QUISAPI_THROTTLE_CACHE_ALIAS = env('QUISAPI_THROTTLE_CACHE_ALIAS', default='default')
+# 状態の保存先
+# 'redis': QUISAPI_THROTTLE_CACHE_ALIAS の Redis のキャッシュ (全ワーカーで共有)
+# 'database': ThrottleBucket テーブル (全ワーカーで共有するが、リクエストごとに行をロックして書き込む)
+# 'local': プロセス内 (ワーカーごとに数えるため、全体の上限はワーカー数倍になる。1プロセスで動かす場合向け)
+# 既定ではキャッシュが Redis なら 'redis'、それ以外は 'database' (複数ワーカーでも上限を守る)
+QUISAPI_THROTTLE_STORE = env(
+    'QUISAPI_THROTTLE_STORE',
+    default=(
+        'redis'
+        if CACHES[QUISAPI_THROTTLE_CACHE_ALIAS]['BACKEND'] == 'django.core.cache.backends.redis.RedisCache'
+        else 'database'
+    ),
+)
+# スコープごとに連続して送れるリクエスト数 (未指定の場合はレートの件数)
+QUISAPI_THROTTLE_BURSTS = {
+    'anon': 20,
+    'read': 100,
+    'write': 30,
+    'follow': 10,
+    'bulk': 5,
+}
+
+# クイズの全文検索 (PostgreSQL) の n-gram の索引
+# 'trigram': pg_trgm (3文字未満の語は索引を使えない)
+# 'bigram': pg_bigm (1〜2文字の語も索引を使える、日本語の2文字の語の検索が多い場合に使う、拡張の導入が必要)
+QUISAPI_SEARCH_NGRAM = env('QUISAPI_SEARCH_NGRAM', default='trigram')
+
+# 人気ランキング
+# 集計期間 (日)・スコアが半分になるまでの時間 (時間)・ランキングに載せるグループ数
+QUISAPI_TRENDING_WINDOW_DAYS = env.int('QUISAPI_TRENDING_WINDOW_DAYS', default=14)
+QUISAPI_TRENDING_HALF_LIFE_HOURS = env.int('QUISAPI_TRENDING_HALF_LIFE_HOURS', default=48)
+QUISAPI_TRENDING_SIZE = env.int('QUISAPI_TRENDING_SIZE', default=1000)
+
+# メトリクス (metrics/ で Prometheus のテキスト形式で出力する)
+# 複数プロセスで動かす場合は集計を書き出すディレクトリを指定する (起動前に空にしておく)
+QUISAPI_METRICS_DIR = env('QUISAPI_METRICS_DIR', default='')
+# 設定されている場合は Authorization: Bearer <トークン> を要求する
+QUISAPI_METRICS_TOKEN = env('QUISAPI_METRICS_TOKEN', default='')
+# この秒数以上かかったリクエストを SQL と共にログに出力する (0 の場合は無効)
+QUISAPI_SLOW_REQUEST_SECONDS = env.float('QUISAPI_SLOW_REQUEST_SECONDS', default=0)
+
+# ビューのクエリ数の上限 (query_budget) を超えた場合の動作
+# 'raise' は例外を送出、'warn' は警告をログに出力、'off' は確認しない
+# テスト (manage.py test) では 'raise'
+QUISAPI_QUERY_BUDGET = env(
+    'QUISAPI_QUERY_BUDGET',
+    default='raise' if sys.argv[1:2] == ['test'] else 'warn',
+)
+
+# 署名付きトークン (token/ で発行し、Authorization: Bearer <トークン> で送る) の有効期間 (秒)
+# トークン認証のリクエストはセッション・CSRF・メッセージのミドルウェアを通さない
+QUISAPI_TOKEN_MAX_AGE = env.int('QUISAPI_TOKEN_MAX_AGE', default=60 * 60 * 24)
@@ -16,10 +16,14 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from quisapi.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     # Cookie認証
     path('quisapi/auth/', include('rest_framework.urls')),
     # QuisAPI
     path('quisapi/', include('quisapi.urls')),
+    # メトリクス (Prometheus)
+    path('metrics', metrics_view),
 ]
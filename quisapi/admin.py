@@ -1,8 +1,29 @@
 from django.contrib import admin
 
-from quisapi.models import QuizGroup, Quiz, QuisAPIUser, Follower
+from quisapi.models import (
+    QuizGroup,
+    Quiz,
+    QuisAPIUser,
+    Follower,
+    FollowingCounterShard,
+    MaterializedFeed,
+    FeedEntry,
+    QuizSearchDocument,
+    Attempt,
+    ReviewSchedule,
+    ThrottleBucket,
+    TrendingScore,
+)
 
 admin.site.register(QuisAPIUser)
 admin.site.register(QuizGroup)
 admin.site.register(Quiz)
 admin.site.register(Follower)
+admin.site.register(FollowingCounterShard)
+admin.site.register(MaterializedFeed)
+admin.site.register(FeedEntry)
+admin.site.register(QuizSearchDocument)
+admin.site.register(Attempt)
+admin.site.register(ReviewSchedule)
+admin.site.register(ThrottleBucket)
+admin.site.register(TrendingScore)
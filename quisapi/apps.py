@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class QuisapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'quisapi'
+
+    def ready(self):
+        from quisapi import signals  # noqa: F401
+        from quisapi.search import create_trigram_index
+
+        post_migrate.connect(create_trigram_index, sender=self)
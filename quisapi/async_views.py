@@ -0,0 +1,160 @@
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ObjectDoesNotExist, ValidationError as DjangoValidationError
+from django.http import Http404, HttpResponse
+from django.views import View
+from rest_framework import exceptions, status
+from rest_framework.parsers import JSONParser
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+
+from quisapi.authentication import SignedTokenAuthentication, is_token_request
+from quisapi.pagination import StandardResultsSetPagination, KeysetPagination
+from quisapi.renderers import FastJSONRenderer
+from quisapi.serializers import QuizGroupSerializer, QuizSerializer, compile_values_serializer
+from quisapi.views import follow_quiz_group, unfollow_quiz_group
+from quisapi.visibility import quiz_group_branches, quiz_branches, combine
+
+
+# 非同期ビューの基底クラス
+# ASGI で動かすことで、遅いクライアントへの送受信の間もワーカーを占有しない
+# 認証・スロットリング・例外のレスポンスは DRF の設定と同じものを使う
+# 同期のビューの条件付きGET (ETag / Last-Modified)・レスポンスキャッシュ・クエリ数の上限には対応しない
+# (一覧・詳細の本文は同期のビューと同じ)
+class AsyncAPIView(View):
+    authentication_required = False
+    throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES
+    renderer = FastJSONRenderer()
+    token_authentication = SignedTokenAuthentication()
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        try:
+            self.request = await self.initialize_request(request)
+            if self.authentication_required and not self.request.user.is_authenticated:
+                raise exceptions.NotAuthenticated()
+            await sync_to_async(self.check_throttles)(self.request)
+            return await super().dispatch(request, *args, **kwargs)
+        except Exception as exc:
+            return self.handle_exception(exc)
+
+    # トークン認証のリクエストはセッションのミドルウェアを通らないため、トークンから認証する
+    async def initialize_request(self, request):
+        drf_request = Request(request, parsers=[JSONParser()])
+        if is_token_request(request):
+            user, _ = await sync_to_async(self.token_authentication.authenticate)(drf_request)
+        else:
+            user = await request.auser()
+        drf_request.user = user
+        return drf_request
+
+    def check_throttles(self, request):
+        for throttle_class in self.throttle_classes:
+            throttle = throttle_class()
+            if not throttle.allow_request(request, self):
+                raise exceptions.Throttled(throttle.wait())
+
+    def handle_exception(self, exc):
+        # DRF のビューと同様に、未認証は WWW-Authenticate: Bearer を付けて 401 で返す
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            exc.auth_header = self.token_authentication.authenticate_header(self.request)
+
+        response = exception_handler(exc, {'view': self, 'request': getattr(self, 'request', None)})
+        if response is None:
+            raise exc
+        headers = {
+            header: value
+            for header, value in response.items()
+            if header.lower() != 'content-type'
+        }
+        return self.render(response.data, status_code=response.status_code, headers=headers)
+
+    def render(self, data, status_code=status.HTTP_200_OK, headers=None):
+        return HttpResponse(
+            self.renderer.render(data),
+            status=status_code,
+            content_type=self.renderer.media_type,
+            headers=headers,
+        )
+
+
+# 読み取り用の非同期ビュー (一覧・詳細)
+class AsyncReadView(AsyncAPIView):
+    serializer_class = None
+    keyset_ordering = None
+
+    def get_visibility_branches(self, queryset):
+        raise NotImplementedError
+
+    async def get(self, request, pk=None, *args, **kwargs):
+        if pk is None:
+            return await self.list()
+        return await self.retrieve(pk)
+
+    async def list(self):
+        columns, serialize = compile_values_serializer(self.serializer_class)
+        fields = list(dict.fromkeys([*columns, *self.keyset_ordering]))
+        branches = self.get_visibility_branches(self.serializer_class.Meta.model.objects.all())
+        queryset = combine(branches, self.keyset_ordering).values(*fields)
+
+        if KeysetPagination.cursor_query_param in self.request.query_params:
+            paginator = KeysetPagination()
+        else:
+            paginator = StandardResultsSetPagination()
+        page = await paginator.apaginate_queryset(queryset, self.request, view=self)
+        if page is None:
+            return self.render([serialize(row) async for row in queryset])
+
+        response = paginator.get_paginated_response([serialize(row) for row in page])
+        return self.render(response.data)
+
+    async def retrieve(self, pk):
+        columns, serialize = compile_values_serializer(self.serializer_class)
+        first, *rest = self.get_visibility_branches(self.serializer_class.Meta.model.objects.all())
+        for branch in rest:
+            first = first | branch
+
+        try:
+            row = await first.values(*columns).aget(pk=pk)
+        except (ObjectDoesNotExist, ValueError, TypeError, DjangoValidationError):
+            raise Http404
+        return self.render(serialize(row))
+
+
+# クイズグループ (一覧・詳細)
+class AsyncQuizGroupView(AsyncReadView):
+    serializer_class = QuizGroupSerializer
+    keyset_ordering = ('quiz_group_name', 'uuid')
+
+    def get_visibility_branches(self, queryset):
+        return quiz_group_branches(self.request.user, queryset)
+
+
+# クイズ (一覧・詳細)
+class AsyncQuizView(AsyncReadView):
+    serializer_class = QuizSerializer
+    keyset_ordering = ('quiz_title', 'uuid')
+
+    def get_visibility_branches(self, queryset):
+        return quiz_branches(self.request.user, queryset)
+
+
+# フォロー
+class AsyncFollowView(AsyncAPIView):
+    authentication_required = True
+    throttle_scope = 'follow'
+
+    async def put(self, request, pk, *args, **kwargs):
+        await sync_to_async(follow_quiz_group)(self.request.user, pk)
+        return self.render(status.HTTP_200_OK)
+
+
+# フォロー解除
+class AsyncUnfollowView(AsyncAPIView):
+    authentication_required = True
+    throttle_scope = 'follow'
+
+    async def put(self, request, pk, *args, **kwargs):
+        await sync_to_async(unfollow_quiz_group)(self.request.user, pk)
+        return self.render(status.HTTP_200_OK)
@@ -0,0 +1,126 @@
+import time
+import uuid as uuid_lib
+
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core import signing
+from django.middleware.csrf import CsrfViewMiddleware
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+from quisapi.backends import CachedModelBackend
+
+KEYWORD = 'Bearer'
+SALT = 'quisapi.authentication.token'
+
+
+# Authorization: Bearer が付いたリクエスト (セッション・CSRF のミドルウェアを通さない)
+def is_token_request(request):
+    return request.META.get('HTTP_AUTHORIZATION', '')[:len(KEYWORD) + 1].lower() == 'bearer '
+
+
+# トークンの発行
+# 内容は「ユーザの uuid.有効期限 (UNIX 時刻).失効バージョン」で、SECRET_KEY による HMAC で署名する
+def issue_token(user):
+    expires = int(time.time()) + settings.QUISAPI_TOKEN_MAX_AGE
+    token = signing.Signer(salt=SALT).sign(
+        '%s.%d.%d' % (user.pk.hex, expires, user.token_version)
+    )
+    return token, expires
+
+
+# トークンの検証 (データベースを参照しない)
+# 返り値は (ユーザの uuid, 失効バージョン)
+def verify_token(token):
+    try:
+        value = signing.Signer(salt=SALT).unsign(token)
+        user_hex, expires, version = value.split('.')
+        user_pk = uuid_lib.UUID(hex=user_hex)
+        expires = int(expires)
+        version = int(version)
+    except (signing.BadSignature, ValueError):
+        raise exceptions.AuthenticationFailed('Invalid token.')
+    if expires < time.time():
+        raise exceptions.AuthenticationFailed('Token has expired.')
+    return user_pk, version
+
+
+# トークン認証のリクエストのユーザの uuid (ユーザは取得しない、検証できない場合は None)
+def get_token_user_pk(request):
+    auth = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(auth) != 2:
+        return None
+    try:
+        user_pk, _ = verify_token(auth[1])
+    except exceptions.AuthenticationFailed:
+        return None
+    return user_pk
+
+
+# 署名付きトークンによる認証 (モバイル・サーバ間のクライアント向け)
+# セッションを使わず、ユーザは CachedModelBackend のキャッシュから取得するため、通常はクエリを実行しない
+# 失効 (ログアウト・パスワードの変更) はユーザの token_version を進めることで行う
+class SignedTokenAuthentication(BaseAuthentication):
+    backend = CachedModelBackend()
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != KEYWORD.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+
+        try:
+            token = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        user_pk, version = verify_token(token)
+
+        user = self.backend.get_user(user_pk)
+        if user is None or user.token_version != version:
+            raise exceptions.AuthenticationFailed('Token has been revoked.')
+        return (user, token)
+
+    def authenticate_header(self, request):
+        return KEYWORD
+
+
+# トークン認証のリクエストでは処理を飛ばすミドルウェア
+# (セッションの読み込み・CSRF の確認・セッションからのユーザの取得を行わない)
+# 管理サイトの設定の確認 (admin.E408 など) のため、元のミドルウェアを継承する
+class SkipForTokenMixin:
+    def __call__(self, request):
+        if is_token_request(request):
+            return self.get_response(request)
+        return super().__call__(request)
+
+
+class TokenAwareSessionMiddleware(SkipForTokenMixin, SessionMiddleware):
+    pass
+
+
+class TokenAwareCsrfViewMiddleware(SkipForTokenMixin, CsrfViewMiddleware):
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        if is_token_request(request):
+            return None
+        return super().process_view(request, callback, callback_args, callback_kwargs)
+
+
+# DRF 以外のビュー (管理サイトなど) のため、request.user は未ログインのユーザにする
+class TokenAwareAuthenticationMiddleware(SkipForTokenMixin, AuthenticationMiddleware):
+    def __call__(self, request):
+        if is_token_request(request):
+            request.user = AnonymousUser()
+            request.auser = aget_anonymous_user
+        return super().__call__(request)
+
+
+async def aget_anonymous_user():
+    return AnonymousUser()
+
+
+class TokenAwareMessageMiddleware(SkipForTokenMixin, MessageMiddleware):
+    pass
@@ -0,0 +1,93 @@
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.db import transaction
+
+KEY_PREFIX = 'quisapi:auth'
+PERMISSION_KINDS = ('user', 'group')
+
+
+def get_cache():
+    return caches[settings.QUISAPI_USER_CACHE_ALIAS]
+
+
+def is_enabled():
+    return settings.QUISAPI_USER_CACHE_TIMEOUT > 0
+
+
+def user_key(user_pk):
+    return '%s:user:%s' % (KEY_PREFIX, user_pk)
+
+
+# 権限のキー (グループの権限の変更は多くのユーザに及ぶため、全体のバージョンを含める)
+def permissions_key(user_pk, kind):
+    cache = get_cache()
+    version_key = '%s:permissions-version' % KEY_PREFIX
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, time.time_ns(), timeout=None)
+        version = cache.get(version_key)
+    return '%s:permissions:%s:%s:%s' % (KEY_PREFIX, version, kind, user_pk)
+
+
+# ユーザの変更 (パスワード・有効/無効・管理者権限を含む) をコミット後に反映する
+def invalidate_user(user_pk):
+    if not is_enabled():
+        return
+    transaction.on_commit(lambda: get_cache().delete_many([
+        user_key(user_pk),
+        *(permissions_key(user_pk, kind) for kind in PERMISSION_KINDS),
+    ]))
+
+
+# 権限・グループの変更
+def invalidate_permissions():
+    if not is_enabled():
+        return
+
+    def bump():
+        cache = get_cache()
+        try:
+            cache.incr('%s:permissions-version' % KEY_PREFIX)
+        except ValueError:
+            pass
+    transaction.on_commit(bump)
+
+
+# ユーザと権限を共有キャッシュから読む認証バックエンド
+# セッション認証のリクエストごとに行われるユーザの取得と、権限の確認のクエリを省く
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        if not is_enabled():
+            return super().get_user(user_id)
+
+        cache = get_cache()
+        key = user_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            cache.set(key, user, timeout=settings.QUISAPI_USER_CACHE_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        return await sync_to_async(self.get_user)(user_id)
+
+    def _get_permissions(self, user_obj, obj, from_name):
+        if not is_enabled() or not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return super()._get_permissions(user_obj, obj, from_name)
+
+        perm_cache_name = '_%s_perm_cache' % from_name
+        if not hasattr(user_obj, perm_cache_name):
+            cache = get_cache()
+            key = permissions_key(user_obj.pk, from_name)
+            perms = cache.get(key)
+            if perms is None:
+                perms = super()._get_permissions(user_obj, obj, from_name)
+                cache.set(key, perms, timeout=settings.QUISAPI_USER_CACHE_TIMEOUT)
+            setattr(user_obj, perm_cache_name, perms)
+        return getattr(user_obj, perm_cache_name)
@@ -0,0 +1,296 @@
+import itertools
+import math
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, connection
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from quisapi import search
+from quisapi.counters import reconcile_followings, reconcile_quizzes
+from quisapi.models import QuisAPIUser, QuizGroup, Quiz, Follower
+from quisapi.trending import refresh_trending
+
+URL_PREFIX = '/quisapi/'
+BATCH_SIZE = 1000
+
+
+# 計測用データの作成
+# パスワードのハッシュ化は1回だけ行い、全ユーザで同じ値を使う
+def seed(users=50, groups_per_user=4, quizzes_per_group=50, follows_per_user=10, public_ratio=0.8, rng=None):
+    rng = rng or random.Random(0)
+    password = make_password('benchmark')
+
+    user_objs = QuisAPIUser.objects.bulk_create(
+        [
+            QuisAPIUser(
+                username='bench%d' % i,
+                email='bench%d@example.com' % i,
+                password=password,
+            )
+            for i in range(users)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    groups = QuizGroup.objects.bulk_create(
+        [
+            QuizGroup(
+                user=user,
+                quiz_group_name='group %d-%d' % (i, j),
+                quiz_group_description='benchmark group %d of user %d' % (j, i),
+                scope=rng.random() < public_ratio,
+            )
+            for i, user in enumerate(user_objs)
+            for j in range(groups_per_user)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    for group in groups:
+        Quiz.objects.bulk_create(
+            [
+                Quiz(
+                    quiz_group=group,
+                    quiz_title='quiz %d of %s' % (k, group.quiz_group_name),
+                    quiz_content='content %d' % rng.randrange(1 << 30),
+                    draw_index=k,
+                )
+                for k in range(quizzes_per_group)
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        search.index_quiz_group(group)
+
+    public = [group for group in groups if group.scope]
+    follows = []
+    for user in user_objs:
+        candidates = [group for group in public if group.user_id != user.pk]
+        for group in rng.sample(candidates, min(follows_per_user, len(candidates))):
+            follows.append(Follower(user=user, quiz_group=group))
+    Follower.objects.bulk_create(follows, batch_size=BATCH_SIZE)
+
+    reconcile_followings()
+    reconcile_quizzes()
+    refresh_trending()
+    return {
+        'users': len(user_objs),
+        'quiz_groups': len(groups),
+        'quizzes': len(groups) * quizzes_per_group,
+        'followers': len(follows),
+    }
+
+
+# シナリオ
+# 呼び出すごとに1リクエストを送り、レスポンスを返す
+class Scenarios:
+    def __init__(self, client, user, rng):
+        self.client = client
+        self.user = user
+        self.rng = rng
+        self.public_groups = list(
+            QuizGroup.objects.filter(scope=True).exclude(user=user).values_list('uuid', flat=True)
+        )
+        self.own_groups = list(QuizGroup.objects.filter(user=user).values_list('uuid', flat=True))
+        self.quizzes = list(
+            Quiz.objects.filter(quiz_group__scope=True).values_list('uuid', flat=True)[:10000]
+        )
+        # 未ログインでも存在するページだけを選ぶよう、公開グループの数から求める
+        self.group_count = QuizGroup.objects.filter(scope=True).count()
+        self.next_url = None
+        self.following = set(Follower.objects.filter(user=user).values_list('quiz_group_id', flat=True))
+
+    def get(self, path, **params):
+        return self.client.get(URL_PREFIX + path, params)
+
+    def quiz_group_list(self):
+        return self.get('quiz-group/')
+
+    def quiz_group_retrieve(self):
+        return self.get('quiz-group/%s/' % self.rng.choice(self.public_groups))
+
+    def quiz_group_page(self):
+        pages = max(1, math.ceil(self.group_count / 10))
+        return self.get('quiz-group/', page=self.rng.randint(1, pages))
+
+    # キーセットページネーションで最後まで辿り、最後に達したら先頭に戻る
+    def quiz_group_keyset(self):
+        if self.next_url is None:
+            response = self.get('quiz-group/', cursor='')
+        else:
+            response = self.client.get(self.next_url)
+        self.next_url = response.json().get('next') if response.status_code == 200 else None
+        return response
+
+    def quiz_list(self):
+        return self.get('quiz/')
+
+    def quiz_retrieve(self):
+        return self.get('quiz/%s/' % self.rng.choice(self.quizzes))
+
+    def quiz_create(self):
+        return self.client.post(
+            URL_PREFIX + 'quiz/',
+            {
+                'quiz_group': str(self.rng.choice(self.own_groups)),
+                'quiz_title': 'benchmark %d' % self.rng.randrange(1 << 30),
+                'quiz_content': 'benchmark',
+            },
+            content_type='application/json',
+        )
+
+    # フォロー・フォロー解除を交互に行う
+    def follow_unfollow(self):
+        candidates = [pk for pk in self.public_groups if pk not in self.following]
+        if self.following and (not candidates or self.rng.random() < 0.5):
+            pk = self.rng.choice(sorted(self.following))
+            self.following.discard(pk)
+            return self.client.put(URL_PREFIX + 'follow/remove/%s' % pk)
+
+        pk = self.rng.choice(candidates)
+        self.following.add(pk)
+        return self.client.put(
+            URL_PREFIX + 'follow/add/%s' % pk,
+            {'user': str(self.user.pk), 'quiz_group': str(pk)},
+            content_type='application/json',
+        )
+
+    def feed(self):
+        return self.get('feed/')
+
+    def search(self):
+        return self.get('search/', q='quiz %d' % self.rng.randrange(10))
+
+    def draw(self):
+        return self.get('quiz-group/%s/draw/' % self.rng.choice(self.public_groups), n=20)
+
+    def trending(self):
+        return self.get('trending/')
+
+
+SCENARIOS = (
+    'quiz_group_list',
+    'quiz_group_retrieve',
+    'quiz_group_page',
+    'quiz_group_keyset',
+    'quiz_list',
+    'quiz_retrieve',
+    'quiz_create',
+    'follow_unfollow',
+    'feed',
+    'search',
+    'draw',
+    'trending',
+)
+
+
+CONNECTION_MODES = ('none', 'persistent', 'pool')
+
+
+# 接続の扱いを切り替える (settings.QUISAPI_DB_CONNECTION_MODE と同じ設定にする)
+def configure_connection(mode, conn_max_age=60):
+    connection.close()
+    if connection.vendor == 'postgresql':
+        connection.close_pool()
+    settings_dict = connection.settings_dict
+    options = settings_dict.setdefault('OPTIONS', {})
+    options.pop('pool', None)
+    if mode == 'none':
+        settings_dict['CONN_MAX_AGE'] = 0
+        settings_dict['CONN_HEALTH_CHECKS'] = False
+    elif mode == 'persistent':
+        settings_dict['CONN_MAX_AGE'] = conn_max_age
+        settings_dict['CONN_HEALTH_CHECKS'] = True
+    else:
+        if connection.vendor != 'postgresql':
+            raise ImproperlyConfigured('The pool connection mode requires PostgreSQL.')
+        settings_dict['CONN_MAX_AGE'] = 0
+        settings_dict['CONN_HEALTH_CHECKS'] = True
+        options['pool'] = True
+
+
+# パーセンタイル (最近接順位法)
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, queries, errors, elapsed, connections=0):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'connections': connections,
+        'throughput': count / elapsed if elapsed else None,
+        'latency_ms': {
+            'mean': sum(latencies) / count * 1000 if count else None,
+            'p50': percentile(latencies, 50) * 1000 if count else None,
+            'p95': percentile(latencies, 95) * 1000 if count else None,
+            'p99': percentile(latencies, 99) * 1000 if count else None,
+            'max': latencies[-1] * 1000 if count else None,
+        },
+        'queries': {
+            'mean': sum(queries) / count if count else None,
+            'max': max(queries) if count else None,
+        },
+    }
+
+
+# シナリオを実行し、リクエストごとの時間とクエリ数・新たに開いた接続数を集計する
+# 計測前に warmup 回だけ実行して結果を捨てる
+# テストクライアントはリクエストの終了時に接続を閉じないため、サーバと同様に close_old_connections を呼ぶ
+def run(names, requests=200, warmup=10, anonymous=False, seed=0):
+    rng = random.Random(seed)
+    user = QuisAPIUser.objects.filter(
+        quizgroup__isnull=False,
+    ).order_by(
+        'username',
+    ).first()
+
+    results = {}
+    for name in names:
+        client = Client()
+        if not anonymous:
+            client.force_login(user)
+        scenario = getattr(Scenarios(client, user, rng), name)
+
+        for _ in range(warmup):
+            scenario()
+            close_old_connections()
+
+        latencies = []
+        queries = []
+        errors = 0
+        connections = []
+
+        def count_connection(sender, connection, **kwargs):
+            connections.append(connection.alias)
+
+        connection_created.connect(count_connection)
+        started = time.perf_counter()
+        try:
+            for _ in itertools.repeat(None, requests):
+                # CaptureQueriesContext は開始時に接続するため、接続の時間も含めて計る
+                begin = time.perf_counter()
+                with CaptureQueriesContext(connection) as context:
+                    response = scenario()
+                    close_old_connections()
+                latencies.append(time.perf_counter() - begin)
+                queries.append(len(context.captured_queries))
+                if response.status_code >= 400:
+                    errors += 1
+        finally:
+            connection_created.disconnect(count_connection)
+        results[name] = summarize(
+            latencies,
+            queries,
+            errors,
+            time.perf_counter() - started,
+            connections=len(connections),
+        )
+    return results
@@ -0,0 +1,199 @@
+import hashlib
+import time
+import uuid as uuid_lib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+KEY_PREFIX = 'quisapi'
+
+
+def get_cache():
+    return caches[settings.QUISAPI_RESPONSE_CACHE_ALIAS]
+
+
+def is_enabled():
+    return settings.QUISAPI_RESPONSE_CACHE_TIMEOUT > 0
+
+
+def version_key(name):
+    return '%s:version:%s' % (KEY_PREFIX, name)
+
+
+def group_version_name(quiz_group_pk):
+    return 'group:%s' % quiz_group_pk
+
+
+# バージョン番号を取得する
+# バージョンのキーが追い出された場合でも古いエントリに当たらないよう、初期値は時刻から作る
+def get_versions(*names):
+    cache = get_cache()
+    keys = [version_key(name) for name in names]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(*names):
+    cache = get_cache()
+    for name in names:
+        key = version_key(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), timeout=None)
+
+
+# コミット後にバージョンを進めて、関連するキャッシュを無効化する
+# (コミット前に進めると、並行するリクエストが古い内容を新しいバージョンで保存しうる)
+def invalidate(*names):
+    if not is_enabled():
+        return
+    transaction.on_commit(lambda: bump_versions(*names))
+
+
+# すべてのキャッシュの無効化
+def invalidate_all():
+    invalidate('all')
+
+
+# クイズグループの変更 (公開範囲・フォロー数を含む)
+def invalidate_quiz_group(quiz_group_pk):
+    invalidate(group_version_name(quiz_group_pk), 'quiz-group', 'quiz')
+
+
+# クイズの変更 (クイズ数・最終更新日時はクイズグループにも表示される)
+def invalidate_quiz(quiz_group_pk, quiz_pk=None):
+    if not is_enabled():
+        return
+    if quiz_pk is not None:
+        transaction.on_commit(lambda: get_cache().delete(quiz_group_of_key(quiz_pk)))
+    invalidate(group_version_name(quiz_group_pk), 'quiz-group', 'quiz')
+
+
+# フォロワーの変更 (フォロー数はクイズグループにのみ表示される)
+def invalidate_followings(*quiz_group_pks):
+    if quiz_group_pks:
+        invalidate(*map(group_version_name, quiz_group_pks), 'quiz-group')
+
+
+# クイズが属するクイズグループの対応表のキー
+def quiz_group_of_key(quiz_pk):
+    return '%s:quiz-group-of:%s' % (KEY_PREFIX, quiz_pk)
+
+
+# ヒット・ミスの件数
+# 共有キャッシュを使う場合はプロセスをまたいで集計される
+def record(result):
+    cache = get_cache()
+    key = '%s:stats:%s' % (KEY_PREFIX, result)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def get_stats():
+    cache = get_cache()
+    results = ('hit', 'miss')
+    stats = cache.get_many(['%s:stats:%s' % (KEY_PREFIX, result) for result in results])
+    return {
+        result: stats.get('%s:stats:%s' % (KEY_PREFIX, result), 0)
+        for result in results
+    }
+
+
+def normalize_uuid(value):
+    try:
+        return str(uuid_lib.UUID(str(value)))
+    except ValueError:
+        return None
+
+
+# 公開データのレスポンスキャッシュ
+# 未ログインのユーザには scope=True のデータしか見えないため、そのレスポンスだけをキャッシュする
+# キーは (エンドポイント, ホスト, クエリパラメータ, 依存するバージョン) から作る
+class PublicResponseCacheMixin:
+    cache_namespace = None
+    cache_quiz_group_field = None
+
+    def is_cacheable(self, request):
+        return (
+            is_enabled()
+            and request.method == 'GET'
+            and not request.user.is_authenticated
+        )
+
+    # 詳細表示のキャッシュが依存するクイズグループ (不明な場合は None)
+    # cache_quiz_group_field が未指定の場合は、オブジェクト自身がクイズグループ
+    def get_cache_quiz_group(self):
+        pk = normalize_uuid(self.kwargs.get(self.lookup_url_kwarg or self.lookup_field))
+        if pk is None or self.cache_quiz_group_field is None:
+            return pk
+        return get_cache().get(quiz_group_of_key(pk))
+
+    def set_cache_quiz_group(self, data):
+        pk = normalize_uuid(self.kwargs.get(self.lookup_url_kwarg or self.lookup_field))
+        if pk is None or self.cache_quiz_group_field is None:
+            return
+        get_cache().set(
+            quiz_group_of_key(pk),
+            normalize_uuid(data[self.cache_quiz_group_field]),
+            timeout=settings.QUISAPI_RESPONSE_CACHE_TIMEOUT,
+        )
+
+    def get_cache_key(self, request, versions):
+        params = sorted(request.query_params.lists())
+        pk = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        raw = repr((self.basename, self.action, request.get_host(), pk, params, versions))
+        return '%s:response:%s' % (KEY_PREFIX, hashlib.sha256(raw.encode('utf-8')).hexdigest())
+
+    def cached_response(self, request, version_names, handler):
+        cache = get_cache()
+        key = self.get_cache_key(request, get_versions('all', *version_names))
+        data = cache.get(key)
+        if data is not None:
+            record('hit')
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        record('miss')
+        response = handler()
+        if response.status_code == 200:
+            cache.set(key, response.data, timeout=settings.QUISAPI_RESPONSE_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        handler = super().list
+        if not self.is_cacheable(request):
+            return handler(request, *args, **kwargs)
+
+        return self.cached_response(
+            request,
+            [self.cache_namespace],
+            lambda: handler(request, *args, **kwargs),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        handler = super().retrieve
+        if not self.is_cacheable(request):
+            return handler(request, *args, **kwargs)
+
+        quiz_group_pk = self.get_cache_quiz_group()
+        if quiz_group_pk is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code == 200:
+                self.set_cache_quiz_group(response.data)
+            return response
+
+        return self.cached_response(
+            request,
+            [group_version_name(quiz_group_pk)],
+            lambda: handler(request, *args, **kwargs),
+        )
@@ -0,0 +1,115 @@
+import hashlib
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.response import Response
+
+from quisapi import cache
+
+
+# ETag / Last-Modified による条件付きGET
+# update_date などの検証用の値だけを取得し、変更が無ければシリアライズせずに 304 を返す
+class ConditionalGetMixin:
+    # 詳細表示の検証に使う列 (update_date は先頭)
+    etag_fields = ('update_date',)
+    # 詳細表示で If-Modified-Since を判定するか (update_date 以外の列の変更も検証する場合は False)
+    use_last_modified = True
+    # 一覧表示の検証に使う集計 (last_modified は必須)
+    etag_aggregates = {}
+
+    def make_etag(self, request, values):
+        user = request.user.pk if request.user.is_authenticated else None
+        raw = repr((self.basename, self.action, request.get_full_path(), user, values))
+        return quote_etag(hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32])
+
+    def get_object_validators(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.get_aggregate_queryset()
+        try:
+            values = queryset.filter(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+            ).values_list(*self.etag_fields).first()
+        except (ValueError, DjangoValidationError):
+            return None, None
+        if values is None:
+            return None, None
+
+        return self.make_etag(self.request, values), values[0]
+
+    def get_list_validators(self):
+        values = self.get_list_aggregates()
+        return self.make_etag(self.request, sorted(values.items())), values['last_modified']
+
+    # 一覧の検証に使う集計
+    # レスポンスキャッシュが有効な場合は、同じバージョンのキーにユーザごとに保存して再利用する
+    # (一覧のリクエストごとに閲覧可能な全件を集計しない)
+    def get_list_aggregates(self):
+        namespace = getattr(self, 'cache_namespace', None)
+        if not cache.is_enabled() or namespace is None:
+            return self.get_aggregate_queryset().aggregate(**self.etag_aggregates)
+
+        # 集計より先にバージョンを読む (集計中の変更は次のバージョンで集計し直される)
+        versions = cache.get_versions('all', namespace)
+        user = self.request.user.pk if self.request.user.is_authenticated else None
+        key = '%s:validators:%s:%s:%s' % (
+            cache.KEY_PREFIX,
+            self.basename,
+            user,
+            ':'.join(map(str, versions)),
+        )
+        values = cache.get_cache().get(key)
+        if values is None:
+            values = self.get_aggregate_queryset().aggregate(**self.etag_aggregates)
+            cache.get_cache().set(key, values, timeout=settings.QUISAPI_RESPONSE_CACHE_TIMEOUT)
+        return values
+
+    # 条件に一致すれば 304 を返す
+    def get_not_modified_response(self, request, etag, last_modified, use_last_modified=True):
+        timestamp = None
+        if use_last_modified and last_modified:
+            timestamp = int(last_modified.timestamp())
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            return None
+
+        return Response(status=response.status_code, headers=self.get_validator_headers(etag, last_modified))
+
+    def get_validator_headers(self, etag, last_modified):
+        headers = {}
+        if etag:
+            headers['ETag'] = etag
+        if last_modified:
+            headers['Last-Modified'] = http_date(last_modified.timestamp())
+        return headers
+
+    def set_validator_headers(self, response, etag, last_modified):
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        for header, value in self.get_validator_headers(etag, last_modified).items():
+            response[header] = value
+        return response
+
+    def list(self, request, *args, **kwargs):
+        etag, last_modified = self.get_list_validators()
+        # 一覧は削除されても最終更新日時が変わらないため、If-Modified-Since では判定しない
+        not_modified = self.get_not_modified_response(request, etag, last_modified, use_last_modified=False)
+        if not_modified is not None:
+            return not_modified
+
+        response = super().list(request, *args, **kwargs)
+        return self.set_validator_headers(response, etag, last_modified)
+
+    def retrieve(self, request, *args, **kwargs):
+        etag, last_modified = self.get_object_validators()
+        if etag is not None:
+            not_modified = self.get_not_modified_response(
+                request, etag, last_modified, use_last_modified=self.use_last_modified,
+            )
+            if not_modified is not None:
+                return not_modified
+
+        response = super().retrieve(request, *args, **kwargs)
+        return self.set_validator_headers(response, etag, last_modified)
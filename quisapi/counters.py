@@ -0,0 +1,195 @@
+import random
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from quisapi import cache
+from quisapi.models import QuizGroup, Quiz, Follower, FollowingCounterShard
+
+
+# シャード数 (0 の場合は QuizGroup.followings を直接更新する)
+def get_shard_count():
+    return getattr(settings, 'QUISAPI_FOLLOWINGS_SHARDS', 0)
+
+
+# フォロー数を増減する
+# 読み出した値に加算するのではなく、DB側で F() により加算するため更新が失われない
+def add_followings(quiz_group_pk, delta):
+    shards = get_shard_count()
+    if shards <= 0:
+        QuizGroup.objects.filter(
+            uuid=quiz_group_pk,
+        ).update(
+            followings=F('followings') + delta,
+        )
+        return
+
+    shard = random.randrange(shards)
+    updated = FollowingCounterShard.objects.filter(
+        quiz_group_id=quiz_group_pk,
+        shard=shard,
+    ).update(
+        delta=F('delta') + delta,
+    )
+    if not updated:
+        FollowingCounterShard.objects.get_or_create(
+            quiz_group_id=quiz_group_pk,
+            shard=shard,
+        )
+        FollowingCounterShard.objects.filter(
+            quiz_group_id=quiz_group_pk,
+            shard=shard,
+        ).update(
+            delta=F('delta') + delta,
+        )
+
+
+# 複数のクイズグループのフォロー数を同じだけ増減する (グループ数によらずクエリの回数は一定)
+def add_followings_many(quiz_group_pks, delta):
+    if not quiz_group_pks:
+        return
+
+    shards = get_shard_count()
+    if shards <= 0:
+        QuizGroup.objects.filter(
+            uuid__in=quiz_group_pks,
+        ).update(
+            followings=F('followings') + delta,
+        )
+        return
+
+    # 無いシャードの行をまとめて作成してから加算する
+    shard = random.randrange(shards)
+    FollowingCounterShard.objects.bulk_create(
+        [
+            FollowingCounterShard(quiz_group_id=quiz_group_pk, shard=shard)
+            for quiz_group_pk in quiz_group_pks
+        ],
+        ignore_conflicts=True,
+    )
+    FollowingCounterShard.objects.filter(
+        quiz_group_id__in=quiz_group_pks,
+        shard=shard,
+    ).update(
+        delta=F('delta') + delta,
+    )
+
+
+# シャードに溜まった差分を QuizGroup.followings へ集約する
+# 集約したグループ数を返す
+def rollup_followings():
+    quiz_group_pks = FollowingCounterShard.objects.exclude(
+        delta=0,
+    ).values_list(
+        'quiz_group_id',
+        flat=True,
+    ).distinct()
+
+    count = 0
+    for quiz_group_pk in list(quiz_group_pks):
+        with transaction.atomic():
+            shards = list(
+                FollowingCounterShard.objects.select_for_update().filter(
+                    quiz_group_id=quiz_group_pk,
+                ).exclude(
+                    delta=0,
+                )
+            )
+            if not shards:
+                continue
+
+            total = sum(shard.delta for shard in shards)
+            FollowingCounterShard.objects.filter(
+                pk__in=[shard.pk for shard in shards],
+            ).update(
+                delta=0,
+            )
+            QuizGroup.objects.filter(
+                uuid=quiz_group_pk,
+            ).update(
+                followings=F('followings') + total,
+            )
+            cache.invalidate_followings(quiz_group_pk)
+            count += 1
+
+    return count
+
+
+# Follower テーブルからフォロー数を再計算する
+# 更新したグループ数を返す
+@transaction.atomic
+def reconcile_followings():
+    follower_count = Follower.objects.filter(
+        quiz_group=OuterRef('pk'),
+    ).order_by().values(
+        'quiz_group',
+    ).annotate(
+        count=Count('pk'),
+    ).values('count')
+
+    FollowingCounterShard.objects.all().delete()
+    cache.invalidate_all()
+    return QuizGroup.objects.update(
+        followings=Coalesce(Subquery(follower_count), Value(0)),
+    )
+
+
+# クイズ数を増やし、クイズの最終更新日時を進める
+# (delta が 0 の場合は最終更新日時のみ)
+# 最終更新日時はグループにあるクイズの update_date の最大値 (reconcile_quizzes と同じ定義)
+def add_quizzes(quiz_group_pk, delta, activity=None):
+    if activity is None:
+        activity = timezone.now()
+    QuizGroup.objects.filter(
+        uuid=quiz_group_pk,
+    ).update(
+        quiz_count=F('quiz_count') + delta,
+        last_quiz_activity=Greatest(
+            Coalesce(F('last_quiz_activity'), Value(activity)),
+            Value(activity),
+        ),
+    )
+
+
+# クイズ数を減らし、クイズの最終更新日時を残ったクイズから求め直す
+# (クイズの削除・移動の後に呼ぶ)
+def remove_quizzes(quiz_group_pk, count):
+    QuizGroup.objects.filter(
+        uuid=quiz_group_pk,
+    ).update(
+        quiz_count=F('quiz_count') - count,
+        last_quiz_activity=Subquery(
+            Quiz.objects.filter(
+                quiz_group=OuterRef('pk'),
+            ).order_by().values(
+                'quiz_group',
+            ).annotate(
+                last=Max('update_date'),
+            ).values('last'),
+        ),
+    )
+
+
+# Quiz テーブルからクイズ数・最終更新日時を再計算する
+# 更新したグループ数を返す
+@transaction.atomic
+def reconcile_quizzes():
+    quizzes = Quiz.objects.filter(
+        quiz_group=OuterRef('pk'),
+    ).order_by().values(
+        'quiz_group',
+    )
+
+    cache.invalidate_all()
+    return QuizGroup.objects.update(
+        quiz_count=Coalesce(
+            Subquery(quizzes.annotate(count=Count('pk')).values('count')),
+            Value(0),
+        ),
+        last_quiz_activity=Subquery(
+            quizzes.annotate(last=Max('update_date')).values('last'),
+        ),
+    )
@@ -0,0 +1,120 @@
+import random
+
+from django.db import transaction
+from django.db.models import F, Max
+
+from quisapi.models import QuizGroup, Quiz
+
+# 欠番を引き直す回数 (超えた場合は残りの連番を全て取得して選ぶ)
+MAX_ROUNDS = 3
+
+
+# グループ内の連番の上限 (最大の連番 + 1)
+# (quiz_group, draw_index) の一意索引の末尾を読むだけで求まる
+def get_draw_sequence(quiz_group_pk):
+    last = Quiz.objects.filter(
+        quiz_group_id=quiz_group_pk,
+    ).aggregate(
+        last=Max('draw_index'),
+    )['last']
+    return 0 if last is None else last + 1
+
+
+# 作成前のクイズに抽選用連番を割り当てる
+# 同じグループへの同時採番を防ぐためクイズグループの行をロックする
+# (ロックはトランザクションの終了まで保持されるため、呼び出し元は保存までを同じトランザクションで行う)
+@transaction.atomic
+def assign_draw_indexes(quiz_group_pk, quizzes):
+    QuizGroup.objects.select_for_update().only('pk').get(pk=quiz_group_pk)
+    start = get_draw_sequence(quiz_group_pk)
+    for offset, quiz in enumerate(quizzes):
+        quiz.draw_index = start + offset
+
+
+# 連番 [0, sequence) のうち、tried に含まれないものを最大 count 個無作為に選ぶ
+def sample_indexes(sequence, tried, count):
+    candidates = []
+    for index in random.sample(range(sequence), min(sequence, count + len(tried))):
+        if index not in tried:
+            candidates.append(index)
+            if len(candidates) >= count:
+                break
+    return candidates
+
+
+# クイズグループから n 件を重複なく無作為に選ぶ (exclude の uuid は除く)
+# ORDER BY random() で全件を並び替えず、連番を無作為に選んで (quiz_group, draw_index) の索引で引く
+# 削除による欠番は引き直すため、残っているクイズはどれも同じ確率で選ばれる
+def draw(queryset, quiz_group, n, exclude=()):
+    queryset = queryset.filter(
+        quiz_group=quiz_group,
+    )
+    sequence = get_draw_sequence(quiz_group.pk)
+    tried = set()
+    if exclude:
+        tried.update(
+            queryset.filter(
+                uuid__in=exclude,
+            ).values_list(
+                'draw_index',
+                flat=True,
+            )
+        )
+
+    found = {}
+    order = []
+    for _ in range(MAX_ROUNDS):
+        need = n - len(found)
+        if need <= 0 or len(tried) >= sequence:
+            break
+
+        # 欠番を見込んで多めに引く
+        candidates = sample_indexes(sequence, tried, need * 2)
+        tried.update(candidates)
+        order.extend(candidates)
+        for row in queryset.filter(draw_index__in=candidates):
+            found[row['draw_index']] = row
+    else:
+        if len(found) < n and len(tried) < sequence:
+            rest = [
+                index
+                for index in queryset.filter(
+                    draw_index__isnull=False,
+                ).values_list(
+                    'draw_index',
+                    flat=True,
+                )
+                if index not in tried
+            ]
+            candidates = random.sample(rest, min(len(rest), n - len(found)))
+            order.extend(candidates)
+            for row in queryset.filter(draw_index__in=candidates):
+                found[row['draw_index']] = row
+
+    return [found[index] for index in order if index in found][:n]
+
+
+# 抽選用連番を 0 から振り直す (欠番の解消・連番の無い既存データの採番)
+@transaction.atomic
+def renumber(quiz_group_pk):
+    QuizGroup.objects.select_for_update().only('pk').get(pk=quiz_group_pk)
+    quizzes = list(
+        Quiz.objects.filter(
+            quiz_group_id=quiz_group_pk,
+        ).order_by(
+            F('draw_index').asc(nulls_last=True),
+            'creation_date',
+        ).only(
+            'uuid',
+        )
+    )
+    # 一意制約に触れないよう一度外してから振り直す
+    Quiz.objects.filter(
+        quiz_group_id=quiz_group_pk,
+    ).update(
+        draw_index=None,
+    )
+    for index, quiz in enumerate(quizzes):
+        quiz.draw_index = index
+    Quiz.objects.bulk_update(quizzes, fields=['draw_index'], batch_size=1000)
+    return len(quizzes)
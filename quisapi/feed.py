@@ -0,0 +1,122 @@
+from django.conf import settings
+from django.db.models import F
+
+from quisapi.models import Quiz, Follower, MaterializedFeed, FeedEntry
+
+BATCH_SIZE = 1000
+
+
+# タイムラインを事前に作成するフォロー数の閾値 (0 の場合は常に読み込み時に集約する)
+def get_materialize_follows():
+    return getattr(settings, 'QUISAPI_FEED_MATERIALIZE_FOLLOWS', 0)
+
+
+def is_enabled():
+    return get_materialize_follows() > 0
+
+
+# フィードのクエリセット
+# 並び替えは feed_date (新着順) と uuid で行う
+def feed_queryset(user):
+    if is_enabled() and MaterializedFeed.objects.filter(user=user).exists():
+        # ファンアウト・オン・ライト: 作成済みのタイムラインから読む
+        queryset = Quiz.objects.filter(
+            feedentry__user=user,
+        ).annotate(
+            feed_date=F('feedentry__creation_date'),
+        )
+    else:
+        # ファンアウト・オン・リード: フォロー中のグループのクイズを (quiz_group, creation_date) の索引で集める
+        queryset = Quiz.objects.filter(
+            quiz_group__follower__user=user,
+        ).annotate(
+            feed_date=F('creation_date'),
+        )
+
+    # 非公開になったグループのクイズは表示しない
+    return queryset.filter(
+        quiz_group__scope=True,
+    )
+
+
+# 新しく作成されたクイズを、タイムラインを作成済みのフォロワーに配る
+def fan_out(quiz_group_pk, quizzes):
+    if not is_enabled() or not quizzes:
+        return
+
+    user_pks = Follower.objects.filter(
+        quiz_group_id=quiz_group_pk,
+        user__materializedfeed__isnull=False,
+    ).values_list(
+        'user_id',
+        flat=True,
+    )
+    FeedEntry.objects.bulk_create(
+        [
+            FeedEntry(
+                user_id=user_pk,
+                quiz_id=quiz.pk,
+                quiz_group_id=quiz_group_pk,
+                creation_date=quiz.creation_date,
+            )
+            for user_pk in user_pks
+            for quiz in quizzes
+        ],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+# 指定したグループの新しいクイズをタイムラインに追加する
+# 追加するのは新しいものから QUISAPI_FEED_BACKFILL 件まで
+def backfill(user, quiz_group_pks):
+    quizzes = Quiz.objects.filter(
+        quiz_group__in=quiz_group_pks,
+    ).order_by(
+        '-creation_date',
+    ).values_list(
+        'uuid',
+        'quiz_group_id',
+        'creation_date',
+    )[:settings.QUISAPI_FEED_BACKFILL]
+
+    FeedEntry.objects.bulk_create(
+        [
+            FeedEntry(
+                user=user,
+                quiz_id=quiz_pk,
+                quiz_group_id=quiz_group_pk,
+                creation_date=creation_date,
+            )
+            for quiz_pk, quiz_group_pk, creation_date in quizzes
+        ],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+# フォロー時 (複数のグループをまとめて扱う)
+# フォロー数が閾値に達したユーザはタイムラインの作成に切り替える
+def on_follow(user, quiz_group_pks):
+    if not is_enabled() or not quiz_group_pks:
+        return
+
+    if MaterializedFeed.objects.filter(user=user).exists():
+        backfill(user, quiz_group_pks)
+        return
+
+    follows = Follower.objects.filter(user=user)
+    if follows.count() >= get_materialize_follows():
+        MaterializedFeed.objects.get_or_create(user=user)
+        backfill(user, follows.values('quiz_group'))
+
+
+# フォロー解除時 (複数のグループをまとめて扱う)
+def on_unfollow(user, quiz_group_pks):
+    if not quiz_group_pks:
+        return
+
+    FeedEntry.objects.filter(
+        user=user,
+        quiz_group_id__in=quiz_group_pks,
+    ).delete()
@@ -0,0 +1,152 @@
+import json
+import platform
+import subprocess
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from quisapi import benchmark
+from quisapi.models import QuisAPIUser
+
+
+# エンドポイントの負荷計測
+# 既存のデータを壊さないよう、テスト用データベース (test_<NAME>) を作成してデータを投入し、
+# 計測後に削除する (--keepdb で再利用)
+# --connection-modes で接続の扱いを切り替えて比較する (SQLite のテスト用データベースはメモリ上にあり接続を閉じないため、
+# 接続にかかる時間の差は PostgreSQL で計測する)
+class Command(BaseCommand):
+    help = 'Seed a test database and benchmark QuisAPI endpoints.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--groups-per-user', type=int, default=4)
+        parser.add_argument('--quizzes-per-group', type=int, default=50)
+        parser.add_argument('--follows-per-user', type=int, default=10)
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per scenario.')
+        parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per scenario.')
+        parser.add_argument(
+            '--scenarios',
+            default=','.join(benchmark.SCENARIOS),
+            help='Comma separated scenarios (%s).' % ', '.join(benchmark.SCENARIOS),
+        )
+        parser.add_argument('--anonymous', action='store_true', help='Send requests without logging in.')
+        parser.add_argument('--throttle', action='store_true', help='Keep request throttling enabled.')
+        parser.add_argument('--keepdb', action='store_true', help='Reuse the seeded test database.')
+        parser.add_argument(
+            '--connection-modes',
+            default='',
+            help='Comma separated connection modes to compare (%s). Defaults to the configured mode.'
+            % ', '.join(benchmark.CONNECTION_MODES),
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+
+    def handle(self, *args, **options):
+        names = [name for name in options['scenarios'].split(',') if name]
+        unknown = set(names) - set(benchmark.SCENARIOS)
+        if unknown:
+            raise CommandError('Unknown scenarios: %s' % ', '.join(sorted(unknown)))
+        modes = [mode for mode in options['connection_modes'].split(',') if mode]
+        unknown = set(modes) - set(benchmark.CONNECTION_MODES)
+        if unknown:
+            raise CommandError('Unknown connection modes: %s' % ', '.join(sorted(unknown)))
+        if 'pool' in modes and connection.vendor != 'postgresql':
+            raise CommandError('The pool connection mode requires PostgreSQL.')
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, keepdb=options['keepdb'])
+        try:
+            scale = None
+            if not options['keepdb'] or not QuisAPIUser.objects.exists():
+                scale = benchmark.seed(
+                    users=options['users'],
+                    groups_per_user=options['groups_per_user'],
+                    quizzes_per_group=options['quizzes_per_group'],
+                    follows_per_user=options['follows_per_user'],
+                )
+
+            rest_framework = dict(settings.REST_FRAMEWORK)
+            if not options['throttle']:
+                rest_framework['DEFAULT_THROTTLE_RATES'] = {}
+            results = {}
+            with override_settings(REST_FRAMEWORK=rest_framework):
+                # 接続の扱いごとに同じシナリオを実行する (未指定の場合は設定のまま1回)
+                for mode in modes or [settings.QUISAPI_DB_CONNECTION_MODE]:
+                    if modes:
+                        benchmark.configure_connection(mode, settings.QUISAPI_DB_CONN_MAX_AGE)
+                    results[mode] = benchmark.run(
+                        names,
+                        requests=options['requests'],
+                        warmup=options['warmup'],
+                        anonymous=options['anonymous'],
+                        seed=options['seed'],
+                    )
+        finally:
+            connection.close()
+            if connection.vendor == 'postgresql':
+                # プールの接続が残っているとテスト用データベースを削除できない
+                connection.close_pool()
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'commit': self.get_commit(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'scale': scale,
+                'options': {
+                    key: options[key]
+                    for key in ('requests', 'warmup', 'anonymous', 'throttle', 'seed')
+                },
+            },
+            'connection_modes': results,
+        }
+        for mode, mode_results in results.items():
+            self.stdout.write('connection mode: %s' % mode)
+            self.write_table(mode_results)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS('Wrote %s' % options['output']))
+
+    def get_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'],
+                capture_output=True,
+                check=True,
+                cwd=settings.BASE_DIR,
+                text=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def write_table(self, results):
+        self.stdout.write(
+            '%-20s %8s %6s %10s %9s %9s %9s %8s %8s' % (
+                'scenario', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'connects',
+            )
+        )
+        for name, result in results.items():
+            latency = result['latency_ms']
+            self.stdout.write(
+                '%-20s %8d %6d %10.1f %9.2f %9.2f %9.2f %8.1f %8d' % (
+                    name,
+                    result['requests'],
+                    result['errors'],
+                    result['throughput'] or 0,
+                    latency['p50'] or 0,
+                    latency['p95'] or 0,
+                    latency['p99'] or 0,
+                    result['queries']['mean'] or 0,
+                    result['connections'],
+                )
+            )
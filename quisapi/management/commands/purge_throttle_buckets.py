@@ -0,0 +1,14 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from quisapi.models import ThrottleBucket
+
+
+# 期限切れのスロットリングの状態の削除 (データベースに状態を持つ場合に定期的に実行する)
+class Command(BaseCommand):
+    help = 'Delete throttle buckets that have fully drained.'
+
+    def handle(self, *args, **options):
+        count, _ = ThrottleBucket.objects.filter(tat__lt=time.time()).delete()
+        self.stdout.write(self.style.SUCCESS('Deleted %d throttle buckets.' % count))
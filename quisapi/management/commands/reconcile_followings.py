@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from quisapi.counters import reconcile_followings
+
+
+# フォロー数の再計算
+class Command(BaseCommand):
+    help = 'Recompute QuizGroup.followings from the Follower table.'
+
+    def handle(self, *args, **options):
+        count = reconcile_followings()
+        self.stdout.write(self.style.SUCCESS('Reconciled %d quiz groups.' % count))
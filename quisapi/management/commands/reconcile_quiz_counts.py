@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from quisapi.counters import reconcile_quizzes
+
+
+# クイズ数・クイズの最終更新日時の再計算
+class Command(BaseCommand):
+    help = 'Recompute QuizGroup.quiz_count and last_quiz_activity from the Quiz table.'
+
+    def handle(self, *args, **options):
+        count = reconcile_quizzes()
+        self.stdout.write(self.style.SUCCESS('Reconciled %d quiz groups.' % count))
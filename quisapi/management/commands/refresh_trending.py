@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from quisapi.trending import refresh_trending
+
+
+# 人気ランキングの更新 (定期的に実行する)
+class Command(BaseCommand):
+    help = 'Recompute the trending quiz group ranking.'
+
+    def handle(self, *args, **options):
+        count = refresh_trending()
+        self.stdout.write(self.style.SUCCESS('Ranked %d quiz groups.' % count))
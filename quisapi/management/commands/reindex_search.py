@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from quisapi.models import QuizGroup
+from quisapi.search import index_quiz_group
+
+
+# 検索用ドキュメントの再作成 (導入時や正規化方法の変更時に実行する)
+class Command(BaseCommand):
+    help = 'Rebuild the quiz search documents.'
+
+    def handle(self, *args, **options):
+        count = 0
+        for quiz_group in QuizGroup.objects.iterator(chunk_size=1000):
+            index_quiz_group(quiz_group)
+            count += 1
+        self.stdout.write(self.style.SUCCESS('Reindexed %d quiz groups.' % count))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from quisapi.draw import renumber
+from quisapi.models import QuizGroup
+
+
+# 抽選用連番の振り直し (導入時や削除で欠番が増えた場合に実行する)
+class Command(BaseCommand):
+    help = 'Renumber Quiz.draw_index densely within each quiz group.'
+
+    def handle(self, *args, **options):
+        count = 0
+        for pk in QuizGroup.objects.values_list('pk', flat=True).iterator(chunk_size=1000):
+            renumber(pk)
+            count += 1
+        self.stdout.write(self.style.SUCCESS('Renumbered %d quiz groups.' % count))
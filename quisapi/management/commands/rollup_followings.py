@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from quisapi.counters import rollup_followings
+
+
+# フォロー数シャードの集約
+class Command(BaseCommand):
+    help = 'Roll up sharded follower counters into QuizGroup.followings.'
+
+    def handle(self, *args, **options):
+        count = rollup_followings()
+        self.stdout.write(self.style.SUCCESS('Rolled up %d quiz groups.' % count))
@@ -0,0 +1,308 @@
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+logger = logging.getLogger('quisapi.slow_request')
+
+# ヒストグラムのバケット (レイテンシは秒、クエリ数は件)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# 他プロセスから読めるよう、集計をファイルに書き出す間隔 (秒)
+FLUSH_INTERVAL = 5
+# 遅いリクエストのログに載せる SQL の件数
+MAX_LOGGED_QUERIES = 50
+
+METRICS = {
+    'quisapi_requests_total': ('counter', 'Requests by view, method and status class.'),
+    'quisapi_request_duration_seconds': ('histogram', 'Request latency.'),
+    'quisapi_db_queries': ('histogram', 'Database queries per request.'),
+    'quisapi_db_duration_seconds_total': ('counter', 'Time spent executing database queries.'),
+    'quisapi_serialize_duration_seconds_total': ('counter', 'Time spent serializing and rendering responses.'),
+    'quisapi_response_bytes_total': ('counter', 'Response body size (streaming responses are not counted).'),
+}
+
+# 処理中のリクエストの計測値 (シリアライズ時間の加算先)
+current = contextvars.ContextVar('quisapi_request_metrics', default=None)
+
+
+# プロセス内の集計
+# スレッド間ではロックで保護し、プロセス間では QUISAPI_METRICS_DIR にプロセスごとのファイルとして書き出して
+# 出力時に全ファイルを合算する
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.flushed_at = 0
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets):
+        key = (name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # バケットごとの件数 (+Inf を含む)・合計
+                histogram = self.histograms[key] = [buckets, [0] * (len(buckets) + 1), 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    break
+            else:
+                i = len(buckets)
+            histogram[1][i] += 1
+            histogram[2] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'histograms': [
+                    [name, labels, list(buckets), list(counts), total]
+                    for (name, labels), (buckets, counts, total) in self.histograms.items()
+                ],
+            }
+
+    # 一定間隔ごとにファイルへ書き出す (書きかけのファイルを読まないよう置き換えで書く)
+    def flush(self, force=False):
+        directory = settings.QUISAPI_METRICS_DIR
+        if not directory:
+            return
+        now = time.monotonic()
+        if not force and now - self.flushed_at < FLUSH_INTERVAL:
+            return
+        self.flushed_at = now
+        path = os.path.join(directory, '%d.json' % os.getpid())
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    # 全プロセスの集計を合算する
+    # 終了したプロセスのファイルも残して合算する (カウンタが減らないように)
+    def collect(self):
+        directory = settings.QUISAPI_METRICS_DIR
+        if not directory:
+            return self.snapshot()
+        self.flush(force=True)
+        snapshots = []
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return merge(snapshots)
+
+
+registry = Registry()
+
+
+def merge(snapshots):
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, buckets, counts, total in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            if key not in histograms:
+                histograms[key] = [buckets, [0] * len(counts), 0]
+            histogram = histograms[key]
+            histogram[1] = [a + b for a, b in zip(histogram[1], counts)]
+            histogram[2] += total
+    return {
+        'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+        'histograms': [
+            [name, labels, buckets, counts, total]
+            for (name, labels), (buckets, counts, total) in histograms.items()
+        ],
+    }
+
+
+def format_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in pairs
+    )
+
+
+def format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+# Prometheus のテキスト形式で出力する
+def render(snapshot):
+    series = {}
+    for name, labels, value in sorted(snapshot['counters']):
+        series.setdefault(name, []).append('%s%s %s' % (name, format_labels(labels), format_value(value)))
+    for name, labels, buckets, counts, total in sorted(snapshot['histograms']):
+        lines = series.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip([*buckets, '+Inf'], counts):
+            cumulative += count
+            lines.append('%s_bucket%s %d' % (name, format_labels(labels, [('le', bound)]), cumulative))
+        lines.append('%s_sum%s %s' % (name, format_labels(labels), format_value(total)))
+        lines.append('%s_count%s %d' % (name, format_labels(labels), cumulative))
+
+    output = []
+    for name, (kind, help_text) in METRICS.items():
+        if name not in series:
+            continue
+        output.append('# HELP %s %s' % (name, help_text))
+        output.append('# TYPE %s %s' % (name, kind))
+        output.extend(series[name])
+    return '\n'.join(output) + '\n'
+
+
+# シリアライズ・レンダリングにかかった時間を処理中のリクエストに加算する
+@contextlib.contextmanager
+def measure_serialize():
+    request_metrics = current.get()
+    if request_metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        request_metrics.serialize_time += time.perf_counter() - started
+
+
+# 1リクエスト分の計測値
+# connection.execute_wrapper で全データベースのクエリの件数・時間を数える
+class RequestMetrics:
+    def __init__(self, capture_sql):
+        self.capture_sql = capture_sql
+        self.queries = 0
+        self.db_time = 0
+        self.serialize_time = 0
+        self.captured = []
+        self.stack = contextlib.ExitStack()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.queries += 1
+            self.db_time += duration
+            if self.capture_sql and len(self.captured) < MAX_LOGGED_QUERIES:
+                self.captured.append((duration, sql))
+
+    # 接続はスレッドごとのため、非同期の場合はデータベースを操作するスレッドで呼び出す
+    def install(self):
+        for connection in connections.all():
+            self.stack.enter_context(connection.execute_wrapper(self))
+
+    def uninstall(self):
+        self.stack.close()
+
+    def start(self):
+        self.token = current.set(self)
+        self.started = time.perf_counter()
+
+    def stop(self):
+        self.duration = time.perf_counter() - self.started
+        current.reset(self.token)
+
+    def record(self, request, response):
+        match = request.resolver_match
+        view = match.view_name if match is not None else '<unresolved>'
+        labels = (('view', view), ('method', request.method))
+        status = '%dxx' % (response.status_code // 100)
+
+        registry.inc('quisapi_requests_total', (*labels, ('status', status)))
+        registry.observe('quisapi_request_duration_seconds', labels, self.duration, LATENCY_BUCKETS)
+        registry.observe('quisapi_db_queries', labels, self.queries, QUERY_BUCKETS)
+        registry.inc('quisapi_db_duration_seconds_total', labels, self.db_time)
+        registry.inc('quisapi_serialize_duration_seconds_total', labels, self.serialize_time)
+        if not response.streaming:
+            registry.inc('quisapi_response_bytes_total', labels, len(response.content))
+        registry.flush()
+
+        threshold = settings.QUISAPI_SLOW_REQUEST_SECONDS
+        if threshold and self.duration >= threshold:
+            logger.warning(
+                'Slow request: %s %s (%s) %.3fs, %d queries in %.3fs, serialize %.3fs%s',
+                request.method,
+                request.path,
+                view,
+                self.duration,
+                self.queries,
+                self.db_time,
+                self.serialize_time,
+                ''.join('\n  [%.3fs] %s' % (duration, sql) for duration, sql in self.captured),
+            )
+
+
+# ビュー・メソッドごとの計測
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request_metrics = RequestMetrics(bool(settings.QUISAPI_SLOW_REQUEST_SECONDS))
+        request_metrics.install()
+        request_metrics.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            request_metrics.stop()
+            request_metrics.uninstall()
+        request_metrics.record(request, response)
+        return response
+
+    async def __acall__(self, request):
+        request_metrics = RequestMetrics(bool(settings.QUISAPI_SLOW_REQUEST_SECONDS))
+        await sync_to_async(request_metrics.install, thread_sensitive=True)()
+        request_metrics.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_metrics.stop()
+            await sync_to_async(request_metrics.uninstall, thread_sensitive=True)()
+        request_metrics.record(request, response)
+        return response
+
+
+# メトリクスの出力 (Prometheus のテキスト形式)
+# QUISAPI_METRICS_TOKEN が設定されている場合は Bearer トークンを要求する
+def metrics_view(request):
+    token = settings.QUISAPI_METRICS_TOKEN
+    if token and not constant_time_compare(
+        request.headers.get('Authorization', ''),
+        'Bearer %s' % token,
+    ):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        render(registry.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
@@ -7,7 +7,9 @@ from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import PermissionsMixin
 from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.core.mail import send_mail
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models.deletion import Collector
+from django.dispatch import Signal
 from django.utils import timezone
 
 
@@ -135,6 +137,12 @@ class QuisAPIUser(AbstractBaseUser, PermissionsMixin):
         'update date',
         auto_now=True
     )
+    # 署名付きトークンの失効バージョン (進めると発行済みのトークンが全て無効になる)
+    token_version = models.PositiveIntegerField(
+        'token version',
+        default=0,
+        editable=False
+    )
 
     objects = QuisAPIUserManager()
 
@@ -151,6 +159,20 @@ class QuisAPIUser(AbstractBaseUser, PermissionsMixin):
         super().clean()
         self.email = self.__class__.objects.normalize_email(self.email)
 
+    # パスワードの変更を保存した時に発行済みのトークンを失効させる
+    # (set_password() 後の保存だけが対象で、check_password() によるハッシュの更新は変更として扱わない)
+    def save(self, *args, **kwargs):
+        if self._password is not None and not self._state.adding:
+            self.token_version += 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'token_version' not in update_fields:
+                kwargs['update_fields'] = [*update_fields, 'token_version']
+        super().save(*args, **kwargs)
+
+    def revoke_tokens(self):
+        self.token_version += 1
+        self.save(update_fields=['token_version'])
+
     def get_full_name(self):
         """
         Return the first_name plus the last_name, with a space in between.
@@ -178,6 +200,19 @@ class QuizGroup(models.Model):
                 name='quiz_group_name_unique'
             ),
         ]
+        indexes = [
+            # 公開グループの一覧・キーセットページネーション用の部分インデックス
+            models.Index(
+                fields=['quiz_group_name', 'uuid'],
+                name='quiz_group_public_idx',
+                condition=models.Q(scope=True),
+            ),
+            # 自分のグループの一覧用
+            models.Index(
+                fields=['user', 'quiz_group_name', 'uuid'],
+                name='quiz_group_user_name_idx',
+            ),
+        ]
 
     uuid = models.UUIDField(
         default=uuid_lib.uuid4,
@@ -200,6 +235,15 @@ class QuizGroup(models.Model):
     followings = models.IntegerField(
         default=0,
     )
+    # クイズ数 (クイズの作成・削除時に F() で増減する)
+    quiz_count = models.IntegerField(
+        default=0,
+    )
+    # クイズの最終更新日時 (グループにあるクイズの update_date の最大値、クイズが無い場合は None)
+    last_quiz_activity = models.DateTimeField(
+        null=True,
+        blank=True,
+    )
     creation_date = models.DateTimeField(
         default=timezone.now,
     )
@@ -207,12 +251,83 @@ class QuizGroup(models.Model):
         auto_now=True,
     )
 
+    # クイズとその従属する行は件数によらず一定回数のクエリで先に削除する
+    def delete(self, using=None, keep_parents=False):
+        using = using or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            Quiz.objects.using(using).filter(quiz_group=self).delete_all()
+            return super().delete(using=using, keep_parents=keep_parents)
+
+
+# クイズの削除 (クイズ数・キャッシュの反映は signals で受け取る)
+# Quiz に pre_delete / post_delete の受信者があるとクイズグループ・ユーザの削除で全クイズを読み込んで1件ずつ送るため、
+# クイズ自体の削除 (Quiz.delete・QuerySet.delete) でだけ送る
+# counts はクイズグループの uuid ごとの削除件数
+quizzes_deleted = Signal()
+
+
+class QuizQuerySet(models.QuerySet):
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            counts = dict(
+                self.order_by().values_list('quiz_group').annotate(count=models.Count('pk'))
+            )
+            result = super().delete()
+            quizzes_deleted.send(sender=self.model, counts=counts, using=self.db)
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    # クイズグループごと削除する場合の一括削除 (クイズ数・キャッシュは反映しない)
+    # Collector はクイズを読み込んで一定件数ごとに従属する行を削除するため、
+    # 従属する行をクイズの条件のサブクエリで1テーブル1文ずつ削除してから、クイズを1文で削除する
+    # 従属する行にさらに従属する行・シグナルの受信者がある場合は通常の削除にする
+    def delete_all(self):
+        collector = Collector(using=self.db)
+        dependants = [
+            related.related_model._base_manager.using(self.db).filter(**{'%s__in' % related.field.name: self})
+            for related in self.model._meta.related_objects
+        ]
+        if not all(
+            related.on_delete is models.CASCADE
+            for related in self.model._meta.related_objects
+        ) or not all(map(collector.can_fast_delete, dependants)):
+            return super().delete()
+
+        with transaction.atomic(using=self.db):
+            for queryset in dependants:
+                queryset._raw_delete(self.db)
+            self._raw_delete(self.db)
+
+    delete_all.alters_data = True
+    delete_all.queryset_only = True
+
 
 # クイズテーブル
 class Quiz(models.Model):
     class Meta:
         verbose_name = 'Quiz'
         verbose_name_plural = 'Quiz'
+        constraints = [
+            # 抽選用 (グループ内の連番で引く)
+            models.UniqueConstraint(
+                fields=['quiz_group', 'draw_index'],
+                name='quiz_draw_index_unique',
+            ),
+        ]
+        indexes = [
+            # キーセットページネーション用
+            models.Index(
+                fields=['quiz_title', 'uuid'],
+                name='quiz_title_uuid_idx',
+            ),
+            # フィード (フォロー中のグループの新着順) 用
+            models.Index(
+                fields=['quiz_group', 'creation_date'],
+                name='quiz_group_creation_idx',
+            ),
+        ]
 
     uuid = models.UUIDField(
         default=uuid_lib.uuid4,
@@ -229,6 +344,12 @@ class Quiz(models.Model):
     quiz_content = models.CharField(
         max_length=1024,
     )
+    # グループ内の抽選用連番 (削除分は欠番になる)
+    draw_index = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+    )
     creation_date = models.DateTimeField(
         default=timezone.now,
     )
@@ -236,6 +357,23 @@ class Quiz(models.Model):
         auto_now=True,
     )
 
+    objects = QuizQuerySet.as_manager()
+
+    # 抽選用連番の採番 (pre_save のシグナル) から保存までを1トランザクションで行う
+    # 採番時にロックしたクイズグループの行を保存まで保持し、同時に保存された別のクイズと連番が重ならないようにする
+    # (管理サイト・シェルなど、トランザクション外からの保存も対象)
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+
+    def delete(self, using=None, keep_parents=False):
+        using = using or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            result = super().delete(using=using, keep_parents=keep_parents)
+            quizzes_deleted.send(sender=type(self), counts={self.quiz_group_id: 1}, using=using)
+        return result
+
 
 # フォローワーテーブル
 class Follower(models.Model):
@@ -263,3 +401,211 @@ class Follower(models.Model):
         QuizGroup,
         on_delete=models.CASCADE,
     )
+    # フォロー日時 (人気ランキングの集計用)
+    creation_date = models.DateTimeField(
+        default=timezone.now,
+    )
+
+
+# フォロー数カウンタのシャードテーブル
+# 人気グループのフォローが1行のロックに集中しないよう、差分を複数行に分散して記録し
+# 定期的に QuizGroup.followings へ集約する
+class FollowingCounterShard(models.Model):
+    class Meta:
+        verbose_name = 'FollowingCounterShard'
+        verbose_name_plural = 'FollowingCounterShard'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['quiz_group', 'shard'],
+                name='following_counter_shard_unique'
+            ),
+        ]
+
+    quiz_group = models.ForeignKey(
+        QuizGroup,
+        on_delete=models.CASCADE,
+    )
+    shard = models.PositiveSmallIntegerField()
+    delta = models.IntegerField(
+        default=0,
+    )
+
+
+# フィードのタイムラインを事前に作成するユーザ
+# フォローが多いユーザは読み込み時の集約が重いため、クイズの作成時にタイムラインへ書き込む
+class MaterializedFeed(models.Model):
+    class Meta:
+        verbose_name = 'MaterializedFeed'
+        verbose_name_plural = 'MaterializedFeed'
+
+    user = models.OneToOneField(
+        QuisAPIUser,
+        on_delete=models.CASCADE,
+        primary_key=True,
+    )
+    creation_date = models.DateTimeField(
+        default=timezone.now,
+    )
+
+
+# フィードのタイムラインテーブル
+class FeedEntry(models.Model):
+    class Meta:
+        verbose_name = 'FeedEntry'
+        verbose_name_plural = 'FeedEntry'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'quiz'],
+                name='feed_entry_unique'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-creation_date', '-quiz'],
+                name='feed_entry_user_date_idx',
+            ),
+        ]
+
+    user = models.ForeignKey(
+        QuisAPIUser,
+        on_delete=models.CASCADE,
+    )
+    quiz = models.ForeignKey(
+        Quiz,
+        on_delete=models.CASCADE,
+    )
+    quiz_group = models.ForeignKey(
+        QuizGroup,
+        on_delete=models.CASCADE,
+    )
+    # クイズの作成日時の複製 (並び替えをこのテーブルだけで行うため)
+    creation_date = models.DateTimeField()
+
+
+# 検索用ドキュメントテーブル
+# クイズとクイズグループの文字列を正規化して1列にまとめ、トライグラム索引で検索する
+class QuizSearchDocument(models.Model):
+    class Meta:
+        verbose_name = 'QuizSearchDocument'
+        verbose_name_plural = 'QuizSearchDocument'
+
+    quiz = models.OneToOneField(
+        Quiz,
+        on_delete=models.CASCADE,
+        primary_key=True,
+    )
+    document = models.TextField()
+
+
+# 解答履歴テーブル (追記のみ)
+# 行を小さく保つため、主キーは連番、正誤は 0〜5 の評価1列で表す
+class Attempt(models.Model):
+    class Meta:
+        verbose_name = 'Attempt'
+        verbose_name_plural = 'Attempt'
+        indexes = [
+            # ユーザごとの解答履歴用
+            models.Index(
+                fields=['user', 'answered_at'],
+                name='attempt_user_date_idx',
+            ),
+        ]
+
+    user = models.ForeignKey(
+        QuisAPIUser,
+        on_delete=models.CASCADE,
+        db_index=False,
+    )
+    quiz = models.ForeignKey(
+        Quiz,
+        on_delete=models.CASCADE,
+    )
+    # 評価 (0: 全く分からない 〜 5: 完璧、3 以上を正解とする)
+    grade = models.PositiveSmallIntegerField()
+    answered_at = models.DateTimeField(
+        default=timezone.now,
+    )
+
+
+# 復習スケジュールテーブル
+# ユーザ・クイズごとに次の出題日時を保持し、出題対象の取得で解答履歴を集計しない
+class ReviewSchedule(models.Model):
+    class Meta:
+        verbose_name = 'ReviewSchedule'
+        verbose_name_plural = 'ReviewSchedule'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'quiz'],
+                name='review_schedule_unique'
+            ),
+        ]
+        indexes = [
+            # グループ内の出題対象 (次の出題日時順) 用
+            models.Index(
+                fields=['user', 'quiz_group', 'next_due'],
+                name='review_schedule_due_idx',
+            ),
+        ]
+
+    user = models.ForeignKey(
+        QuisAPIUser,
+        on_delete=models.CASCADE,
+        db_index=False,
+    )
+    quiz = models.ForeignKey(
+        Quiz,
+        on_delete=models.CASCADE,
+    )
+    # クイズのグループの複製 (グループ内の出題対象をこのテーブルの索引だけで引くため)
+    quiz_group = models.ForeignKey(
+        QuizGroup,
+        on_delete=models.CASCADE,
+    )
+    # 連続正解数
+    repetitions = models.PositiveSmallIntegerField(
+        default=0,
+    )
+    # 出題間隔 (日)
+    interval = models.PositiveIntegerField(
+        default=0,
+    )
+    # 易しさ係数
+    ease = models.FloatField(
+        default=2.5,
+    )
+    next_due = models.DateTimeField()
+    last_answered_at = models.DateTimeField()
+
+
+# スロットリングの状態テーブル (QUISAPI_THROTTLE_STORE=database の場合に使う)
+# キーごとに GCRA の理論上の次の到着時刻 (UNIX 時刻) だけを保持する
+class ThrottleBucket(models.Model):
+    class Meta:
+        verbose_name = 'ThrottleBucket'
+        verbose_name_plural = 'ThrottleBucket'
+
+    key = models.CharField(
+        max_length=128,
+        primary_key=True,
+    )
+    tat = models.FloatField()
+
+
+# 人気ランキングテーブル
+# refresh_trending コマンドで定期的に作り直し、一覧は順位の索引だけで返す
+class TrendingScore(models.Model):
+    class Meta:
+        verbose_name = 'TrendingScore'
+        verbose_name_plural = 'TrendingScore'
+
+    quiz_group = models.OneToOneField(
+        QuizGroup,
+        on_delete=models.CASCADE,
+        primary_key=True,
+    )
+    # 順位 (1 から)
+    rank = models.PositiveIntegerField(
+        unique=True,
+    )
+    score = models.FloatField()
+    computed_at = models.DateTimeField()
@@ -0,0 +1,244 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage, Page
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from quisapi.visibility import filter_combined
+
+
+# ページネーション
+class StandardResultsSetPagination(PageNumberPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    # 非同期ビュー用
+    # 件数とページの取得だけを非同期で行い、それ以外は PageNumberPagination と同じ
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            number = paginator.validate_number(page_number)
+        except InvalidPage as exc:
+            msg = self.invalid_page_message.format(
+                page_number=page_number, message=str(exc)
+            )
+            raise NotFound(msg)
+
+        bottom = (number - 1) * page_size
+        object_list = [row async for row in queryset[bottom:bottom + page_size]]
+        self.page = Page(object_list, number, paginator)
+        return object_list
+
+
+# キーセット(カーソル)ページネーション
+# (name, uuid) の複合キーで位置を決めるため、COUNT(*) も OFFSET も発行しない
+class KeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    page_size = StandardResultsSetPagination.page_size
+    page_size_query_param = StandardResultsSetPagination.page_size_query_param
+    max_page_size = StandardResultsSetPagination.max_page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.prepare_queryset(queryset, request, view)
+        return self.set_results(list(queryset[:self.page_size + 1]))
+
+    # 非同期ビュー用
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.prepare_queryset(queryset, request, view)
+        return self.set_results([row async for row in queryset[:self.page_size + 1]])
+
+    def prepare_queryset(self, queryset, request, view):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.ordering = tuple(view.keyset_ordering)
+        self.page_size = self.get_page_size(request)
+
+        self.reverse, self.position = self.decode_cursor(request, queryset)
+        if self.position is not None:
+            queryset = self.filter_after(queryset, self.position, self.reverse)
+        if self.reverse:
+            return queryset.order_by(*[
+                field[1:] if field.startswith('-') else '-' + field
+                for field in self.ordering
+            ])
+        return queryset.order_by(*self.ordering)
+
+    # 1件多く取得した結果から、次ページの有無を判定する
+    def set_results(self, results):
+        reverse, position = self.reverse, self.position
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        if reverse:
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.first_position = self.get_position(results[0]) if results else position
+        self.last_position = self.get_position(results[-1]) if results else position
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'previous': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    # 並び順の列名 (降順を表す '-' を除いたもの)
+    def get_field_names(self):
+        return [field.lstrip('-') for field in self.ordering]
+
+    def get_position(self, instance):
+        # values() の行 (dict) にも対応する
+        if isinstance(instance, dict):
+            return [str(instance[field]) for field in self.get_field_names()]
+        return [str(getattr(instance, field)) for field in self.get_field_names()]
+
+    # name > x OR (name = x AND uuid > y) を、先頭列の範囲条件でインデックスを使える形に展開する
+    # 降順の列や前のページへ戻る場合は不等号の向きを逆にする
+    def filter_after(self, queryset, position, reverse):
+        fields = self.get_field_names()
+        ascending = [field.startswith('-') == reverse for field in self.ordering]
+        condition = Q()
+        for i, field in enumerate(fields):
+            lookup = 'gt' if ascending[i] else 'lt'
+            branch = Q(**{'%s__%s' % (field, lookup): position[i]})
+            for prev_field, prev_value in zip(fields[:i], position[:i]):
+                branch &= Q(**{prev_field: prev_value})
+            condition |= branch
+
+        first_lookup = 'gte' if ascending[0] else 'lte'
+        return filter_combined(
+            queryset,
+            Q(**{'%s__%s' % (fields[0], first_lookup): position[0]}),
+            condition,
+        )
+
+    # 並び順の列のフィールド (注釈の列は出力の型、関連先の列は関連先のモデルのフィールド)
+    def get_ordering_fields(self, queryset):
+        query = queryset.query
+        if query.combinator:
+            query = query.combined_queries[0]
+
+        ordering_fields = []
+        for name in self.get_field_names():
+            if name in query.annotations:
+                ordering_fields.append(query.annotations[name].output_field)
+                continue
+            model = queryset.model
+            *relations, field_name = name.split('__')
+            for relation in relations:
+                model = model._meta.get_field(relation).related_model
+            ordering_fields.append(model._meta.get_field(field_name))
+        return ordering_fields
+
+    # カーソルの位置は列の型に変換して検証する (不正な値はクエリの実行時ではなくここで 404 にする)
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return False, None
+
+        try:
+            querystring = base64.urlsafe_b64decode(encoded.encode('ascii'))
+            payload = json.loads(querystring.decode('utf-8'))
+            reverse = bool(payload['r'])
+            values = payload['p']
+            if (
+                not isinstance(values, list)
+                or len(values) != len(self.ordering)
+                or not all(isinstance(value, str) for value in values)
+            ):
+                raise ValueError
+            position = [
+                field.to_python(value)
+                for field, value in zip(self.get_ordering_fields(queryset), values)
+            ]
+        except (TypeError, ValueError, KeyError, UnicodeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return reverse, position
+
+    def encode_cursor(self, reverse, position):
+        position = [str(value) for value in position]
+        payload = json.dumps({'r': int(reverse), 'p': position}, ensure_ascii=False, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(False, self.last_position)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.first_position is None:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(True, self.first_position)
+
+
+# ?cursor= が指定された場合のみキーセットページネーションに切り替える
+class KeysetPaginationMixin:
+    keyset_pagination_class = KeysetPagination
+    keyset_ordering = None
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            request = getattr(self, 'request', None)
+            if (
+                self.keyset_ordering
+                and request is not None
+                and self.keyset_pagination_class.cursor_query_param in request.query_params
+            ):
+                self._paginator = self.keyset_pagination_class()
+            else:
+                self._paginator = super().paginator
+        return self._paginator
@@ -0,0 +1,32 @@
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+# NDJSON (1行1オブジェクトのJSON) パーサ
+# 行ごとに読み込むため、本文全体を1つの文字列として保持しない
+class NDJSONParser(BaseParser):
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return list(self.iter_parse(stream, parser_context))
+
+    def iter_parse(self, stream, parser_context=None):
+        for line_number, data in self.iter_parse_lines(stream, parser_context):
+            yield data
+
+    # (行番号, オブジェクト) を返す
+    def iter_parse_lines(self, stream, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+
+        for line_number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_number, json.loads(line.decode(encoding))
+            except ValueError as exc:
+                raise ParseError('NDJSON parse error on line %d - %s' % (line_number, exc))
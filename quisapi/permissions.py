@@ -0,0 +1,13 @@
+from operator import attrgetter
+
+from rest_framework import permissions
+
+
+# 作成者のみ編集・削除可能
+# get_object() で取得した同じインスタンスで判定するため、追加のクエリを発行しない
+class IsOwnerOrReadOnly(permissions.BasePermission):
+    def has_object_permission(self, request, view, obj):
+        if request.method in permissions.SAFE_METHODS:
+            return True
+
+        return attrgetter(view.owner_field)(obj) == request.user.pk
@@ -0,0 +1,144 @@
+import collections
+import contextlib
+import functools
+import logging
+import re
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('quisapi.query_budget')
+
+# トランザクション制御の文は数えない
+# (テストでは TestCase のトランザクション内でセーブポイントになるなど、環境によって件数が変わるため)
+TRANSACTION_RE = re.compile(r'^\s*(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE)\b', re.IGNORECASE)
+# IN (%s, %s, ...) のプレースホルダの数を揃えて同じ形の SQL としてまとめる
+PLACEHOLDERS_RE = re.compile(r'\(\s*%s(?:\s*,\s*%s)+\s*\)')
+# 報告に載せる重複した SQL の件数
+MAX_REPORTED_DUPLICATES = 10
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def normalize_sql(sql):
+    return PLACEHOLDERS_RE.sub('(%s, ...)', sql)
+
+
+# クエリ数の上限の確認
+# 上限を超えた場合、QUISAPI_QUERY_BUDGET が 'raise' なら例外を送出し (テスト)、
+# 'warn' なら警告をログに出力する (本番)、'off' なら確認しない
+# 同じ形の SQL が複数回実行されていれば (N+1 の可能性) 回数と共に報告する
+# デコレータ・コンテキストマネージャのどちらとしても使える
+class QueryBudget:
+    def __init__(self, max_queries, label=None):
+        self.max_queries = max_queries
+        self.label = label
+
+    # 呼び出しごとに別のインスタンスで数える (スレッド間で共有しないため)
+    def __call__(self, func):
+        label = self.label or '%s.%s' % (func.__module__, func.__qualname__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with QueryBudget(self.max_queries, label):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def execute(self, execute, sql, params, many, context):
+        if not TRANSACTION_RE.match(sql):
+            self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.queries = []
+        self.stack = contextlib.ExitStack()
+        if settings.QUISAPI_QUERY_BUDGET != 'off':
+            for connection in connections.all():
+                self.stack.enter_context(connection.execute_wrapper(self.execute))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stack.close()
+        # 処理中の例外がある場合はそちらを優先する
+        if exc_type is None:
+            self.check()
+        return False
+
+    def report(self):
+        patterns = collections.Counter(normalize_sql(sql) for sql in self.queries)
+        return {
+            'label': self.label,
+            'queries': len(self.queries),
+            'max_queries': self.max_queries,
+            'duplicates': [
+                {'count': count, 'sql': sql}
+                for sql, count in patterns.most_common(MAX_REPORTED_DUPLICATES)
+                if count > 1
+            ],
+        }
+
+    def check(self):
+        if len(self.queries) <= self.max_queries:
+            return
+
+        report = self.report()
+        message = 'Query budget exceeded: %s ran %d queries (max %d)%s' % (
+            self.label,
+            report['queries'],
+            self.max_queries,
+            ''.join(
+                '\n  %d x %s' % (duplicate['count'], duplicate['sql'])
+                for duplicate in report['duplicates']
+            ),
+        )
+        if settings.QUISAPI_QUERY_BUDGET == 'raise':
+            raise QueryBudgetExceeded(message)
+        logger.warning(message, extra={'query_budget': report})
+
+
+# ビューのクエリ数の上限
+# query_budget にアクション (ModelViewSet) またはメソッド名 (小文字) ごとの上限、あるいは全体の上限を指定する
+# 認証・スロットリングは設定 (セッション・ストア) によって件数が変わるため、それらの後から数える
+class QueryBudgetMixin:
+    query_budget = None
+
+    def get_query_budget(self, request):
+        budget = self.query_budget
+        if isinstance(budget, dict):
+            key = getattr(self, 'action', None) or request.method.lower()
+            return budget.get(key)
+        return budget
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        max_queries = self.get_query_budget(request)
+        if max_queries is not None:
+            self._query_budget = QueryBudget(
+                max_queries,
+                label='%s.%s' % (type(self).__name__, getattr(self, 'action', None) or request.method.lower()),
+            )
+            self._query_budget.__enter__()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        query_budget = self.close_query_budget()
+        # エラーのレスポンスは対象にしない
+        if query_budget is not None and response.status_code < 400:
+            query_budget.check()
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    # 処理されない例外 (500) では finalize_response が呼ばれないため、ここで必ず外す
+    # (外さないと接続に execute_wrapper が残り、以降のリクエストでも数え続ける)
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            self.close_query_budget()
+
+    def close_query_budget(self):
+        query_budget = getattr(self, '_query_budget', None)
+        if query_budget is not None:
+            self._query_budget = None
+            query_budget.stack.close()
+        return query_budget
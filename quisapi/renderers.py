@@ -0,0 +1,43 @@
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.renderers import JSONRenderer
+
+from quisapi.metrics import measure_serialize
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# orjson を使う高速な JSON レンダラ
+# 出力は JSONRenderer (コンパクト・非ASCIIをエスケープしない) とバイト単位で一致させる
+# orjson が無い場合や、インデント指定・非厳密モードでは JSONRenderer にそのまま任せる
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with measure_serialize():
+            return self._render(data, accepted_media_type, renderer_context)
+
+    def _render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or data is None
+            or self.ensure_ascii
+            or not self.compact
+            or not self.strict
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data,
+                default=JSONEncoder().default,
+                # 日時は JSONEncoder と同じ形式で出力するため default に渡す
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+            )
+        except TypeError:
+            # orjson が扱えない値 (64bitを超える整数など) は標準の実装で出力する
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # JSONRenderer と同様に U+2028 / U+2029 をエスケープする
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
@@ -0,0 +1,123 @@
+import datetime
+
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from quisapi.models import Quiz, Attempt, ReviewSchedule
+
+BATCH_SIZE = 500
+# 正解とみなす評価の下限
+PASSING_GRADE = 3
+MIN_EASE = 1.3
+
+
+# SM-2 方式で次の出題日時を計算する
+def schedule(review, grade, answered_at):
+    if grade < PASSING_GRADE:
+        review.repetitions = 0
+        review.interval = 1
+    else:
+        review.repetitions += 1
+        if review.repetitions == 1:
+            review.interval = 1
+        elif review.repetitions == 2:
+            review.interval = 6
+        else:
+            review.interval = round(review.interval * review.ease)
+
+    review.ease = max(
+        MIN_EASE,
+        review.ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02),
+    )
+    review.last_answered_at = answered_at
+    review.next_due = answered_at + datetime.timedelta(days=review.interval)
+
+
+# 解答をまとめて記録し、復習スケジュールを更新する
+# 解答履歴は追記のみ、スケジュールは対象のクイズ分だけ1回の UPSERT で書き込む
+def record_attempts(user, attempts):
+    now = timezone.now()
+    attempts = [
+        Attempt(
+            user=user,
+            quiz_id=attrs['quiz_id'],
+            grade=attrs['grade'],
+            answered_at=attrs.get('answered_at') or now,
+        )
+        for attrs in attempts
+    ]
+    Attempt.objects.bulk_create(attempts, batch_size=BATCH_SIZE)
+
+    quiz_pks = {attempt.quiz_id for attempt in attempts}
+    quiz_groups = dict(
+        Quiz.objects.filter(
+            uuid__in=quiz_pks,
+        ).values_list(
+            'uuid',
+            'quiz_group_id',
+        )
+    )
+    reviews = {
+        review.quiz_id: review
+        for review in ReviewSchedule.objects.select_for_update().filter(
+            user=user,
+            quiz__in=quiz_pks,
+        )
+    }
+
+    for attempt in sorted(attempts, key=lambda attempt: attempt.answered_at):
+        review = reviews.get(attempt.quiz_id)
+        if review is None:
+            review = reviews[attempt.quiz_id] = ReviewSchedule(
+                user=user,
+                quiz_id=attempt.quiz_id,
+            )
+        elif review.last_answered_at >= attempt.answered_at:
+            # 記録済みの解答より古い解答は履歴にだけ残す
+            continue
+        review.quiz_group_id = quiz_groups[attempt.quiz_id]
+        schedule(review, attempt.grade, attempt.answered_at)
+
+    ReviewSchedule.objects.bulk_create(
+        reviews.values(),
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['user', 'quiz'],
+        update_fields=['quiz_group', 'repetitions', 'interval', 'ease', 'next_due', 'last_answered_at'],
+    )
+    return attempts
+
+
+# グループ内で次に出題するクイズ
+# 出題日時を過ぎたクイズを古い順に、足りなければ未解答のクイズを作成順に加える
+def due(queryset, user, quiz_group, n, now=None):
+    if now is None:
+        now = timezone.now()
+
+    rows = list(
+        queryset.filter(
+            reviewschedule__user=user,
+            reviewschedule__quiz_group=quiz_group,
+            reviewschedule__next_due__lte=now,
+        ).order_by(
+            'reviewschedule__next_due',
+            'uuid',
+        )[:n]
+    )
+    if len(rows) < n:
+        rows.extend(
+            queryset.filter(
+                quiz_group=quiz_group,
+            ).exclude(
+                Exists(
+                    ReviewSchedule.objects.filter(
+                        user=user,
+                        quiz=OuterRef('pk'),
+                    )
+                ),
+            ).order_by(
+                'creation_date',
+                'uuid',
+            )[:n - len(rows)]
+        )
+    return rows
@@ -0,0 +1,161 @@
+import contextvars
+import logging
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from quisapi.authentication import get_token_user_pk, is_token_request
+
+logger = logging.getLogger(__name__)
+
+# 書き込み後、一定時間はプライマリから読むための Cookie
+PIN_COOKIE = 'quisapi_primary'
+# Cookie を保持しないトークン認証のクライアント向けに、ユーザごとに同じ印をキャッシュに置くキー
+PIN_KEY_PREFIX = 'quisapi:primary'
+# レプリカの死活を確認する間隔 (秒)
+HEALTH_CHECK_INTERVAL = 5
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# 処理中のリクエストでレプリカから読んでよいか (リクエスト外では常にプライマリ)
+use_replica = contextvars.ContextVar('quisapi_use_replica', default=False)
+
+
+# レプリカの死活の記録 (プロセス内)
+# 確認は間隔ごとに1回だけ行い、接続できなかったレプリカは次の確認まで使わない
+class ReplicaHealth:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked_at = {}
+        self.healthy = {}
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        with self.lock:
+            if now - self.checked_at.get(alias, -HEALTH_CHECK_INTERVAL) < HEALTH_CHECK_INTERVAL:
+                # 他のスレッドが確認中の場合は使えるものとして扱う
+                return self.healthy.get(alias, True)
+            self.checked_at[alias] = now
+
+        connection = connections[alias]
+        try:
+            connection.ensure_connection()
+            healthy = connection.is_usable()
+        except DatabaseError:
+            healthy = False
+        if not healthy:
+            logger.warning('Database replica %s is unavailable, reading from the primary.', alias)
+            connection.close()
+        with self.lock:
+            self.healthy[alias] = healthy
+        return healthy
+
+
+health = ReplicaHealth()
+
+
+def get_replicas():
+    return [alias for alias in settings.QUISAPI_DB_REPLICAS if health.is_healthy(alias)]
+
+
+# 読み取りをレプリカに振り分けるルータ
+# 次の場合はプライマリ (default) から読む
+# - リクエスト外 (管理コマンドなど)・安全でないメソッドのリクエスト
+# - 書き込みの直後 (PIN_COOKIE が付いている間)
+# - プライマリのトランザクション内 (transaction.atomic)
+# - 使えるレプリカが無い場合
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not settings.QUISAPI_DB_REPLICAS or not use_replica.get():
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+
+        replicas = get_replicas()
+        if not replicas:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    # プライマリとレプリカは同じデータのため、相互の関連を許可する
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.QUISAPI_DB_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+def pin_key(user_pk):
+    return '%s:%s' % (PIN_KEY_PREFIX, user_pk)
+
+
+# リクエストごとに読み取り先を決める
+# 安全でないメソッドのリクエストの後は QUISAPI_DB_REPLICA_STICKY_SECONDS 秒だけ Cookie を付け、
+# その間は自分の書き込みを読めるようプライマリから読む
+# トークン認証のリクエストでは Cookie の代わりにユーザごとのキャッシュのキーで判定する
+# (トークンのユーザは署名の検証だけで分かるため、認証の前に判定できる)
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = use_replica.set(self.can_use_replica(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            use_replica.reset(token)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        token = use_replica.set(self.can_use_replica(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            use_replica.reset(token)
+        return self.process_response(request, response)
+
+    def can_use_replica(self, request):
+        if (
+            not settings.QUISAPI_DB_REPLICAS
+            or request.method not in SAFE_METHODS
+            or PIN_COOKIE in request.COOKIES
+        ):
+            return False
+        if is_token_request(request):
+            user_pk = get_token_user_pk(request)
+            if user_pk is not None and caches[settings.QUISAPI_DB_REPLICA_PIN_CACHE_ALIAS].get(pin_key(user_pk)):
+                return False
+        return True
+
+    def process_response(self, request, response):
+        if settings.QUISAPI_DB_REPLICAS and request.method not in SAFE_METHODS:
+            response.set_cookie(
+                PIN_COOKIE,
+                '1',
+                max_age=settings.QUISAPI_DB_REPLICA_STICKY_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+            if is_token_request(request):
+                user_pk = get_token_user_pk(request)
+                if user_pk is not None:
+                    caches[settings.QUISAPI_DB_REPLICA_PIN_CACHE_ALIAS].set(
+                        pin_key(user_pk),
+                        1,
+                        timeout=settings.QUISAPI_DB_REPLICA_STICKY_SECONDS,
+                    )
+        return response
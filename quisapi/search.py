@@ -0,0 +1,156 @@
+import logging
+import unicodedata
+
+from django.conf import settings
+from django.db import connection, DatabaseError
+from django.db.models import ExpressionWrapper, FloatField, Func, Q, Value
+from django.db.models.functions import Coalesce, StrIndex
+
+from quisapi.models import Quiz, QuizSearchDocument
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+TRIGRAM_INDEX_NAME = 'quiz_search_document_trgm_idx'
+BIGRAM_INDEX_NAME = 'quiz_search_document_bigm_idx'
+
+
+# pg_bigm による類似度
+class BigmSimilarity(Func):
+    function = 'bigm_similarity'
+    output_field = FloatField()
+
+
+# 検索用に文字列を正規化する
+# 全角・半角の英数字やカタカナの揺れを NFKC で吸収し、大文字小文字を区別しない
+def normalize(text):
+    return unicodedata.normalize('NFKC', text or '').casefold()
+
+
+def build_document(quiz, quiz_group):
+    return '\n'.join(
+        normalize(text)
+        for text in (
+            quiz.quiz_title,
+            quiz.quiz_content,
+            quiz_group.quiz_group_name,
+            quiz_group.quiz_group_description,
+        )
+    )
+
+
+# 検索用ドキュメントを作成・更新する (1回の UPSERT)
+def index_quizzes(quizzes, quiz_group):
+    QuizSearchDocument.objects.bulk_create(
+        [
+            QuizSearchDocument(
+                quiz_id=quiz.pk,
+                document=build_document(quiz, quiz_group),
+            )
+            for quiz in quizzes
+        ],
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['quiz'],
+        update_fields=['document'],
+    )
+
+
+# ドキュメントに含めるクイズグループの文字列
+# (only() で遅延読み込みになっている列は変更がないものとして扱う)
+def get_quiz_group_text(quiz_group):
+    deferred = quiz_group.get_deferred_fields()
+    return tuple(
+        None if field in deferred else getattr(quiz_group, field)
+        for field in ('quiz_group_name', 'quiz_group_description')
+    )
+
+
+# クイズグループ名・説明の変更時に、グループ内のクイズのドキュメントを作り直す
+def index_quiz_group(quiz_group):
+    quizzes = Quiz.objects.filter(
+        quiz_group=quiz_group,
+    ).only(
+        'uuid',
+        'quiz_title',
+        'quiz_content',
+    ).iterator(chunk_size=BATCH_SIZE)
+
+    batch = []
+    for quiz in quizzes:
+        batch.append(quiz)
+        if len(batch) >= BATCH_SIZE:
+            index_quizzes(batch, quiz_group)
+            batch = []
+    if batch:
+        index_quizzes(batch, quiz_group)
+
+
+# 検索語に分割する
+def split_terms(query):
+    return [term for term in normalize(query).split() if term]
+
+
+# 検索条件と順位を付けたクエリセット
+# PostgreSQL では n-gram の索引で LIKE を絞り込む (QUISAPI_SEARCH_NGRAM)
+# - 'trigram': pg_trgm の索引で絞り込み、word_similarity で順位を付ける
+#   3文字未満の語 (漢字2文字の語など) は索引を使えず、全件の走査になる
+# - 'bigram': pg_bigm の索引で絞り込み、bigm_similarity で順位を付ける (1〜2文字の語も索引を使える)
+# それ以外 (SQLite) では LIKE で絞り込み、語がドキュメントの先頭 (タイトル) に近いほど上位にする
+def search(queryset, query):
+    terms = split_terms(query)
+
+    condition = Q()
+    for term in terms:
+        condition &= Q(quizsearchdocument__document__contains=term)
+
+    if connection.vendor == 'postgresql' and settings.QUISAPI_SEARCH_NGRAM == 'bigram':
+        rank = BigmSimilarity(Value(' '.join(terms)), 'quizsearchdocument__document')
+    elif connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramWordSimilarity
+
+        rank = TrigramWordSimilarity(' '.join(terms), 'quizsearchdocument__document')
+    else:
+        rank = sum(
+            (
+                ExpressionWrapper(
+                    Value(1.0) / StrIndex('quizsearchdocument__document', Value(term)),
+                    output_field=FloatField(),
+                )
+                for term in terms
+            ),
+            Value(0.0),
+        )
+
+    queryset = queryset.filter(condition).annotate(
+        rank=Coalesce(rank, Value(0.0), output_field=FloatField()),
+    )
+    if not terms:
+        return queryset.none()
+    return queryset
+
+
+# n-gram の索引の作成 (PostgreSQL のみ、QUISAPI_SEARCH_NGRAM の拡張を使う)
+# マイグレーションをリポジトリに含めていないため、migrate 後に作成する
+def create_trigram_index(using='default', **kwargs):
+    from django.db import connections
+
+    db = connections[using]
+    if db.vendor != 'postgresql':
+        return
+
+    if settings.QUISAPI_SEARCH_NGRAM == 'bigram':
+        extension, index_name, opclass = 'pg_bigm', BIGRAM_INDEX_NAME, 'gin_bigm_ops'
+    else:
+        extension, index_name, opclass = 'pg_trgm', TRIGRAM_INDEX_NAME, 'gin_trgm_ops'
+
+    table = QuizSearchDocument._meta.db_table
+    try:
+        with db.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS %s' % extension)
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS %s ON %s USING gin (document %s)'
+                % (db.ops.quote_name(index_name), db.ops.quote_name(table), opclass)
+            )
+    except DatabaseError:
+        logger.warning('Could not create the %s index for quiz search.', extension, exc_info=True)
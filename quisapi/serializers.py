@@ -1,14 +1,28 @@
+import functools
+
+from django.contrib.auth import authenticate
+from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.validators import UniqueTogetherValidator
 
-from quisapi.models import QuizGroup, Quiz, Follower
+from quisapi import draw, review
+from quisapi.models import QuizGroup, Quiz, Follower, Attempt
+from quisapi.visibility import quiz_branches
 
 
 # QuizGroupCRUD用シリアライザ
 class QuizGroupSerializer(serializers.ModelSerializer):
     class Meta:
         model = QuizGroup
-        fields = ['user', 'quiz_group_name', 'quiz_group_description', 'followings', 'scope']
+        fields = [
+            'user',
+            'quiz_group_name',
+            'quiz_group_description',
+            'followings',
+            'scope',
+            'quiz_count',
+            'last_quiz_activity',
+        ]
         validators = [
             UniqueTogetherValidator(
                 queryset=QuizGroup.objects.all(),
@@ -21,6 +35,15 @@ class QuizGroupSerializer(serializers.ModelSerializer):
                 'read_only': True,
             },
         }
+        read_only_fields = ['quiz_count', 'last_quiz_activity']
+
+    # 変更された列だけを保存する
+    # (フォロー数・クイズ数は F() で更新されるため、読み込み時の値で上書きしない)
+    def update(self, instance, validated_data):
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(update_fields=[*validated_data, 'update_date'])
+        return instance
 
 
 # QuizCRUD用シリアライザ
@@ -43,12 +66,273 @@ class FollowerSerializer(serializers.ModelSerializer):
             ),
         ]
 
+    # 作成者の判定は外部キーの値で行う (クイズグループの作成者を取得しない)
     def validate(self, data):
         user = data.get('user')
-        authors = data.get('quiz_group').user
+        author_id = data.get('quiz_group').user_id
 
-        if user == authors:
+        if user is not None and user.pk == author_id:
             raise serializers.ValidationError(
                 'The creator himself cannot be followed'
             )
         return data
+
+
+# FeedView用シリアライザ
+class FeedSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Quiz
+        fields = ['uuid', 'quiz_group', 'quiz_title', 'quiz_content', 'creation_date']
+        read_only_fields = fields
+
+
+# SearchView用シリアライザ
+class SearchSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Quiz
+        fields = ['uuid', 'quiz_group', 'quiz_title', 'quiz_content']
+        read_only_fields = fields
+
+
+# 出題用シリアライザ (抽選・復習)
+class PracticeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Quiz
+        fields = ['uuid', 'quiz_group', 'quiz_title', 'quiz_content']
+        read_only_fields = fields
+
+
+# クイズの抽選のクエリパラメータ
+class DrawQuerySerializer(serializers.Serializer):
+    default_items = 20
+    max_items = 100
+
+    n = serializers.IntegerField(
+        min_value=1,
+        max_value=max_items,
+    )
+    exclude = serializers.ListField(
+        child=serializers.UUIDField(),
+    )
+
+
+# フォローの一括登録・解除、フォロー状態の取得用シリアライザ
+class FollowBatchSerializer(serializers.Serializer):
+    max_items = 100
+
+    quiz_groups = serializers.ListField(
+        child=serializers.UUIDField(),
+        allow_empty=False,
+        max_length=max_items,
+    )
+
+
+# TrendingView用シリアライザ
+class TrendingSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = QuizGroup
+        fields = [
+            'uuid',
+            'user',
+            'quiz_group_name',
+            'quiz_group_description',
+            'followings',
+            'quiz_count',
+            'last_quiz_activity',
+        ]
+        read_only_fields = fields
+
+
+# エクスポート・インポート用シリアライザ
+# uuid はエクスポート元の値 (インポート時はグループとクイズの対応付けにのみ使う)
+class QuizGroupTransferSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = QuizGroup
+        fields = ['uuid', 'quiz_group_name', 'quiz_group_description', 'scope', 'creation_date']
+        # 一意性は書き込み時にまとめて確認する
+        validators = []
+
+
+class QuizTransferSerializer(serializers.ModelSerializer):
+    quiz_group = serializers.UUIDField(
+        source='quiz_group_id',
+    )
+
+    class Meta:
+        model = Quiz
+        fields = ['uuid', 'quiz_group', 'quiz_title', 'quiz_content', 'creation_date']
+
+
+# クイズ一括操作用リストシリアライザ
+# 1件ずつ save() せず bulk_create / bulk_update でまとめて書き込む
+class QuizBulkListSerializer(serializers.ListSerializer):
+    batch_size = 500
+
+    def run_child_validation(self, data):
+        if self.instance is not None:
+            try:
+                uuid = self.child.fields['uuid'].run_validation(data['uuid'])
+                self.child.instance = self.instance[uuid]
+            except serializers.ValidationError as exc:
+                raise serializers.ValidationError({
+                    'uuid': exc.detail,
+                })
+            except (KeyError, TypeError):
+                raise serializers.ValidationError({
+                    'uuid': ['Not found.'],
+                })
+            self.child.initial_data = data
+        return super().run_child_validation(data)
+
+    def create(self, validated_data):
+        quiz_group = self.context['quiz_group']
+        quizzes = []
+        for attrs in validated_data:
+            attrs.pop('uuid', None)
+            quizzes.append(Quiz(quiz_group=quiz_group, **attrs))
+
+        draw.assign_draw_indexes(quiz_group.pk, quizzes)
+        return Quiz.objects.bulk_create(quizzes, batch_size=self.batch_size)
+
+    def update(self, instance, validated_data):
+        now = timezone.now()
+        fields = {'update_date'}
+        quizzes = []
+        for attrs in validated_data:
+            quiz = instance[attrs.pop('uuid')]
+            for attr, value in attrs.items():
+                setattr(quiz, attr, value)
+                fields.add(attr)
+            quiz.update_date = now
+            quizzes.append(quiz)
+
+        Quiz.objects.bulk_update(quizzes, fields=sorted(fields), batch_size=self.batch_size)
+        return quizzes
+
+
+# QuizGroupCRUD のクイズ一括操作用シリアライザ
+class QuizBulkSerializer(serializers.ModelSerializer):
+    uuid = serializers.UUIDField(
+        required=False,
+    )
+
+    class Meta:
+        model = Quiz
+        fields = ['uuid', 'quiz_title', 'quiz_content']
+        list_serializer_class = QuizBulkListSerializer
+
+
+# 解答一括記録用リストシリアライザ
+# 閲覧できないクイズへの解答は、1回のクエリでまとめて確認する
+class AttemptListSerializer(serializers.ListSerializer):
+    def validate(self, attrs):
+        quiz_pks = {item['quiz_id'] for item in attrs}
+        first, *rest = quiz_branches(self.context['request'].user)
+        for branch in rest:
+            first = first | branch
+        found = set(first.filter(uuid__in=quiz_pks).values_list('uuid', flat=True))
+
+        errors = {
+            index: {'quiz': ['Not found.']}
+            for index, item in enumerate(attrs)
+            if item['quiz_id'] not in found
+        }
+        if errors:
+            raise serializers.ValidationError(errors)
+        return attrs
+
+    def create(self, validated_data):
+        return review.record_attempts(self.context['request'].user, validated_data)
+
+
+# AttemptView用シリアライザ
+class AttemptSerializer(serializers.ModelSerializer):
+    quiz = serializers.UUIDField(
+        source='quiz_id',
+    )
+    answered_at = serializers.DateTimeField(
+        required=False,
+    )
+
+    class Meta:
+        model = Attempt
+        fields = ['quiz', 'grade', 'answered_at']
+        list_serializer_class = AttemptListSerializer
+        extra_kwargs = {
+            'grade': {
+                'max_value': 5,
+            },
+        }
+
+    def validate_answered_at(self, value):
+        if value > timezone.now():
+            raise serializers.ValidationError('Ensure this value is not in the future.')
+        return value
+
+
+# 復習対象の取得のクエリパラメータ
+class DueQuerySerializer(serializers.Serializer):
+    default_items = 20
+    max_items = 100
+
+    n = serializers.IntegerField(
+        min_value=1,
+        max_value=max_items,
+    )
+
+
+# DBから取得した値をそのまま出力できるフィールド
+PASSTHROUGH_FIELDS = (
+    serializers.BooleanField,
+    serializers.CharField,
+    serializers.IntegerField,
+    serializers.UUIDField,
+    serializers.PrimaryKeyRelatedField,
+)
+
+
+# 一覧表示用の読み取り専用シリアライザを生成する
+# ModelSerializer と同じ出力を、モデルインスタンスやフィールドオブジェクトを作らずに
+# values() の行から直接組み立てる関数としてあらかじめコンパイルしておく
+# 返り値は (取得する列, 行を dict に変換する関数)
+@functools.lru_cache(maxsize=None)
+def compile_values_serializer(serializer_class):
+    serializer = serializer_class()
+    model = serializer_class.Meta.model
+    columns = []
+    namespace = {}
+    items = []
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+
+        column = model._meta.get_field(field.source).attname
+        columns.append(column)
+        value = 'row[%r]' % column
+        if isinstance(field, PASSTHROUGH_FIELDS) and getattr(field, 'pk_field', None) is None:
+            items.append('%r: %s' % (name, value))
+        else:
+            converter = '_to_representation_%d' % len(namespace)
+            namespace[converter] = field.to_representation
+            items.append('%r: None if %s is None else %s(%s)' % (name, value, converter, value))
+
+    source = 'def serialize(row):\n    return {%s}\n' % ', '.join(items)
+    exec(compile(source, '<%s>' % serializer_class.__name__, 'exec'), namespace)
+    return columns, namespace['serialize']
+
+
+# TokenView用シリアライザ
+class TokenObtainSerializer(serializers.Serializer):
+    username = serializers.CharField()
+    password = serializers.CharField(trim_whitespace=False, write_only=True)
+
+    def validate(self, data):
+        user = authenticate(
+            self.context.get('request'),
+            username=data['username'],
+            password=data['password'],
+        )
+        if user is None:
+            raise serializers.ValidationError('Unable to log in with provided credentials.')
+        data['user'] = user
+        return data
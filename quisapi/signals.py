@@ -0,0 +1,156 @@
+from django.contrib.auth.models import Group
+from django.db.models import QuerySet
+from django.db.models.signals import post_init, pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from quisapi import backends, cache, draw, feed, search
+from quisapi.counters import add_quizzes, remove_quizzes
+from quisapi.models import QuisAPIUser, QuizGroup, Quiz, Follower, ReviewSchedule, quizzes_deleted
+
+
+# レスポンスキャッシュの無効化
+@receiver(post_save, sender=QuizGroup)
+@receiver(post_delete, sender=QuizGroup)
+def invalidate_quiz_group_cache(sender, instance, **kwargs):
+    cache.invalidate_quiz_group(instance.pk)
+
+
+# クイズの削除は quizzes_deleted で反映する (uncount_quizzes)
+@receiver(post_save, sender=Quiz)
+def invalidate_quiz_cache(sender, instance, **kwargs):
+    cache.invalidate_quiz(instance.quiz_group_id, instance.pk)
+
+
+# クイズグループの削除に伴うカスケード削除は、クイズグループ自体の無効化で足りる
+@receiver(post_save, sender=Follower)
+@receiver(post_delete, sender=Follower)
+def invalidate_follower_cache(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, QuizGroup) or (isinstance(origin, QuerySet) and origin.model is QuizGroup):
+        return
+    cache.invalidate_followings(instance.quiz_group_id)
+
+
+# 認証のキャッシュの無効化 (パスワードの変更も保存で反映される)
+@receiver(post_save, sender=QuisAPIUser)
+@receiver(post_delete, sender=QuisAPIUser)
+def invalidate_user_cache(sender, instance, **kwargs):
+    backends.invalidate_user(instance.pk)
+
+
+@receiver(m2m_changed, sender=QuisAPIUser.groups.through)
+@receiver(m2m_changed, sender=QuisAPIUser.user_permissions.through)
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_permission_cache(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        backends.invalidate_permissions()
+
+
+@receiver(post_delete, sender=Group)
+def invalidate_group_permission_cache(sender, instance, **kwargs):
+    backends.invalidate_permissions()
+
+
+# フィードのタイムラインへの配信
+# (loaddata などの raw の保存では配信しない)
+@receiver(post_save, sender=Quiz)
+def fan_out_quiz(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        feed.fan_out(instance.quiz_group_id, [instance])
+
+
+# 検索用ドキュメントの更新 (loaddata などの raw の保存では更新しない)
+# クイズグループは読み込み済み (作成・更新の API) ならそれを使い、無ければ必要な列だけを取得する
+@receiver(post_save, sender=Quiz)
+def index_quiz(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    if Quiz.quiz_group.is_cached(instance):
+        quiz_group = instance.quiz_group
+    else:
+        quiz_group = QuizGroup.objects.only(
+            'quiz_group_name',
+            'quiz_group_description',
+        ).get(
+            pk=instance.quiz_group_id,
+        )
+    search.index_quizzes([instance], quiz_group)
+
+
+# クイズグループ名・説明の変更を検出するため、読み込み時の値を保持する
+@receiver(post_init, sender=QuizGroup)
+def remember_quiz_group_text(sender, instance, **kwargs):
+    instance._search_text = search.get_quiz_group_text(instance)
+
+
+@receiver(post_save, sender=QuizGroup)
+def index_quiz_group(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    text = search.get_quiz_group_text(instance)
+    if not created and text != instance._search_text:
+        search.index_quiz_group(instance)
+    instance._search_text = text
+
+
+# クイズの移動を検出するため、読み込み時のクイズグループを保持する
+@receiver(post_init, sender=Quiz)
+def remember_quiz_group(sender, instance, **kwargs):
+    # only() で遅延読み込みにしている場合は読み込まない
+    instance._original_quiz_group_id = instance.__dict__.get('quiz_group_id')
+
+
+def is_moved(instance):
+    return (
+        instance._original_quiz_group_id is not None
+        and instance.quiz_group_id != instance._original_quiz_group_id
+    )
+
+
+# 抽選用連番の採番
+# 作成時と、別のクイズグループへ移動した時に新しいグループで採番する
+@receiver(pre_save, sender=Quiz)
+def assign_draw_index(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    if instance._state.adding or is_moved(instance):
+        draw.assign_draw_indexes(instance.quiz_group_id, [instance])
+
+
+# 移動したクイズの復習スケジュールを新しいグループに付け替える
+@receiver(post_save, sender=Quiz)
+def move_review_schedules(sender, instance, created, **kwargs):
+    if not created and is_moved(instance):
+        ReviewSchedule.objects.filter(
+            quiz=instance,
+        ).update(
+            quiz_group_id=instance.quiz_group_id,
+        )
+
+
+# クイズ数・クイズの最終更新日時の更新
+@receiver(post_save, sender=Quiz)
+def count_quiz(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    if created:
+        add_quizzes(instance.quiz_group_id, 1, instance.update_date)
+    elif is_moved(instance):
+        remove_quizzes(instance._original_quiz_group_id, 1)
+        add_quizzes(instance.quiz_group_id, 1, instance.update_date)
+    else:
+        add_quizzes(instance.quiz_group_id, 0, instance.update_date)
+
+
+# 削除はクイズグループごとにまとめて反映する
+# クイズグループ・ユーザの削除に伴うカスケード削除ではグループごと消えるため送られない (更新も不要)
+@receiver(quizzes_deleted, sender=Quiz)
+def uncount_quizzes(sender, counts, **kwargs):
+    for quiz_group_pk, count in counts.items():
+        remove_quizzes(quiz_group_pk, count)
+        cache.invalidate_quiz(quiz_group_pk)
+
+
+# 読み込み時のクイズグループを保存後の値にする (クイズの post_save の最後に登録する)
+@receiver(post_save, sender=Quiz)
+def reset_original_quiz_group(sender, instance, **kwargs):
+    instance._original_quiz_group_id = instance.quiz_group_id
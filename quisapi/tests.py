@@ -1,3 +1,1823 @@
-from django.test import TestCase
+import base64
+import datetime
+import json
+import random
+import tempfile
+import time
+import uuid
+from collections import Counter, OrderedDict
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission
+from django.core import serializers
+from django.core.cache import caches
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient, APITestCase
+
+from quisapi import backends, cache, counters, draw, metrics, review, routers, throttling, transfer, trending
+from quisapi.authentication import issue_token
+from quisapi.backends import CachedModelBackend
+from quisapi.models import (
+    QuisAPIUser, QuizGroup, Quiz, Follower, Attempt, ReviewSchedule, ThrottleBucket, FollowingCounterShard,
+    MaterializedFeed, FeedEntry, QuizSearchDocument, TrendingScore,
+)
+from quisapi.parsers import NDJSONParser
+from quisapi.querybudget import QueryBudget, QueryBudgetExceeded
+from quisapi.renderers import FastJSONRenderer
+from quisapi.serializers import (
+    QuizGroupSerializer,
+    QuizSerializer,
+    FeedSerializer,
+    SearchSerializer,
+    TrendingSerializer,
+    PracticeSerializer,
+    compile_values_serializer,
+)
+from quisapi.views import QuizGroupCRUD
+
+
+def create_user(username):
+    return QuisAPIUser.objects.create_user(username, '%s@example.com' % username, 'password')
+
+
+def encode_cursor(position, reverse=False):
+    payload = json.dumps({'r': int(reverse), 'p': position})
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+# テストの基底クラス
+# レスポンスキャッシュは無効にし (TestCase ではコミット後の無効化が実行されないため)、
+# スロットリングはプロセス内のストアで数え (クエリ数にスロットリングの書き込みを含めないため)、状態はテストごとに作り直す
+# クエリ数の上限 (query_budget) は manage.py test では超えると例外になる
+@override_settings(
+    QUISAPI_RESPONSE_CACHE_TIMEOUT=0,
+    QUISAPI_THROTTLE_STORE='local',
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class QuisAPITestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        throttling._stores.clear()
+
+    def walk(self, url):
+        names = []
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            data = response.json()
+            pages.append(data)
+            names.extend(row['quiz_group_name'] for row in data['results'])
+            url = data['next']
+        return names, pages
+
+
+# ページ番号とキーセットのページネーション、UNION ALL による閲覧範囲
+class PaginationTests(QuisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        for i in range(8):
+            QuizGroup.objects.create(user=self.alice, quiz_group_name='alice-public-%02d' % i, scope=True)
+        for i in range(4):
+            QuizGroup.objects.create(user=self.alice, quiz_group_name='alice-private-%02d' % i, scope=False)
+        for i in range(5):
+            QuizGroup.objects.create(user=self.bob, quiz_group_name='bob-private-%02d' % i, scope=False)
+        for i in range(3):
+            QuizGroup.objects.create(user=self.bob, quiz_group_name='bob-public-%02d' % i, scope=True)
+
+    def visible_names(self, user):
+        groups = QuizGroup.objects.filter(scope=True) | QuizGroup.objects.filter(user=user)
+        return list(groups.order_by('quiz_group_name', 'uuid').values_list('quiz_group_name', flat=True))
+
+    def test_keyset_matches_page_number(self):
+        self.client.force_authenticate(self.bob)
+        expected = self.visible_names(self.bob)
+
+        page_names, _ = self.walk('/quisapi/quiz-group/?page_size=5')
+        keyset_names, pages = self.walk('/quisapi/quiz-group/?page_size=5&cursor=')
+
+        self.assertEqual(page_names, expected)
+        self.assertEqual(keyset_names, expected)
+        self.assertEqual(len(pages), 4)
+        self.assertIsNone(pages[0]['previous'])
+
+    def test_keyset_previous_links(self):
+        self.client.force_authenticate(self.bob)
+        _, pages = self.walk('/quisapi/quiz-group/?page_size=5&cursor=')
+
+        url = pages[-1]['previous']
+        for page in reversed(pages[:-1]):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['results'], page['results'])
+            url = response.json()['previous']
+        self.assertIsNone(url)
+
+    def test_anonymous_sees_only_public(self):
+        expected = list(
+            QuizGroup.objects.filter(scope=True).order_by('quiz_group_name', 'uuid').values_list(
+                'quiz_group_name',
+                flat=True,
+            )
+        )
+        page_names, _ = self.walk('/quisapi/quiz-group/?page_size=4')
+        keyset_names, _ = self.walk('/quisapi/quiz-group/?page_size=4&cursor=')
+
+        self.assertEqual(page_names, expected)
+        self.assertEqual(keyset_names, expected)
+
+    def test_owner_sees_own_private_groups(self):
+        self.client.force_authenticate(self.alice)
+        names, _ = self.walk('/quisapi/quiz-group/?page_size=6&cursor=')
+
+        self.assertEqual(names, self.visible_names(self.alice))
+        self.assertNotIn('bob-private-00', names)
+        self.assertIn('alice-private-00', names)
+
+    def test_quiz_keyset_matches_page_number(self):
+        quiz_group = QuizGroup.objects.get(quiz_group_name='alice-public-00')
+        for i in range(7):
+            Quiz.objects.create(quiz_group=quiz_group, quiz_title='quiz-%02d' % i, quiz_content='content')
+
+        titles = {}
+        for mode in ('', '&cursor='):
+            url = '/quisapi/quiz/?page_size=3' + mode
+            titles[mode] = []
+            while url:
+                data = self.client.get(url).json()
+                titles[mode].extend(row['quiz_title'] for row in data['results'])
+                url = data['next']
+
+        self.assertEqual(titles[''], ['quiz-%02d' % i for i in range(7)])
+        self.assertEqual(titles['&cursor='], titles[''])
+
+    def test_invalid_cursor_returns_404(self):
+        for position in (['name', 'not-a-uuid'], [None, None], ['name'], 'name'):
+            response = self.client.get('/quisapi/quiz-group/?cursor=' + encode_cursor(position))
+            self.assertEqual(response.status_code, 404, position)
+
+        response = self.client.get('/quisapi/quiz-group/?cursor=not-base64!')
+        self.assertEqual(response.status_code, 404)
+
+
+# 一覧表示の事前にコンパイルしたシリアライザが ModelSerializer と同じバイト列を出力するか
+class ValuesSerializerTests(QuisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = create_user('alice')
+        self.quiz_group = QuizGroup.objects.create(
+            user=self.alice,
+            quiz_group_name='グループ "quoted" \\ name',
+            quiz_group_description='説明\n改行',
+            scope=True,
+        )
+        QuizGroup.objects.create(user=self.alice, quiz_group_name='empty', scope=True)
+        for i in range(3):
+            Quiz.objects.create(quiz_group=self.quiz_group, quiz_title='タイトル %d' % i, quiz_content='内容 🎌')
+
+    def test_compiled_serializers_match_model_serializers(self):
+        renderer = FastJSONRenderer()
+        for serializer_class in (
+            QuizGroupSerializer,
+            QuizSerializer,
+            FeedSerializer,
+            SearchSerializer,
+            TrendingSerializer,
+            PracticeSerializer,
+        ):
+            model = serializer_class.Meta.model
+            columns, serialize = compile_values_serializer(serializer_class)
+            for instance in model.objects.all():
+                row = model.objects.values(*columns).get(pk=instance.pk)
+                self.assertEqual(
+                    renderer.render(serialize(row)),
+                    renderer.render(serializer_class(instance).data),
+                    serializer_class.__name__,
+                )
+
+    def test_list_response_matches_model_serializer(self):
+        renderer = FastJSONRenderer()
+        for url, serializer_class, queryset in (
+            ('/quisapi/quiz-group/', QuizGroupSerializer, QuizGroup.objects.order_by('quiz_group_name', 'uuid')),
+            ('/quisapi/quiz/', QuizSerializer, Quiz.objects.order_by('quiz_title', 'uuid')),
+        ):
+            response = self.client.get(url)
+            expected = OrderedDict([
+                ('count', queryset.count()),
+                ('next', None),
+                ('previous', None),
+                ('results', serializer_class(queryset, many=True).data),
+            ])
+            self.assertEqual(response.content, renderer.render(expected))
+
+
+# ETag / Last-Modified による条件付きGET
+class ConditionalGetTests(QuisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.quiz_group = QuizGroup.objects.create(user=self.alice, quiz_group_name='group', scope=True)
+        self.quiz = Quiz.objects.create(quiz_group=self.quiz_group, quiz_title='quiz', quiz_content='content')
+
+    def test_retrieve_not_modified(self):
+        url = '/quisapi/quiz/%s/' % self.quiz.pk
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertIn('ETag', response)
+
+    def test_retrieve_modified_after_update(self):
+        url = '/quisapi/quiz/%s/' % self.quiz.pk
+        etag = self.client.get(url)['ETag']
+
+        self.client.force_authenticate(self.alice)
+        response = self.client.patch(url, {'quiz_title': 'changed'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.client.force_authenticate(None)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['quiz_title'], 'changed')
+
+    def test_quiz_if_modified_since(self):
+        url = '/quisapi/quiz/%s/' % self.quiz.pk
+        last_modified = self.client.get(url)['Last-Modified']
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    # フォロー数の変更では update_date が変わらないため、If-Modified-Since だけでは 304 にしない
+    def test_quiz_group_counters_change_validators(self):
+        url = '/quisapi/quiz-group/%s/' % self.quiz_group.pk
+        self.client.force_authenticate(self.bob)
+        response = self.client.get(url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        response = self.client.put(
+            '/quisapi/follow/add/%s' % self.quiz_group.pk,
+            {'user': str(self.bob.pk), 'quiz_group': str(self.quiz_group.pk)},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['followings'], 1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_list_not_modified_until_changed(self):
+        url = '/quisapi/quiz/'
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Quiz.objects.create(quiz_group=self.quiz_group, quiz_title='new', quiz_content='content')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 2)
+
+    # 閲覧範囲の異なるユーザには別の ETag を返す
+    def test_etag_depends_on_user(self):
+        url = '/quisapi/quiz-group/'
+        anonymous_etag = self.client.get(url)['ETag']
+        self.client.force_authenticate(self.bob)
+        self.assertNotEqual(self.client.get(url)['ETag'], anonymous_etag)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=anonymous_etag)
+        self.assertEqual(response.status_code, 200)
+
+    # レスポンスキャッシュが有効な場合、一覧の検証用の集計はバージョンが変わるまで再利用する
+    @override_settings(QUISAPI_RESPONSE_CACHE_TIMEOUT=300)
+    def test_list_validators_cached_until_invalidated(self):
+        caches['default'].clear()
+        url = '/quisapi/quiz/'
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Quiz.objects.create(quiz_group=self.quiz_group, quiz_title='new', quiz_content='content')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 2)
+
+
+# クイズの無作為抽出 (抽選用連番による抽出)
+class DrawTests(QuisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = create_user('alice')
+        self.quiz_group = QuizGroup.objects.create(user=self.alice, quiz_group_name='group', scope=True)
+        self.other_group = QuizGroup.objects.create(user=self.alice, quiz_group_name='other', scope=True)
+        self.quizzes = [
+            Quiz.objects.create(quiz_group=self.quiz_group, quiz_title='quiz-%02d' % i, quiz_content='content')
+            for i in range(20)
+        ]
+        Quiz.objects.create(quiz_group=self.other_group, quiz_title='other', quiz_content='content')
+        # 欠番を作る
+        for quiz in self.quizzes[::3]:
+            quiz.delete()
+        self.remaining = {quiz.pk for quiz in self.quizzes[1::3] + self.quizzes[2::3]}
+        random.seed(0)
+
+    def draw(self, n, exclude=()):
+        rows = draw.draw(Quiz.objects.values('uuid', 'draw_index'), self.quiz_group, n, exclude)
+        return [row['uuid'] for row in rows]
+
+    def test_draw_indexes_are_unique_in_group(self):
+        indexes = list(Quiz.objects.filter(quiz_group=self.quiz_group).values_list('draw_index', flat=True))
+        self.assertEqual(len(indexes), len(set(indexes)))
+        self.assertNotIn(None, indexes)
+
+    def test_draw_returns_distinct_quizzes_of_group(self):
+        drawn = self.draw(5)
+        self.assertEqual(len(drawn), 5)
+        self.assertEqual(len(set(drawn)), 5)
+        self.assertTrue(set(drawn) <= self.remaining)
+
+    def test_draw_excludes_quizzes(self):
+        exclude = list(self.remaining)[:10]
+        for _ in range(20):
+            drawn = self.draw(3, exclude)
+            self.assertEqual(len(drawn), 3)
+            self.assertFalse(set(drawn) & set(exclude))
+
+    def test_draw_more_than_available(self):
+        self.assertEqual(set(self.draw(100)), self.remaining)
+        exclude = list(self.remaining)[:-2]
+        self.assertEqual(set(self.draw(100, exclude)), self.remaining - set(exclude))
+
+    # 欠番があっても、残っているクイズはどれも同じ確率で選ばれる
+    def test_draw_is_uniform(self):
+        counts = Counter()
+        rounds = 2000
+        for _ in range(rounds):
+            counts.update(self.draw(1))
+
+        self.assertEqual(set(counts), self.remaining)
+        expected = rounds / len(self.remaining)
+        chi_square = sum((count - expected) ** 2 / expected for count in counts.values())
+        # 自由度 12 の 99.9% 点 (32.9)
+        self.assertLess(chi_square, 32.9)
+
+    def test_draw_endpoint(self):
+        exclude = ','.join(str(pk) for pk in list(self.remaining)[:3])
+        response = self.client.get(
+            '/quisapi/quiz-group/%s/draw/?n=5&exclude=%s' % (self.quiz_group.pk, exclude),
+        )
+        self.assertEqual(response.status_code, 200)
+        drawn = [row['uuid'] for row in response.json()]
+        self.assertEqual(len(set(drawn)), 5)
+        self.assertFalse(set(drawn) & set(exclude.split(',')))
+
+    def test_moved_quiz_gets_index_in_new_group(self):
+        quiz = Quiz.objects.get(pk=self.quizzes[1].pk)
+        quiz.quiz_group = self.other_group
+        quiz.save()
+
+        indexes = list(Quiz.objects.filter(quiz_group=self.other_group).values_list('draw_index', flat=True))
+        self.assertEqual(sorted(indexes), [0, 1])
+
+
+# 解答の記録と SM-2 方式の復習スケジュール
+class ReviewTests(QuisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.quiz_group = QuizGroup.objects.create(user=self.alice, quiz_group_name='group', scope=True)
+        self.quizzes = [
+            Quiz.objects.create(quiz_group=self.quiz_group, quiz_title='quiz-%d' % i, quiz_content='content')
+            for i in range(3)
+        ]
+        self.client.force_authenticate(self.bob)
+
+    def test_schedule(self):
+        schedule = ReviewSchedule(user=self.bob, quiz=self.quizzes[0])
+        answered_at = timezone.now()
+        expected = [
+            # (評価, 連続正解数, 間隔, 易しさ係数)
+            (5, 1, 1, 2.6),
+            (5, 2, 6, 2.7),
+            (4, 3, 16, 2.7),
+            (2, 0, 1, 2.38),
+            (3, 1, 1, 2.24),
+        ]
+        for grade, repetitions, interval, ease in expected:
+            review.schedule(schedule, grade, answered_at)
+            self.assertEqual(schedule.repetitions, repetitions)
+            self.assertEqual(schedule.interval, interval)
+            self.assertAlmostEqual(schedule.ease, ease)
+            self.assertEqual(schedule.next_due, answered_at + datetime.timedelta(days=interval))
+            self.assertEqual(schedule.last_answered_at, answered_at)
+
+    def test_schedule_minimum_ease(self):
+        schedule = ReviewSchedule(user=self.bob, quiz=self.quizzes[0])
+        for _ in range(10):
+            review.schedule(schedule, 0, timezone.now())
+        self.assertEqual(schedule.ease, review.MIN_EASE)
+        self.assertEqual(schedule.interval, 1)
+
+    def test_record_attempts(self):
+        now = timezone.now()
+        response = self.client.post('/quisapi/attempts/', [
+            {'quiz': str(self.quizzes[0].pk), 'grade': 5, 'answered_at': (now - datetime.timedelta(days=2)).isoformat()},
+            {'quiz': str(self.quizzes[0].pk), 'grade': 5, 'answered_at': (now - datetime.timedelta(days=1)).isoformat()},
+            {'quiz': str(self.quizzes[1].pk), 'grade': 1},
+        ], format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Attempt.objects.filter(user=self.bob).count(), 3)
+
+        first = ReviewSchedule.objects.get(user=self.bob, quiz=self.quizzes[0])
+        self.assertEqual((first.repetitions, first.interval), (2, 6))
+        self.assertEqual(first.quiz_group_id, self.quiz_group.pk)
+        second = ReviewSchedule.objects.get(user=self.bob, quiz=self.quizzes[1])
+        self.assertEqual((second.repetitions, second.interval), (0, 1))
+
+        # 記録済みより古い解答は履歴にだけ残す
+        response = self.client.post('/quisapi/attempts/', [
+            {'quiz': str(self.quizzes[0].pk), 'grade': 0, 'answered_at': (now - datetime.timedelta(days=3)).isoformat()},
+        ], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(ReviewSchedule.objects.get(pk=first.pk).repetitions, 2)
+        self.assertEqual(Attempt.objects.filter(user=self.bob).count(), 4)
+
+    def test_record_attempts_rejects_invisible_quizzes(self):
+        private_group = QuizGroup.objects.create(user=self.alice, quiz_group_name='private', scope=False)
+        quiz = Quiz.objects.create(quiz_group=private_group, quiz_title='private', quiz_content='content')
+        response = self.client.post('/quisapi/attempts/', [{'quiz': str(quiz.pk), 'grade': 5}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Attempt.objects.exists())
+
+    def test_due(self):
+        url = '/quisapi/quiz-group/%s/due/' % self.quiz_group.pk
+        self.assertEqual(self.client.get(url).status_code, 403)
+        Follower.objects.create(user=self.bob, quiz_group=self.quiz_group)
+
+        now = timezone.now()
+        self.client.post('/quisapi/attempts/', [
+            # 出題日時を過ぎたクイズ (1日後が期限)
+            {'quiz': str(self.quizzes[2].pk), 'grade': 1, 'answered_at': (now - datetime.timedelta(days=2)).isoformat()},
+            # まだ期限前のクイズ
+            {'quiz': str(self.quizzes[1].pk), 'grade': 5},
+        ], format='json')
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [row['uuid'] for row in response.json()],
+            [str(self.quizzes[2].pk), str(self.quizzes[0].pk)],
+        )
+        response = self.client.get(url + '?n=1')
+        self.assertEqual([row['uuid'] for row in response.json()], [str(self.quizzes[2].pk)])
+
+
+# GCRA によるスロットリング
+class ThrottleTests(QuisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user('alice')
+
+    # 読み取りのレートを 1件/分・同時に 3件 にする
+    def throttle_settings(self, **kwargs):
+        rest_framework = dict(
+            settings.REST_FRAMEWORK,
+            DEFAULT_THROTTLE_RATES={'anon': '1/min', 'read': '1/min', 'write': '1/min'},
+        )
+        return override_settings(
+            REST_FRAMEWORK=rest_framework,
+            QUISAPI_THROTTLE_BURSTS={'anon': 3, 'read': 3, 'write': 3},
+            **kwargs
+        )
+
+    def test_gcra(self):
+        # 間隔 10秒・許容 30秒 (同時に 3件)
+        tat = 100.0
+        for expected in (110.0, 120.0, 130.0):
+            tat, wait = throttling.gcra(tat, 100.0, 10, 30)
+            self.assertEqual((tat, wait), (expected, 0))
+        self.assertEqual(throttling.gcra(tat, 100.0, 10, 30), (130.0, 10.0))
+        self.assertEqual(throttling.gcra(tat, 105.0, 10, 30), (130.0, 5.0))
+        self.assertEqual(throttling.gcra(tat, 110.0, 10, 30), (140.0, 0))
+        # 長く空いた場合も許容を超えて貯まらない
+        self.assertEqual(throttling.gcra(tat, 1000.0, 10, 30), (1010.0, 0))
+
+    def test_local_store(self):
+        store = throttling.LocalStore()
+        for _ in range(3):
+            self.assertEqual(store.acquire('a', 60, 180), 0)
+        wait = store.acquire('a', 60, 180)
+        self.assertGreater(wait, 59)
+        self.assertLessEqual(wait, 60)
+        # キーごとに数える
+        self.assertEqual(store.acquire('b', 60, 180), 0)
+
+    def test_throttled(self):
+        self.client.force_authenticate(self.user)
+        with self.throttle_settings():
+            for _ in range(3):
+                self.assertEqual(self.client.get('/quisapi/quiz-group/').status_code, 200)
+            response = self.client.get('/quisapi/quiz-group/')
+            self.assertEqual(response.status_code, 429)
+            self.assertIn(response['Retry-After'], ('59', '60'))
+            # 書き込みは別のスコープで数える
+            response = self.client.post('/quisapi/quiz-group/', {'quiz_group_name': 'group'}, format='json')
+            self.assertNotEqual(response.status_code, 429)
+
+    def test_database_store(self):
+        self.client.force_authenticate(self.user)
+        with self.throttle_settings(QUISAPI_THROTTLE_STORE='database'):
+            for _ in range(3):
+                self.assertEqual(self.client.get('/quisapi/quiz-group/').status_code, 200)
+            self.assertEqual(self.client.get('/quisapi/quiz-group/').status_code, 429)
+        self.assertEqual(ThrottleBucket.objects.count(), 1)
+
+
+# フォロー数 (QuizGroup.followings) の更新と再計算
+class FollowingsTests(QuisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.quiz_groups = [
+            QuizGroup.objects.create(user=self.alice, quiz_group_name='group-%d' % i, scope=True)
+            for i in range(3)
+        ]
+        self.client.force_authenticate(self.bob)
+
+    def followings(self):
+        return [
+            QuizGroup.objects.get(pk=quiz_group.pk).followings
+            for quiz_group in self.quiz_groups
+        ]
+
+    def follow_all(self):
+        pks = [str(quiz_group.pk) for quiz_group in self.quiz_groups]
+        response = self.client.put('/quisapi/follow/add/', {'quiz_groups': pks}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response
+
+    def test_follow(self):
+        quiz_group = self.quiz_groups[0]
+        data = {'user': str(self.bob.pk), 'quiz_group': str(quiz_group.pk)}
+        response = self.client.put('/quisapi/follow/add/%s' % quiz_group.pk, data, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.followings(), [1, 0, 0])
+
+        # 二重のフォローは数えない
+        response = self.client.put('/quisapi/follow/add/%s' % quiz_group.pk, data, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.followings(), [1, 0, 0])
+
+        response = self.client.put('/quisapi/follow/remove/%s' % quiz_group.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.followings(), [0, 0, 0])
+        response = self.client.put('/quisapi/follow/remove/%s' % quiz_group.pk)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.followings(), [0, 0, 0])
+
+    # 本文は使わず、URL のクイズグループをリクエストのユーザがフォローする
+    def test_follow_ignores_body(self):
+        carol = create_user('carol')
+        data = {'user': str(carol.pk), 'quiz_group': str(self.quiz_groups[1].pk)}
+        response = self.client.put('/quisapi/follow/add/%s' % self.quiz_groups[0].pk, data, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(
+            list(Follower.objects.values_list('user', 'quiz_group')),
+            [(self.bob.pk, self.quiz_groups[0].pk)],
+        )
+        self.assertEqual(self.followings(), [1, 0, 0])
+
+    def test_follow_rejects_own_and_private(self):
+        own = QuizGroup.objects.create(user=self.bob, quiz_group_name='own', scope=True)
+        private = QuizGroup.objects.create(user=self.alice, quiz_group_name='private', scope=False)
+        self.assertEqual(self.client.put('/quisapi/follow/add/%s' % own.pk).status_code, 400)
+        self.assertEqual(self.client.put('/quisapi/follow/add/%s' % private.pk).status_code, 404)
+        self.assertEqual(self.client.put('/quisapi/follow/add/not-a-uuid').status_code, 404)
+        self.assertFalse(Follower.objects.exists())
+
+    def test_batch_follow(self):
+        pks = [str(self.quiz_groups[0].pk)]
+        self.client.put('/quisapi/follow/add/', {'quiz_groups': pks}, format='json')
+        response = self.follow_all()
+        self.assertEqual(
+            sorted(response.json()['followed']),
+            sorted(str(quiz_group.pk) for quiz_group in self.quiz_groups[1:]),
+        )
+        # 既にフォロー中のグループは加算しない
+        self.assertEqual(self.followings(), [1, 1, 1])
+
+        pks = [str(quiz_group.pk) for quiz_group in self.quiz_groups[:2]]
+        response = self.client.put('/quisapi/follow/remove/', {'quiz_groups': pks}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['unfollowed']), 2)
+        self.assertEqual(self.followings(), [0, 0, 1])
+
+    def test_batch_follow_rejects_own_and_private(self):
+        own = QuizGroup.objects.create(user=self.bob, quiz_group_name='own', scope=True)
+        private = QuizGroup.objects.create(user=self.alice, quiz_group_name='private', scope=False)
+        for quiz_group in (own, private):
+            response = self.client.put('/quisapi/follow/add/', {'quiz_groups': [str(quiz_group.pk)]}, format='json')
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Follower.objects.exists())
+
+    @override_settings(QUISAPI_FOLLOWINGS_SHARDS=4)
+    def test_sharded(self):
+        self.follow_all()
+        self.client.put('/quisapi/follow/remove/%s' % self.quiz_groups[0].pk)
+        # 集約するまではシャードに溜まる
+        self.assertEqual(self.followings(), [0, 0, 0])
+        self.assertEqual(counters.rollup_followings(), 2)
+        self.assertEqual(self.followings(), [0, 1, 1])
+        self.assertFalse(FollowingCounterShard.objects.exclude(delta=0).exists())
+        self.assertEqual(counters.rollup_followings(), 0)
+
+    def test_reconcile(self):
+        self.follow_all()
+        QuizGroup.objects.update(followings=100)
+        FollowingCounterShard.objects.create(quiz_group=self.quiz_groups[0], shard=0, delta=5)
+        self.assertEqual(counters.reconcile_followings(), 3)
+        self.assertEqual(self.followings(), [1, 1, 1])
+        self.assertFalse(FollowingCounterShard.objects.exists())
+
+
+# クイズ数 (QuizGroup.quiz_count)・クイズの最終更新日時の更新と再計算
+class QuizCountTests(QuisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = create_user('alice')
+        self.quiz_groups = [
+            QuizGroup.objects.create(user=self.alice, quiz_group_name='group-%d' % i, scope=True)
+            for i in range(2)
+        ]
+        self.client.force_authenticate(self.alice)
+
+    def counts(self):
+        return [
+            QuizGroup.objects.get(pk=quiz_group.pk).quiz_count
+            for quiz_group in self.quiz_groups
+        ]
+
+    # 集計値が Quiz テーブルからの再計算と一致することを確認する
+    def assertReconciled(self):
+        fields = ('quiz_count', 'last_quiz_activity')
+        before = list(QuizGroup.objects.order_by('pk').values_list(*fields))
+        counters.reconcile_quizzes()
+        after = list(QuizGroup.objects.order_by('pk').values_list(*fields))
+        self.assertEqual(before, after)
+
+    def activity(self, quiz_group):
+        return QuizGroup.objects.get(pk=quiz_group.pk).last_quiz_activity
+
+    def create_quiz(self, quiz_group, title='quiz'):
+        response = self.client.post('/quisapi/quiz/', {
+            'quiz_group': str(quiz_group.pk),
+            'quiz_title': title,
+            'quiz_content': 'content',
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return Quiz.objects.get(quiz_group=quiz_group, quiz_title=title)
+
+    def test_create_move_delete(self):
+        self.assertIsNone(self.quiz_groups[0].last_quiz_activity)
+        quiz = self.create_quiz(self.quiz_groups[0])
+        other = self.create_quiz(self.quiz_groups[0], 'other')
+        self.assertEqual(self.counts(), [2, 0])
+        self.assertEqual(self.activity(self.quiz_groups[0]), other.update_date)
+        self.assertReconciled()
+
+        # 移動元の最終更新日時は残ったクイズから求め直す
+        response = self.client.patch('/quisapi/quiz/%s/' % quiz.pk, {'quiz_group': str(self.quiz_groups[1].pk)}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.counts(), [1, 1])
+        self.assertEqual(self.activity(self.quiz_groups[0]), other.update_date)
+        self.assertEqual(self.activity(self.quiz_groups[1]), Quiz.objects.get(pk=quiz.pk).update_date)
+        self.assertReconciled()
+
+        # クイズが無くなったグループは None に戻る
+        response = self.client.delete('/quisapi/quiz/%s/' % quiz.pk)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.counts(), [1, 0])
+        self.assertIsNone(self.activity(self.quiz_groups[1]))
+        self.assertReconciled()
+
+    def test_bulk(self):
+        url = '/quisapi/quiz-group/%s/quizzes/' % self.quiz_groups[0].pk
+        response = self.client.post(url, [
+            {'quiz_title': 'quiz-%d' % i, 'quiz_content': 'content'}
+            for i in range(5)
+        ], format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(self.counts(), [5, 0])
+        self.assertReconciled()
+
+        uuids = [str(uuid) for uuid in Quiz.objects.values_list('uuid', flat=True)[:3]]
+        response = self.client.delete(url, uuids, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.counts(), [2, 0])
+        self.assertReconciled()
+
+        # 存在しないクイズを含む場合は何も削除しない
+        response = self.client.delete(url, uuids[:1], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.counts(), [2, 0])
+
+    def test_queryset_delete(self):
+        for quiz_group in self.quiz_groups:
+            for i in range(3):
+                Quiz.objects.create(quiz_group=quiz_group, quiz_title='quiz-%d' % i, quiz_content='content')
+        Quiz.objects.filter(quiz_title__in=['quiz-0', 'quiz-1']).delete()
+        self.assertEqual(self.counts(), [1, 1])
+        self.assertReconciled()
+
+        # グループの削除に伴うカスケード削除
+        self.quiz_groups[1].delete()
+        self.assertEqual(QuizGroup.objects.get(pk=self.quiz_groups[0].pk).quiz_count, 1)
+
+    def test_reconcile(self):
+        for i in range(3):
+            Quiz.objects.create(quiz_group=self.quiz_groups[0], quiz_title='quiz-%d' % i, quiz_content='content')
+        QuizGroup.objects.update(quiz_count=100, last_quiz_activity=None)
+        self.assertEqual(counters.reconcile_quizzes(), 2)
+        self.assertEqual(self.counts(), [3, 0])
+        self.assertEqual(
+            QuizGroup.objects.get(pk=self.quiz_groups[0].pk).last_quiz_activity,
+            Quiz.objects.latest('update_date').update_date,
+        )
+        self.assertIsNone(QuizGroup.objects.get(pk=self.quiz_groups[1].pk).last_quiz_activity)
+
+    def test_import(self):
+        for i in range(3):
+            Quiz.objects.create(quiz_group=self.quiz_groups[0], quiz_title='quiz-%d' % i, quiz_content='content')
+        response = self.client.get('/quisapi/export/')
+        body = b''.join(response.streaming_content)
+
+        self.client.force_authenticate(create_user('bob'))
+        response = self.client.post('/quisapi/import/', body, content_type=NDJSONParser.media_type)
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['quizzes'], 3)
+        imported = QuizGroup.objects.get(user__username='bob', quiz_group_name='group-0')
+        self.assertEqual(imported.quiz_count, 3)
+        self.assertReconciled()
+
+
+# 署名付きトークンの発行・認証・失効
+class TokenTests(QuisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user('alice')
+        self.client = APIClient(enforce_csrf_checks=True)
+
+    def obtain_token(self, password='password'):
+        response = self.client.post('/quisapi/token/', {'username': 'alice', 'password': password}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['token']
+
+    def authorize(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + token)
+
+    def assertUnauthorized(self, url='/quisapi/quiz-group/'):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer')
+
+    def test_obtain(self):
+        response = self.client.post('/quisapi/token/', {'username': 'alice', 'password': 'password'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), {'token', 'expires'})
+        self.assertGreater(response.json()['expires'], time.time())
+
+        response = self.client.post('/quisapi/token/', {'username': 'alice', 'password': 'wrong'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_authenticate(self):
+        self.authorize(self.obtain_token())
+        response = self.client.get('/quisapi/quiz-group/')
+        self.assertEqual(response.status_code, 200)
+        # CSRF トークン無しで書き込め、セッションは作られない
+        response = self.client.post('/quisapi/quiz-group/', {
+            'user': str(self.user.pk),
+            'quiz_group_name': 'group',
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(QuizGroup.objects.get().user, self.user)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertNotIn(settings.CSRF_COOKIE_NAME, response.cookies)
+
+    def test_invalid(self):
+        token = self.obtain_token()
+        self.authorize(token[:-1] + ('A' if token[-1] != 'A' else 'B'))
+        self.assertUnauthorized()
+        self.authorize('not-a-token')
+        self.assertUnauthorized()
+
+    @override_settings(QUISAPI_TOKEN_MAX_AGE=-1)
+    def test_expired(self):
+        self.authorize(self.obtain_token())
+        self.assertUnauthorized()
+
+    def test_revoke(self):
+        self.authorize(self.obtain_token())
+        response = self.client.post('/quisapi/token/revoke/')
+        self.assertEqual(response.status_code, 204)
+        self.assertUnauthorized()
+        self.assertUnauthorized('/quisapi/async/quiz-group/')
+
+        # 新しく発行したトークンは使える
+        self.authorize(self.obtain_token())
+        self.assertEqual(self.client.get('/quisapi/quiz-group/').status_code, 200)
+
+    def test_password_change(self):
+        self.authorize(self.obtain_token())
+        user = QuisAPIUser.objects.get(pk=self.user.pk)
+        user.set_password('new-password')
+        user.save()
+        self.assertUnauthorized()
+        self.authorize(self.obtain_token('new-password'))
+        self.assertEqual(self.client.get('/quisapi/quiz-group/').status_code, 200)
+
+    # ハッシュ方式の更新 (ログイン時に自動で行われる) では失効しない
+    def test_password_hash_upgrade(self):
+        self.authorize(self.obtain_token())
+        with override_settings(PASSWORD_HASHERS=[
+            'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+            'django.contrib.auth.hashers.MD5PasswordHasher',
+        ]):
+            self.obtain_token()
+            self.assertTrue(QuisAPIUser.objects.get(pk=self.user.pk).password.startswith('pbkdf2_sha256$'))
+        self.assertEqual(self.client.get('/quisapi/quiz-group/').status_code, 200)
+
+    # 管理サイトなど DRF 以外のビューでは未ログインとして扱う
+    def test_admin(self):
+        self.authorize(self.obtain_token())
+        response = self.client.get('/admin/')
+        self.assertEqual(response.status_code, 302)
+
+
+# ビューのクエリ数の上限
+class QueryBudgetTests(QuisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user('alice')
+        self.quiz_group = QuizGroup.objects.create(user=self.user, quiz_group_name='group', scope=True)
+        self.client.force_authenticate(self.user)
+
+    def test_exceeded(self):
+        with override_settings(QUISAPI_QUERY_BUDGET='raise'):
+            with self.assertRaises(QueryBudgetExceeded):
+                with QueryBudget(1, 'test'):
+                    list(QuizGroup.objects.all())
+                    list(Quiz.objects.all())
+
+    # 処理されない例外 (500) の後も接続に execute_wrapper が残らない
+    def test_unhandled_exception(self):
+        self.client.raise_request_exception = False
+        url = '/quisapi/quiz-group/%s/' % self.quiz_group.pk
+        with mock.patch.object(QuizGroupCRUD, 'get_object', side_effect=RuntimeError):
+            for _ in range(3):
+                self.assertEqual(self.client.get(url).status_code, 500)
+        for connection in connections.all():
+            self.assertEqual(connection.execute_wrappers, [])
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    # クイズグループの削除はクイズ数によらず一定回数のクエリで済む
+    def test_destroy_large_quiz_group(self):
+        def destroy(count):
+            quiz_group = QuizGroup.objects.create(user=self.user, quiz_group_name='group-%d' % count)
+            Quiz.objects.bulk_create([
+                Quiz(quiz_group=quiz_group, quiz_title='quiz-%d' % i, quiz_content='content', draw_index=i)
+                for i in range(count)
+            ])
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.delete('/quisapi/quiz-group/%s/' % quiz_group.pk)
+            self.assertEqual(response.status_code, 204)
+            self.assertFalse(Quiz.objects.filter(quiz_group_id=quiz_group.pk).exists())
+            return len(queries)
+
+        self.assertEqual(destroy(3000), destroy(1))
+
+    # クイズグループの削除では、クイズ・フォロワーごとにキャッシュを無効化しない
+    @override_settings(QUISAPI_RESPONSE_CACHE_TIMEOUT=60)
+    def test_destroy_quiz_group_invalidation(self):
+        Quiz.objects.bulk_create([
+            Quiz(quiz_group=self.quiz_group, quiz_title='quiz-%d' % i, quiz_content='content', draw_index=i)
+            for i in range(100)
+        ])
+        Follower.objects.bulk_create([
+            Follower(user=create_user('user-%d' % i), quiz_group=self.quiz_group)
+            for i in range(10)
+        ])
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.quiz_group.delete()
+        self.assertEqual(len(callbacks), 1)
+
+
+# フィード (タイムラインの事前作成・ページング)
+@override_settings(QUISAPI_FEED_MATERIALIZE_FOLLOWS=1)
+class FeedTests(QuisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.quiz_group = QuizGroup.objects.create(user=self.alice, quiz_group_name='group', scope=True)
+        Follower.objects.create(user=self.bob, quiz_group=self.quiz_group)
+        MaterializedFeed.objects.create(user=self.bob)
+
+    def load_quiz(self, title):
+        now = timezone.now().isoformat()
+        fixture = json.dumps([{
+            'model': 'quisapi.quiz',
+            'pk': str(uuid.uuid4()),
+            'fields': {
+                'quiz_group': str(self.quiz_group.pk),
+                'quiz_title': title,
+                'quiz_content': 'content',
+                'draw_index': 0,
+                'creation_date': now,
+                'update_date': now,
+            },
+        }])
+        for obj in serializers.deserialize('json', fixture):
+            obj.save()
+        return obj.object
+
+    def test_fan_out(self):
+        quiz = Quiz.objects.create(quiz_group=self.quiz_group, quiz_title='quiz', quiz_content='content')
+        self.assertEqual(list(FeedEntry.objects.values_list('user', 'quiz')), [(self.bob.pk, quiz.pk)])
+
+    # loaddata (raw の保存) では配信しない
+    def test_raw_save(self):
+        self.load_quiz('fixture')
+        self.assertFalse(FeedEntry.objects.exists())
+
+    def create_quizzes(self, quiz_group, count, prefix='quiz'):
+        now = timezone.now()
+        return [
+            Quiz.objects.create(
+                quiz_group=quiz_group,
+                quiz_title='%s-%d' % (prefix, i),
+                quiz_content='content',
+                creation_date=now - datetime.timedelta(minutes=count - i),
+            )
+            for i in range(count)
+        ]
+
+    def walk_feed(self, user, url='/quisapi/feed/?page_size=2'):
+        self.client.force_authenticate(user)
+        titles = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            titles.extend(row['quiz_title'] for row in response.json()['results'])
+            url = response.json()['next']
+        return titles
+
+    # 新着順のページング (タイムラインを作成したユーザと読み込み時に集約するユーザで同じ)
+    def test_paging(self):
+        self.create_quizzes(self.quiz_group, 5)
+        carol = create_user('carol')
+        Follower.objects.create(user=carol, quiz_group=self.quiz_group)
+
+        expected = ['quiz-4', 'quiz-3', 'quiz-2', 'quiz-1', 'quiz-0']
+        self.assertEqual(FeedEntry.objects.filter(user=self.bob).count(), 5)
+        self.assertEqual(self.walk_feed(self.bob), expected)
+        self.assertEqual(self.walk_feed(carol), expected)
+
+    # フォローでタイムラインを作成して既存のクイズを追加し、フォロー解除で取り除く
+    def test_follow_backfill(self):
+        other = QuizGroup.objects.create(user=self.alice, quiz_group_name='other', scope=True)
+        self.create_quizzes(other, 2, 'other')
+        carol = create_user('carol')
+        self.client.force_authenticate(carol)
+        response = self.client.put('/quisapi/follow/add/', {'quiz_groups': [str(other.pk)]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(MaterializedFeed.objects.filter(user=carol).exists())
+        self.assertEqual(self.walk_feed(carol), ['other-1', 'other-0'])
+
+        self.client.force_authenticate(carol)
+        response = self.client.put('/quisapi/follow/remove/%s' % other.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(FeedEntry.objects.filter(user=carol).exists())
+        self.assertEqual(self.walk_feed(carol), [])
+
+    # 非公開になったグループのクイズは表示しない
+    def test_private(self):
+        self.create_quizzes(self.quiz_group, 2)
+        QuizGroup.objects.filter(pk=self.quiz_group.pk).update(scope=False)
+        self.assertEqual(self.walk_feed(self.bob), [])
+
+
+# 全文検索 (検索用ドキュメントの作成・検索)
+class SearchTests(QuisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = create_user('alice')
+        self.quiz_group = QuizGroup.objects.create(
+            user=self.alice,
+            quiz_group_name='Ｐｙｔｈｏｎ入門',
+            quiz_group_description='基礎',
+            scope=True,
+        )
+
+    def document(self, quiz):
+        return QuizSearchDocument.objects.get(quiz=quiz).document
+
+    def test_index(self):
+        quiz = Quiz.objects.create(quiz_group=self.quiz_group, quiz_title='リスト', quiz_content='ＡＢＣ')
+        self.assertEqual(self.document(quiz), 'リスト\nabc\npython入門\n基礎')
+
+        # グループ名の変更でグループ内のクイズのドキュメントを作り直す
+        self.quiz_group.quiz_group_name = 'Django'
+        self.quiz_group.save()
+        self.assertEqual(self.document(quiz), 'リスト\nabc\ndjango\n基礎')
+
+    # クイズグループを読み込んでいない保存では、必要な列だけを取得する
+    def test_index_uncached_quiz_group(self):
+        quiz = Quiz.objects.create(quiz_group=self.quiz_group, quiz_title='リスト', quiz_content='content')
+        quiz = Quiz.objects.get(pk=quiz.pk)
+        quiz.quiz_title = 'タプル'
+        with CaptureQueriesContext(connection) as queries:
+            quiz.save()
+        group_queries = [
+            query['sql'] for query in queries
+            if query['sql'].startswith('SELECT') and 'FROM "quisapi_quizgroup"' in query['sql']
+        ]
+        self.assertEqual(len(group_queries), 1)
+        self.assertNotIn('"quisapi_quizgroup"."scope"', group_queries[0])
+        self.assertTrue(self.document(quiz).startswith('タプル\n'))
+
+    # loaddata (raw の保存) ではドキュメントを作らない
+    def test_raw_save(self):
+        fixture = json.dumps([
+            {
+                'model': 'quisapi.quizgroup',
+                'pk': str(self.quiz_group.pk),
+                'fields': {
+                    'user': str(self.alice.pk),
+                    'quiz_group_name': 'renamed',
+                    'quiz_group_description': '',
+                    'scope': True,
+                    'followings': 0,
+                    'quiz_count': 0,
+                    'creation_date': timezone.now().isoformat(),
+                    'update_date': timezone.now().isoformat(),
+                },
+            },
+            {
+                'model': 'quisapi.quiz',
+                'pk': str(uuid.uuid4()),
+                'fields': {
+                    'quiz_group': str(self.quiz_group.pk),
+                    'quiz_title': 'fixture',
+                    'quiz_content': 'content',
+                    'draw_index': 0,
+                    'creation_date': timezone.now().isoformat(),
+                    'update_date': timezone.now().isoformat(),
+                },
+            },
+        ])
+        with CaptureQueriesContext(connection) as queries:
+            for obj in serializers.deserialize('json', fixture):
+                obj.save()
+        self.assertFalse(QuizSearchDocument.objects.exists())
+        self.assertFalse(any('quisapi_quizsearchdocument' in query['sql'] for query in queries))
+
+    def search(self, query, user=None):
+        self.client.force_authenticate(user)
+        response = self.client.get('/quisapi/search/', {'q': query})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row['quiz_title'] for row in response.json()['results']]
+
+    # 全角・半角、大文字・小文字の揺れを吸収する
+    def test_search_normalization(self):
+        Quiz.objects.create(quiz_group=self.quiz_group, quiz_title='Ｄｊａｎｇｏ', quiz_content='ｶﾀｶﾅ')
+        self.assertEqual(self.search('django'), ['Ｄｊａｎｇｏ'])
+        self.assertEqual(self.search('DJANGO'), ['Ｄｊａｎｇｏ'])
+        self.assertEqual(self.search('カタカナ'), ['Ｄｊａｎｇｏ'])
+        # グループ名も対象
+        self.assertEqual(self.search('python'), ['Ｄｊａｎｇｏ'])
+
+    # すべての語を含むものを、語が前に現れるものから返す
+    def test_search_ranking(self):
+        Quiz.objects.create(quiz_group=self.quiz_group, quiz_title='later', quiz_content='xxxxxxxx keyword')
+        Quiz.objects.create(quiz_group=self.quiz_group, quiz_title='keyword first', quiz_content='other')
+        Quiz.objects.create(quiz_group=self.quiz_group, quiz_title='unrelated', quiz_content='content')
+        self.assertEqual(self.search('keyword'), ['keyword first', 'later'])
+        self.assertEqual(self.search('keyword other'), ['keyword first'])
+        self.assertEqual(self.search(''), [])
+        self.assertEqual(self.search('   '), [])
+
+    # 他人の非公開グループのクイズは返さない (作成者には返す)
+    def test_search_private(self):
+        private = QuizGroup.objects.create(user=self.alice, quiz_group_name='private', scope=False)
+        Quiz.objects.create(quiz_group=private, quiz_title='secret', quiz_content='content')
+        self.assertEqual(self.search('secret'), [])
+        self.assertEqual(self.search('secret', create_user('bob')), [])
+        self.assertEqual(self.search('secret', self.alice), ['secret'])
+
+
+# 非同期ビュー (本文は同期のビューと同じ)
+class AsyncViewTests(QuisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.quiz_groups = [
+            QuizGroup.objects.create(user=self.alice, quiz_group_name='public-%d' % i, scope=True)
+            for i in range(3)
+        ]
+        self.private = QuizGroup.objects.create(user=self.alice, quiz_group_name='private', scope=False)
+        for quiz_group in [*self.quiz_groups, self.private]:
+            for i in range(2):
+                Quiz.objects.create(quiz_group=quiz_group, quiz_title='quiz-%d' % i, quiz_content='content')
+
+    def aget(self, url, **kwargs):
+        return async_to_sync(self.async_client.get)(url, **kwargs)
+
+    def aput(self, url, **kwargs):
+        return async_to_sync(self.async_client.put)(url, **kwargs)
+
+    # ページのリンク (next / previous) はそれぞれのエンドポイントを指す
+    def assertSameBody(self, sync_url, async_url):
+        response = self.client.get(sync_url)
+        async_response = self.aget(async_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(async_response.status_code, 200)
+        self.assertEqual(
+            json.loads(async_response.content.decode().replace('/quisapi/async/', '/quisapi/')),
+            response.json(),
+        )
+
+    def test_same_body(self):
+        objects = (
+            ('quiz-group', self.quiz_groups[0].pk),
+            ('quiz', Quiz.objects.filter(quiz_group=self.quiz_groups[0]).first().pk),
+        )
+        for user in (self.alice, self.bob):
+            self.client.force_login(user)
+            self.async_client.force_login(user)
+            for name, pk in objects:
+                self.assertSameBody('/quisapi/%s/' % name, '/quisapi/async/%s/' % name)
+                self.assertSameBody('/quisapi/%s/?page=2&page_size=2' % name, '/quisapi/async/%s/?page=2&page_size=2' % name)
+                self.assertSameBody('/quisapi/%s/%s/' % (name, pk), '/quisapi/async/%s/%s/' % (name, pk))
+
+    def test_keyset(self):
+        self.async_client.force_login(self.bob)
+        names = []
+        url = '/quisapi/async/quiz-group/?cursor=&page_size=2'
+        while url:
+            response = self.aget(url)
+            self.assertEqual(response.status_code, 200)
+            names.extend(row['quiz_group_name'] for row in response.json()['results'])
+            url = response.json()['next']
+        self.assertEqual(names, ['public-0', 'public-1', 'public-2'])
+
+        # 同期のビューのカーソルと同じ
+        self.client.force_login(self.bob)
+        cursor = encode_cursor(['public-0', str(self.quiz_groups[0].pk)])
+        self.assertSameBody('/quisapi/quiz-group/?cursor=' + cursor, '/quisapi/async/quiz-group/?cursor=' + cursor)
+
+    def test_not_found(self):
+        self.async_client.force_login(self.bob)
+        self.assertEqual(self.aget('/quisapi/async/quiz-group/%s/' % self.private.pk).status_code, 404)
+        self.assertEqual(self.aget('/quisapi/async/quiz-group/%s/' % uuid.uuid4()).status_code, 404)
+        self.assertEqual(self.aget('/quisapi/async/quiz-group/not-a-uuid/').status_code, 404)
+        self.assertEqual(self.aget('/quisapi/async/quiz-group/?cursor=not-base64!').status_code, 404)
+
+    def test_unauthorized(self):
+        response = self.aput('/quisapi/async/follow/add/%s' % self.quiz_groups[0].pk)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer')
+
+        response = self.aget('/quisapi/async/quiz-group/', headers={'Authorization': 'Bearer not-a-token'})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer')
+
+    def test_follow(self):
+        self.async_client.force_login(self.bob)
+        quiz_group = self.quiz_groups[0]
+        self.assertEqual(self.aput('/quisapi/async/follow/add/%s' % quiz_group.pk).status_code, 200)
+        self.assertEqual(self.aput('/quisapi/async/follow/add/%s' % quiz_group.pk).status_code, 400)
+        self.assertEqual(QuizGroup.objects.get(pk=quiz_group.pk).followings, 1)
+        self.assertTrue(Follower.objects.filter(user=self.bob, quiz_group=quiz_group).exists())
+        self.assertEqual(self.aput('/quisapi/async/follow/add/%s' % self.private.pk).status_code, 404)
+
+        self.assertEqual(self.aput('/quisapi/async/follow/remove/%s' % quiz_group.pk).status_code, 200)
+        self.assertEqual(self.aput('/quisapi/async/follow/remove/%s' % quiz_group.pk).status_code, 404)
+        self.assertEqual(QuizGroup.objects.get(pk=quiz_group.pk).followings, 0)
+
+
+# 作成者のみ編集・削除可能
+class OwnershipTests(QuisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.quiz_group = QuizGroup.objects.create(user=self.alice, quiz_group_name='group', scope=True)
+        self.private = QuizGroup.objects.create(user=self.alice, quiz_group_name='private', scope=False)
+        self.quiz = Quiz.objects.create(quiz_group=self.quiz_group, quiz_title='quiz', quiz_content='content')
+
+    def urls(self):
+        return (
+            '/quisapi/quiz-group/%s/' % self.quiz_group.pk,
+            '/quisapi/quiz/%s/' % self.quiz.pk,
+        )
+
+    def test_non_owner(self):
+        self.client.force_authenticate(self.bob)
+        for url in self.urls():
+            self.assertEqual(self.client.get(url).status_code, 200)
+            self.assertEqual(self.client.patch(url, {'quiz_title': 'x', 'quiz_group_name': 'x'}, format='json').status_code, 403)
+            self.assertEqual(self.client.put(url, {}, format='json').status_code, 403)
+            self.assertEqual(self.client.delete(url).status_code, 403)
+        url = '/quisapi/quiz-group/%s/quizzes/' % self.quiz_group.pk
+        self.assertEqual(self.client.post(url, [{'quiz_title': 'x', 'quiz_content': 'x'}], format='json').status_code, 403)
+
+        self.assertEqual(QuizGroup.objects.get(pk=self.quiz_group.pk).quiz_group_name, 'group')
+        self.assertEqual(Quiz.objects.get(pk=self.quiz.pk).quiz_title, 'quiz')
+
+        # 閲覧できないグループは存在しないものとして扱う
+        self.assertEqual(self.client.delete('/quisapi/quiz-group/%s/' % self.private.pk).status_code, 404)
+
+    def test_anonymous(self):
+        for url in self.urls():
+            response = self.client.delete(url)
+            self.assertEqual(response.status_code, 401)
+        self.assertEqual(Quiz.objects.count(), 1)
+
+    def test_owner(self):
+        self.client.force_authenticate(self.alice)
+        quiz_url = self.urls()[1]
+        response = self.client.patch(quiz_url, {'quiz_title': 'renamed'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Quiz.objects.get(pk=self.quiz.pk).quiz_title, 'renamed')
+
+        # 移動先も自分のグループに限る
+        others = QuizGroup.objects.create(user=self.bob, quiz_group_name='others', scope=True)
+        response = self.client.patch(quiz_url, {'quiz_group': str(others.pk)}, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(Quiz.objects.get(pk=self.quiz.pk).quiz_group_id, self.quiz_group.pk)
+
+        for url in reversed(self.urls()):
+            self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertFalse(QuizGroup.objects.filter(pk=self.quiz_group.pk).exists())
+
+
+# クイズの一括登録・更新・削除
+class BulkQuizTests(QuisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = create_user('alice')
+        self.quiz_group = QuizGroup.objects.create(user=self.alice, quiz_group_name='group', scope=True)
+        self.url = '/quisapi/quiz-group/%s/quizzes/' % self.quiz_group.pk
+        self.client.force_authenticate(self.alice)
+
+    def create(self, count):
+        response = self.client.post(self.url, [
+            {'quiz_title': 'quiz-%d' % i, 'quiz_content': 'content'}
+            for i in range(count)
+        ], format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+    def test_create(self):
+        rows = self.create(3)
+        self.assertEqual([row['quiz_title'] for row in rows], ['quiz-0', 'quiz-1', 'quiz-2'])
+        self.assertEqual(
+            sorted(Quiz.objects.values_list('draw_index', flat=True)),
+            [0, 1, 2],
+        )
+
+    def test_create_ndjson(self):
+        body = b'\n'.join(
+            json.dumps({'quiz_title': 'quiz-%d' % i, 'quiz_content': 'content'}).encode()
+            for i in range(3)
+        )
+        response = self.client.post(self.url, body, content_type=NDJSONParser.media_type)
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Quiz.objects.count(), 3)
+
+    # 項目ごとのエラー (エラーのある項目の位置をキーにする) を返し、1件も書き込まない
+    def test_errors(self):
+        response = self.client.post(self.url, [
+            {'quiz_title': 'ok', 'quiz_content': 'content'},
+            {'quiz_title': 'no content'},
+            {'quiz_title': 'x' * 200, 'quiz_content': 'content'},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()
+        self.assertEqual(sorted(errors), ['1', '2'])
+        self.assertEqual(list(errors['1']), ['quiz_content'])
+        self.assertEqual(list(errors['2']), ['quiz_title'])
+        self.assertFalse(Quiz.objects.exists())
+
+        response = self.client.post(self.url, {'quiz_title': 'not a list'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        with mock.patch.object(QuizGroupCRUD, 'bulk_max_items', 2):
+            response = self.client.post(self.url, [{'quiz_title': 'x', 'quiz_content': 'x'}] * 3, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Quiz.objects.exists())
+
+    def test_update(self):
+        rows = self.create(3)
+        draw_indexes = dict(Quiz.objects.values_list('uuid', 'draw_index'))
+        response = self.client.patch(self.url, [
+            {'uuid': rows[0]['uuid'], 'quiz_title': 'renamed-0'},
+            {'uuid': rows[2]['uuid'], 'quiz_content': 'changed'},
+        ], format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        quizzes = {str(quiz.uuid): quiz for quiz in Quiz.objects.all()}
+        self.assertEqual(quizzes[rows[0]['uuid']].quiz_title, 'renamed-0')
+        self.assertEqual(quizzes[rows[1]['uuid']].quiz_title, 'quiz-1')
+        self.assertEqual(quizzes[rows[2]['uuid']].quiz_content, 'changed')
+        self.assertEqual(dict(Quiz.objects.values_list('uuid', 'draw_index')), draw_indexes)
+
+        # PUT はすべての項目が必要
+        response = self.client.put(self.url, [{'uuid': rows[0]['uuid'], 'quiz_title': 'x'}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()['0']), ['quiz_content'])
+
+    def test_update_unknown_quiz(self):
+        rows = self.create(1)
+        other_group = QuizGroup.objects.create(user=self.alice, quiz_group_name='other')
+        other = Quiz.objects.create(quiz_group=other_group, quiz_title='other', quiz_content='content')
+        response = self.client.patch(self.url, [
+            {'uuid': rows[0]['uuid'], 'quiz_title': 'renamed'},
+            {'uuid': str(other.pk), 'quiz_title': 'renamed'},
+            {'uuid': 'not-a-uuid', 'quiz_title': 'renamed'},
+            {'quiz_title': 'renamed'},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()
+        self.assertEqual(sorted(errors), ['1', '2', '3'])
+        self.assertEqual(errors['1'], {'uuid': ['Not found.']})
+        self.assertEqual(list(errors['2']), ['uuid'])
+        self.assertEqual(errors['3'], {'uuid': ['Not found.']})
+        self.assertEqual(Quiz.objects.get(pk=other.pk).quiz_title, 'other')
+        self.assertEqual(Quiz.objects.get(pk=rows[0]['uuid']).quiz_title, 'quiz-0')
+
+
+# 公開データのレスポンスキャッシュ
+@override_settings(QUISAPI_RESPONSE_CACHE_TIMEOUT=60)
+class ResponseCacheTests(QuisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.get_cache().clear()
+        self.alice = create_user('alice')
+        self.quiz_groups = [
+            QuizGroup.objects.create(user=self.alice, quiz_group_name='group-%d' % i, scope=True)
+            for i in range(2)
+        ]
+        self.quiz = Quiz.objects.create(quiz_group=self.quiz_groups[0], quiz_title='quiz', quiz_content='content')
+
+    def assertCache(self, url, expected):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get('X-Cache'), expected)
+        return response
+
+    # コミット後の無効化を実行して書き込む
+    def write(self, func):
+        with self.captureOnCommitCallbacks(execute=True):
+            func()
+
+    def test_list(self):
+        url = '/quisapi/quiz-group/'
+        self.assertCache(url, 'MISS')
+        with self.assertNumQueries(0):
+            self.assertCache(url, 'HIT')
+        # クエリパラメータごとに別のエントリ
+        self.assertCache(url + '?page_size=1', 'MISS')
+
+        self.write(lambda: QuizGroup.objects.create(user=self.alice, quiz_group_name='group-new', scope=True))
+        response = self.assertCache(url, 'MISS')
+        self.assertIn('group-new', [row['quiz_group_name'] for row in response.json()['results']])
+        self.assertCache(url, 'HIT')
+
+        self.write(lambda: self.quiz_groups[0].delete())
+        response = self.assertCache(url, 'MISS')
+        self.assertNotIn('group-0', [row['quiz_group_name'] for row in response.json()['results']])
+
+    # クイズの削除でクイズの一覧・クイズ数を表示するグループの一覧を無効化する
+    def test_quiz_delete(self):
+        for url in ('/quisapi/quiz/', '/quisapi/quiz-group/'):
+            self.assertCache(url, 'MISS')
+        self.write(lambda: Quiz.objects.filter(pk=self.quiz.pk).delete())
+        for url in ('/quisapi/quiz/', '/quisapi/quiz-group/'):
+            self.assertCache(url, 'MISS')
+        self.assertEqual(self.client.get('/quisapi/quiz/').json()['results'], [])
+
+    def test_retrieve(self):
+        url = '/quisapi/quiz/%s/' % self.quiz.pk
+        # 1回目はクイズが属するグループを記録するだけ
+        self.assertCache(url, None)
+        self.assertCache(url, 'MISS')
+        self.assertCache(url, 'HIT')
+
+        # 別のグループの変更では無効化しない
+        self.write(lambda: Quiz.objects.create(quiz_group=self.quiz_groups[1], quiz_title='other', quiz_content='content'))
+        self.assertCache(url, 'HIT')
+
+        def rename():
+            self.quiz.quiz_title = 'renamed'
+            self.quiz.save()
+        self.write(rename)
+        # クイズの変更ではグループの対応も記録し直す (移動の場合があるため)
+        response = self.assertCache(url, None)
+        self.assertEqual(response.json()['quiz_title'], 'renamed')
+        response = self.assertCache(url, 'MISS')
+        self.assertEqual(response.json()['quiz_title'], 'renamed')
+
+    def test_follow_invalidates_quiz_group(self):
+        url = '/quisapi/quiz-group/%s/' % self.quiz_groups[0].pk
+        self.assertCache(url, 'MISS')
+        self.assertCache(url, 'HIT')
+
+        bob = create_user('bob')
+        self.client.force_authenticate(bob)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put('/quisapi/follow/add/%s' % self.quiz_groups[0].pk)
+        self.assertEqual(response.status_code, 200)
+        # ログイン中のユーザのレスポンスはキャッシュしない
+        self.assertCache(url, None)
+
+        self.client.force_authenticate(None)
+        response = self.assertCache(url, 'MISS')
+        self.assertEqual(response.json()['followings'], 1)
+
+    def test_private_not_cached(self):
+        private = QuizGroup.objects.create(user=self.alice, quiz_group_name='private', scope=False)
+        for _ in range(3):
+            response = self.client.get('/quisapi/quiz-group/%s/' % private.pk)
+            self.assertEqual(response.status_code, 404)
+
+    def test_stats(self):
+        url = '/quisapi/quiz-group/'
+        before = cache.get_stats()
+        self.assertCache(url, 'MISS')
+        self.assertCache(url, 'HIT')
+        self.assertCache(url, 'HIT')
+        after = cache.get_stats()
+        self.assertEqual(after['miss'] - before['miss'], 1)
+        self.assertEqual(after['hit'] - before['hit'], 2)
+
+
+# 人気のクイズグループ (事前に作成したランキング)
+class TrendingTests(QuisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = create_user('alice')
+        self.users = [create_user('user-%d' % i) for i in range(6)]
+        self.now = timezone.now()
+
+    def create_group(self, name, follows, days_ago=0, quizzes=0, scope=True):
+        quiz_group = QuizGroup.objects.create(user=self.alice, quiz_group_name=name, scope=scope)
+        followed_at = self.now - datetime.timedelta(days=days_ago)
+        for user in self.users[:follows]:
+            Follower.objects.create(user=user, quiz_group=quiz_group, creation_date=followed_at)
+        for i in range(quizzes):
+            Quiz.objects.create(quiz_group=quiz_group, quiz_title='quiz-%d' % i, quiz_content='content')
+        Quiz.objects.filter(quiz_group=quiz_group).update(update_date=followed_at)
+        return quiz_group
+
+    def trending(self):
+        response = self.client.get('/quisapi/trending/')
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row['quiz_group_name'] for row in response.json()['results']]
+
+    def test_order(self):
+        self.create_group('old', follows=5, days_ago=10)
+        self.create_group('quizzes', follows=1, quizzes=2)
+        self.create_group('follows', follows=3)
+        self.create_group('private', follows=6, scope=False)
+        self.create_group('outside', follows=6, days_ago=30)
+        self.create_group('empty', follows=0)
+
+        self.assertEqual(trending.refresh_trending(self.now), 3)
+        # フォロー 3 > フォロー 1 + クイズ 2 × 0.5 > 10日前のフォロー 5 (半減期 48時間)
+        self.assertEqual(self.trending(), ['follows', 'quizzes', 'old'])
+        self.assertEqual(
+            list(TrendingScore.objects.order_by('rank').values_list('rank', flat=True)),
+            [1, 2, 3],
+        )
+
+    def test_refresh_and_scope(self):
+        quiz_group = self.create_group('group', follows=1)
+        self.assertEqual(self.trending(), [])
+        trending.refresh_trending(self.now)
+        self.assertEqual(self.trending(), ['group'])
+
+        # ランキング作成後に非公開になったグループは表示しない
+        QuizGroup.objects.filter(pk=quiz_group.pk).update(scope=False)
+        self.assertEqual(self.trending(), [])
+        trending.refresh_trending(self.now)
+        self.assertFalse(TrendingScore.objects.exists())
+
+    @override_settings(QUISAPI_TRENDING_SIZE=1)
+    def test_size(self):
+        self.create_group('first', follows=2)
+        self.create_group('second', follows=1)
+        self.assertEqual(trending.refresh_trending(self.now), 1)
+        self.assertEqual(self.trending(), ['first'])
+
+
+# エクスポート (自分のクイズグループのみを出力する)
+class ExportTests(QuisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.quiz_groups = [
+            QuizGroup.objects.create(user=self.alice, quiz_group_name='group-%d' % i, scope=bool(i % 2))
+            for i in range(3)
+        ]
+        for quiz_group in self.quiz_groups:
+            for i in range(2):
+                Quiz.objects.create(quiz_group=quiz_group, quiz_title='quiz-%d' % i, quiz_content='content')
+
+    def export(self, user):
+        self.client.force_authenticate(user)
+        response = self.client.get('/quisapi/export/')
+        self.assertEqual(response.status_code, 200)
+        body = b''.join(response.streaming_content)
+        return [json.loads(line) for line in body.splitlines()]
+
+    def test_other_user(self):
+        # 公開グループであっても他のユーザーのグループは出力しない
+        self.assertEqual(self.export(self.bob), [])
+
+    def test_lines(self):
+        lines = self.export(self.alice)
+        self.assertEqual(len(lines), 9)
+        # 各グループの行の直後にそのグループのクイズが続く
+        current = None
+        for line in lines:
+            if line['type'] == 'quiz_group':
+                current = line['uuid']
+            else:
+                self.assertEqual(line['quiz_group'], current)
+        self.assertEqual(
+            {line['uuid'] for line in lines if line['type'] == 'quiz_group'},
+            {str(quiz_group.pk) for quiz_group in self.quiz_groups},
+        )
+
+    def test_chunks(self):
+        # 件数によらずクエリは2回
+        with self.assertNumQueries(2):
+            chunks = list(transfer.export_lines(self.alice, chunk_size=2))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(sum(chunk.count(b'\n') for chunk in chunks), 9)
+
+    def test_unauthenticated(self):
+        response = self.client.get('/quisapi/export/')
+        self.assertEqual(response.status_code, 401)
+
+
+# メトリクスの計測・出力
+class MetricsTests(QuisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(create_user('alice'))
+        # 他のテストの計測値が混ざらないようにする
+        patcher = mock.patch.object(metrics, 'registry', metrics.Registry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def scrape(self, **kwargs):
+        response = self.client.get('/metrics', **kwargs)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        return response.content.decode().splitlines()
+
+    def test_output(self):
+        self.client.get('/quisapi/quiz-group/')
+        self.client.get('/quisapi/quiz-group/')
+        self.client.get('/quisapi/quiz-group/%s/' % uuid.uuid4())
+        lines = self.scrape()
+
+        labels = 'view="quizgroup-list",method="GET"'
+        self.assertIn('# TYPE quisapi_requests_total counter', lines)
+        self.assertIn('quisapi_requests_total{%s,status="2xx"} 2' % labels, lines)
+        self.assertIn('quisapi_requests_total{view="quizgroup-detail",method="GET",status="4xx"} 1', lines)
+        self.assertIn('# TYPE quisapi_db_queries histogram', lines)
+        self.assertIn('quisapi_db_queries_bucket{%s,le="+Inf"} 2' % labels, lines)
+        self.assertIn('quisapi_db_queries_count{%s} 2' % labels, lines)
+        self.assertIn('quisapi_request_duration_seconds_count{%s} 2' % labels, lines)
+        self.assertTrue(any(line.startswith('quisapi_response_bytes_total{%s} ' % labels) for line in lines))
+
+    def test_buckets(self):
+        registry = metrics.registry
+        for value in (0, 3, 4, 1000):
+            registry.observe('quisapi_db_queries', (('view', 'v'),), value, metrics.QUERY_BUCKETS)
+        lines = metrics.render(registry.snapshot()).splitlines()
+        # バケットは累積値
+        self.assertIn('quisapi_db_queries_bucket{view="v",le="0"} 1', lines)
+        self.assertIn('quisapi_db_queries_bucket{view="v",le="2"} 1', lines)
+        self.assertIn('quisapi_db_queries_bucket{view="v",le="5"} 3', lines)
+        self.assertIn('quisapi_db_queries_bucket{view="v",le="100"} 3', lines)
+        self.assertIn('quisapi_db_queries_bucket{view="v",le="+Inf"} 4', lines)
+        self.assertIn('quisapi_db_queries_sum{view="v"} 1007', lines)
+
+    def test_token(self):
+        with self.settings(QUISAPI_METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong')
+            self.assertEqual(response.status_code, 403)
+            self.scrape(HTTP_AUTHORIZATION='Bearer secret')
+
+    def test_processes(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        other = metrics.Registry()
+        other.inc('quisapi_requests_total', (('view', 'v'), ('method', 'GET'), ('status', '2xx')), 3)
+        with self.settings(QUISAPI_METRICS_DIR=directory):
+            # 別のプロセスが書き出したファイル
+            with mock.patch('os.getpid', return_value=0):
+                other.flush(force=True)
+            metrics.registry.inc('quisapi_requests_total', (('view', 'v'), ('method', 'GET'), ('status', '2xx')), 2)
+            lines = self.scrape()
+        self.assertIn('quisapi_requests_total{view="v",method="GET",status="2xx"} 5', lines)
+
+    @override_settings(QUISAPI_SLOW_REQUEST_SECONDS=1e-9)
+    def test_slow_request(self):
+        with self.assertLogs('quisapi.slow_request', 'WARNING') as logs:
+            self.client.get('/quisapi/quiz-group/')
+        self.assertIn('GET /quisapi/quiz-group/ (quizgroup-list)', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+
+# レプリカへの読み取りの振り分け (書き込み後はプライマリに固定する)
+@override_settings(QUISAPI_DB_REPLICAS=['replica1'], QUISAPI_DB_REPLICA_STICKY_SECONDS=10)
+class ReplicaRoutingTests(QuisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory()
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        patcher = mock.patch.object(routers.health, 'is_healthy', return_value=True)
+        self.is_healthy = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    # リクエストを処理し、ビューの中での読み取り先と応答を返す
+    def route(self, method, cookies=None, user=None):
+        request = getattr(self.factory, method)('/quisapi/quiz-group/')
+        if cookies:
+            request.COOKIES.update(cookies)
+        if user is not None:
+            request.META['HTTP_AUTHORIZATION'] = 'Bearer ' + issue_token(user)[0]
+        databases = []
+
+        def get_response(request):
+            # TestCase のトランザクションの外として判定する
+            with mock.patch.object(connections['default'], 'in_atomic_block', False):
+                databases.append(routers.ReplicaRouter().db_for_read(Quiz))
+            return HttpResponse()
+
+        response = routers.ReplicaRoutingMiddleware(get_response)(request)
+        return databases[0], response
+
+    def test_read(self):
+        database, response = self.route('get')
+        self.assertEqual(database, 'replica1')
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+        # リクエスト外はプライマリ
+        self.assertEqual(routers.ReplicaRouter().db_for_read(Quiz), 'default')
+        self.assertEqual(routers.ReplicaRouter().db_for_write(Quiz), 'default')
+
+    def test_cookie(self):
+        database, response = self.route('post')
+        self.assertEqual(database, 'default')
+        cookie = response.cookies[routers.PIN_COOKIE]
+        self.assertEqual(cookie['max-age'], 10)
+        self.assertTrue(cookie['httponly'])
+
+        database, _ = self.route('get', cookies={routers.PIN_COOKIE: cookie.value})
+        self.assertEqual(database, 'default')
+        database, _ = self.route('get')
+        self.assertEqual(database, 'replica1')
+
+    def test_token(self):
+        pins = caches[settings.QUISAPI_DB_REPLICA_PIN_CACHE_ALIAS]
+        self.addCleanup(pins.delete_many, [routers.pin_key(self.alice.pk), routers.pin_key(self.bob.pk)])
+        database, _ = self.route('get', user=self.alice)
+        self.assertEqual(database, 'replica1')
+
+        self.route('delete', user=self.alice)
+        self.assertEqual(pins.get(routers.pin_key(self.alice.pk)), 1)
+        # Cookie を送らないクライアントでも、書き込んだユーザはプライマリから読む
+        database, _ = self.route('get', user=self.alice)
+        self.assertEqual(database, 'default')
+        database, _ = self.route('get', user=self.bob)
+        self.assertEqual(database, 'replica1')
+
+    def test_unhealthy(self):
+        self.is_healthy.return_value = False
+        database, _ = self.route('get')
+        self.assertEqual(database, 'default')
+
+    def test_atomic(self):
+        request = self.factory.get('/quisapi/quiz-group/')
+        databases = []
+
+        def get_response(request):
+            databases.append(routers.ReplicaRouter().db_for_read(Quiz))
+            return HttpResponse()
+
+        routers.ReplicaRoutingMiddleware(get_response)(request)
+        self.assertEqual(databases, ['default'])
+
+    @override_settings(QUISAPI_DB_REPLICAS=[])
+    def test_disabled(self):
+        database, response = self.route('post', user=self.alice)
+        self.assertEqual(database, 'default')
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+        self.assertIsNone(caches[settings.QUISAPI_DB_REPLICA_PIN_CACHE_ALIAS].get(routers.pin_key(self.alice.pk)))
+
+
+# 認証のキャッシュ (ユーザと権限)
+@override_settings(QUISAPI_USER_CACHE_TIMEOUT=300)
+class CachedModelBackendTests(QuisAPITestCase):
+    def setUp(self):
+        super().setUp()
+        backends.get_cache().clear()
+        self.backend = CachedModelBackend()
+        self.alice = create_user('alice')
+        self.permission = Permission.objects.get(codename='add_quiz')
+
+    def get_user(self, queries):
+        with self.assertNumQueries(queries):
+            return self.backend.get_user(self.alice.pk)
+
+    def has_perm(self, queries):
+        user = self.get_user(0)
+        with self.assertNumQueries(queries):
+            return self.backend.has_perm(user, 'quisapi.add_quiz')
+
+    def test_user(self):
+        self.assertEqual(self.get_user(1), self.alice)
+        self.assertEqual(self.get_user(0), self.alice)
+        self.assertIsNone(self.backend.get_user(uuid.uuid4()))
+
+    def test_password(self):
+        self.get_user(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.set_password('changed')
+            self.alice.save()
+        self.assertTrue(self.get_user(1).check_password('changed'))
+
+    def test_deleted(self):
+        self.get_user(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            QuisAPIUser.objects.get(pk=self.alice.pk).delete()
+        self.assertIsNone(self.get_user(1))
+
+    def test_permission(self):
+        self.get_user(1)
+        self.assertFalse(self.has_perm(2))
+        self.assertFalse(self.has_perm(0))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.user_permissions.add(self.permission)
+        self.assertTrue(self.has_perm(2))
+        self.assertTrue(self.has_perm(0))
+
+    def test_group(self):
+        group = Group.objects.create(name='editors')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.groups.add(group)
+        self.get_user(1)
+        self.assertFalse(self.has_perm(2))
+        # グループの権限の変更はメンバー全員に反映される
+        with self.captureOnCommitCallbacks(execute=True):
+            group.permissions.add(self.permission)
+        self.assertTrue(self.has_perm(2))
+        with self.captureOnCommitCallbacks(execute=True):
+            group.delete()
+        self.assertFalse(self.has_perm(2))
+
+    # コミットされなかった変更では無効化しない
+    def test_rollback(self):
+        self.get_user(1)
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.alice.save()
+        self.assertEqual(len(callbacks), 1)
+        self.get_user(0)
+
+    @override_settings(QUISAPI_USER_CACHE_TIMEOUT=0)
+    def test_disabled(self):
+        self.get_user(1)
+        self.get_user(1)
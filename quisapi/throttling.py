@@ -0,0 +1,182 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.db import transaction
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from quisapi.models import ThrottleBucket
+
+KEY_PREFIX = 'quisapi:throttle'
+
+PERIODS = {
+    's': 1,
+    'm': 60,
+    'h': 60 * 60,
+    'd': 60 * 60 * 24,
+}
+
+# GCRA (Generic Cell Rate Algorithm) を Redis 上で原子的に実行する
+# キーごとに「理論上の次の到着時刻 (TAT)」を1つだけ保持する
+# 時刻はワーカー間のずれを避けるため Redis サーバの時刻を使う
+GCRA_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then
+    tat = now
+end
+local new_tat = tat + interval
+local allow_at = new_tat - tolerance
+if now < allow_at then
+    return tostring(allow_at - now)
+end
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+return '0'
+"""
+
+
+def parse_rate(rate):
+    num, period = rate.split('/')
+    return int(num), PERIODS[period[0]]
+
+
+# 1回の判定 (ローカルで計算する場合)
+# 返り値は (新しい TAT, 待ち時間)、許可された場合の待ち時間は 0
+def gcra(tat, now, interval, tolerance):
+    tat = max(tat, now)
+    new_tat = tat + interval
+    allow_at = new_tat - tolerance
+    if now < allow_at:
+        return tat, allow_at - now
+    return new_tat, 0
+
+
+# Redis に状態を持つストア (全ワーカーで共有、1回の往復で判定する)
+class RedisStore:
+    def __init__(self, cache):
+        self.cache = cache
+        self.script = None
+
+    def acquire(self, key, interval, tolerance):
+        key = self.cache.make_and_validate_key(key)
+        client = self.cache._cache.get_client(key, write=True)
+        if self.script is None:
+            self.script = client.register_script(GCRA_SCRIPT)
+        return float(self.script(keys=[key], args=[interval, tolerance], client=client))
+
+
+# データベースに状態を持つストア (Redis が無い場合の既定、全ワーカーで共有する)
+# キーの行をロックして判定するため、リクエストごとにプライマリへの書き込みが発生する
+class DatabaseStore:
+    @transaction.atomic
+    def acquire(self, key, interval, tolerance):
+        now = time.time()
+        bucket, _ = ThrottleBucket.objects.select_for_update().get_or_create(
+            key=key,
+            defaults={'tat': now},
+        )
+        tat, wait = gcra(bucket.tat, now, interval, tolerance)
+        if not wait:
+            bucket.tat = tat
+            bucket.save(update_fields=['tat'])
+        return wait
+
+
+# プロセス内に状態を持つストア (ワーカーごとに数えるため、全体の上限はワーカー数倍になる)
+# データベース・キャッシュへの往復は無い
+class LocalStore:
+    # 期限切れのキーを掃除する間隔 (キーの追加数)
+    PRUNE_INTERVAL = 1000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tats = {}
+        self.added = 0
+
+    def acquire(self, key, interval, tolerance):
+        now = time.time()
+        with self.lock:
+            if key not in self.tats:
+                self.added += 1
+                if self.added >= self.PRUNE_INTERVAL:
+                    self.added = 0
+                    self.tats = {k: tat for k, tat in self.tats.items() if tat > now}
+            tat, wait = gcra(self.tats.get(key, now), now, interval, tolerance)
+            if not wait:
+                self.tats[key] = tat
+        return wait
+
+
+_stores = {}
+
+
+# ストアの選択 (QUISAPI_THROTTLE_STORE)
+def get_store():
+    name = settings.QUISAPI_THROTTLE_STORE
+    if name not in _stores:
+        if name == 'redis':
+            cache = caches[settings.QUISAPI_THROTTLE_CACHE_ALIAS]
+            if not isinstance(cache, RedisCache):
+                raise ImproperlyConfigured('QUISAPI_THROTTLE_STORE=redis requires a Redis cache.')
+            _stores[name] = RedisStore(cache)
+        elif name == 'database':
+            _stores[name] = DatabaseStore()
+        elif name == 'local':
+            _stores[name] = LocalStore()
+        else:
+            raise ImproperlyConfigured('QUISAPI_THROTTLE_STORE must be redis, database or local.')
+    return _stores[name]
+
+
+# GCRA によるスロットリング
+# DRF の SimpleRateThrottle と違い、キーごとの状態はリクエスト数によらず1つの値だけ
+# スコープは view.throttle_scope (フォロー・一括操作など) か、未ログイン (anon) / 読み取り (read) / 書き込み (write)
+# 同時に送れる数は QUISAPI_THROTTLE_BURSTS で指定する (未指定の場合はレートの件数)
+class GCRAThrottle(BaseThrottle):
+    def get_scope(self, request, view):
+        if not request.user.is_authenticated:
+            return 'anon'
+        scope = getattr(view, 'throttle_scope', None)
+        if scope is not None:
+            return scope
+        if request.method in SAFE_METHODS:
+            return 'read'
+        return 'write'
+
+    def get_cache_key(self, request, scope):
+        if request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return '%s:%s:%s' % (KEY_PREFIX, scope, ident)
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        scope = self.get_scope(request, view)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+        if rate is None:
+            return True
+
+        num_requests, duration = parse_rate(rate)
+        burst = settings.QUISAPI_THROTTLE_BURSTS.get(scope, num_requests)
+        interval = duration / num_requests
+        wait = get_store().acquire(
+            self.get_cache_key(request, scope),
+            interval,
+            interval * burst,
+        )
+        if wait:
+            self.wait_seconds = wait
+            return False
+        return True
+
+    def wait(self):
+        return self.wait_seconds
@@ -0,0 +1,188 @@
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from rest_framework.settings import api_settings
+
+from quisapi import cache, draw, feed, search
+from quisapi.counters import add_quizzes
+from quisapi.models import QuizGroup, Quiz
+from quisapi.renderers import FastJSONRenderer
+from quisapi.serializers import QuizGroupTransferSerializer, QuizTransferSerializer, compile_values_serializer
+
+CHUNK_SIZE = 1000
+BATCH_SIZE = 500
+
+renderer = FastJSONRenderer()
+
+
+# エクスポート (NDJSON)
+# クイズグループの行の後にそのグループのクイズの行を続ける
+# グループとクイズをそれぞれ uuid 順のサーバサイドカーソルで読み、突き合わせながら出力するため
+# 件数によらずクエリは2回、メモリ上には1チャンク分しか保持しない
+def export_lines(user, chunk_size=CHUNK_SIZE):
+    group_columns, serialize_group = compile_values_serializer(QuizGroupTransferSerializer)
+    quiz_columns, serialize_quiz = compile_values_serializer(QuizTransferSerializer)
+    quiz_groups = QuizGroup.objects.filter(
+        user=user,
+    ).order_by(
+        'uuid',
+    ).values(
+        *group_columns,
+    ).iterator(chunk_size=chunk_size)
+    quizzes = Quiz.objects.filter(
+        quiz_group__user=user,
+    ).order_by(
+        'quiz_group',
+        'uuid',
+    ).values(
+        *quiz_columns,
+    ).iterator(chunk_size=chunk_size)
+
+    lines = []
+    quiz = next(quizzes, None)
+    for quiz_group in quiz_groups:
+        lines.append(renderer.render({'type': 'quiz_group', **serialize_group(quiz_group)}))
+        while quiz is not None and quiz['quiz_group_id'] == quiz_group['uuid']:
+            lines.append(renderer.render({'type': 'quiz', **serialize_quiz(quiz)}))
+            quiz = next(quizzes, None)
+        if len(lines) >= chunk_size:
+            yield b'\n'.join(lines) + b'\n'
+            lines = []
+    if lines:
+        yield b'\n'.join(lines) + b'\n'
+
+
+# 同期イテレータを非同期イテレータにする (ASGI で全体をメモリに読み込まずに送るため)
+# サーバサイドカーソルを同じスレッドで読むよう thread_sensitive で実行する
+async def aiterate(iterator):
+    iterator = iter(iterator)
+    while True:
+        chunk = await sync_to_async(next, thread_sensitive=True)(iterator, None)
+        if chunk is None:
+            break
+        yield chunk
+
+
+# インポート (NDJSON)
+# 行ごとに検証し、一定件数ごとに bulk_create でまとめて書き込む
+# バッチはセーブポイント内で書き込み、一意制約の違反があればそのバッチだけ1行ずつ書き直して
+# 失敗した行を errors に記録する
+class Importer:
+    def __init__(self, user, batch_size=BATCH_SIZE):
+        self.user = user
+        self.batch_size = batch_size
+        # エクスポート時の uuid -> 作成したクイズグループ
+        self.quiz_groups = {}
+        self.pending_groups = []
+        self.pending_quizzes = []
+        self.created_groups = 0
+        self.created_quizzes = 0
+        self.errors = {}
+
+    def feed(self, line_number, data):
+        if not isinstance(data, dict) or data.get('type') not in ('quiz_group', 'quiz'):
+            self.errors[line_number] = {'type': ['Expected "quiz_group" or "quiz".']}
+            return
+
+        if data['type'] == 'quiz_group':
+            serializer = QuizGroupTransferSerializer(data=data)
+            if not serializer.is_valid():
+                self.errors[line_number] = serializer.errors
+                return
+            self.pending_groups.append((
+                line_number,
+                str(data.get('uuid')),
+                QuizGroup(user=self.user, **serializer.validated_data),
+            ))
+        else:
+            serializer = QuizTransferSerializer(data=data)
+            if not serializer.is_valid():
+                self.errors[line_number] = serializer.errors
+                return
+            attrs = serializer.validated_data
+            self.pending_quizzes.append((
+                line_number,
+                str(attrs.pop('quiz_group_id')),
+                Quiz(**attrs),
+            ))
+
+        if len(self.pending_groups) + len(self.pending_quizzes) >= self.batch_size:
+            self.flush()
+
+    def finish(self):
+        self.flush()
+        if self.created_groups or self.created_quizzes:
+            cache.invalidate('quiz-group', 'quiz')
+
+    def flush(self):
+        if self.pending_groups:
+            created = self.insert(self.pending_groups)
+            for (line_number, exported_uuid, quiz_group) in created:
+                self.quiz_groups[exported_uuid] = quiz_group
+            self.created_groups += len(created)
+            self.pending_groups = []
+
+        if self.pending_quizzes:
+            self.insert_quizzes(self.pending_quizzes)
+            self.pending_quizzes = []
+
+    # クイズの追加先のグループを解決する
+    # ファイル内で作成したグループか、自分の既存のグループ (1回のクエリでまとめて取得する)
+    def resolve_quiz_groups(self, items):
+        unknown = {
+            exported_uuid
+            for line_number, exported_uuid, quiz in items
+            if exported_uuid not in self.quiz_groups
+        }
+        if unknown:
+            for quiz_group in QuizGroup.objects.filter(user=self.user, uuid__in=unknown):
+                self.quiz_groups[str(quiz_group.uuid)] = quiz_group
+
+    def insert_quizzes(self, items):
+        self.resolve_quiz_groups(items)
+        by_group = {}
+        for line_number, exported_uuid, quiz in items:
+            quiz_group = self.quiz_groups.get(exported_uuid)
+            if quiz_group is None:
+                self.errors[line_number] = {'quiz_group': ['Not found.']}
+                continue
+            quiz.quiz_group = quiz_group
+            by_group.setdefault(quiz_group.pk, []).append((line_number, exported_uuid, quiz))
+
+        for quiz_group_pk, group_items in by_group.items():
+            quiz_group = group_items[0][2].quiz_group
+            draw.assign_draw_indexes(quiz_group_pk, [quiz for _, _, quiz in group_items])
+            created = [quiz for _, _, quiz in self.insert(group_items)]
+            if not created:
+                continue
+            # bulk_create はシグナルを送らないため明示的に反映する
+            # (既存のグループはクイズ数・最終更新日時が変わるため、詳細表示のキャッシュも無効化する)
+            add_quizzes(quiz_group_pk, len(created), max(quiz.update_date for quiz in created))
+            cache.invalidate_quiz(quiz_group_pk)
+            search.index_quizzes(created, quiz_group)
+            feed.fan_out(quiz_group_pk, created)
+            self.created_quizzes += len(created)
+
+    # セーブポイント内でまとめて書き込み、失敗した場合は1行ずつ書き込む
+    # 書き込めた (行番号, uuid, オブジェクト) を返す
+    def insert(self, items):
+        model = type(items[0][2])
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create([obj for _, _, obj in items])
+            return items
+        except IntegrityError:
+            pass
+
+        created = []
+        for item in items:
+            line_number, exported_uuid, obj = item
+            try:
+                with transaction.atomic():
+                    model.objects.bulk_create([obj])
+            except IntegrityError:
+                self.errors[line_number] = {
+                    api_settings.NON_FIELD_ERRORS_KEY: ['duplicate key value violates unique constraint'],
+                }
+                continue
+            created.append(item)
+        return created
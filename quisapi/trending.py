@@ -0,0 +1,75 @@
+import collections
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDay
+from django.utils import timezone
+
+from quisapi.models import Quiz, Follower, TrendingScore
+
+BATCH_SIZE = 1000
+# クイズの作成・更新1件あたりの重み (フォロー1件を 1 とする)
+QUIZ_WEIGHT = 0.5
+
+
+# 日ごとの件数を集計する
+def count_by_day(queryset, date_field, since):
+    return queryset.filter(
+        **{'%s__gte' % date_field: since},
+        quiz_group__scope=True,
+    ).annotate(
+        day=TruncDay(date_field),
+    ).order_by().values(
+        'quiz_group',
+        'day',
+    ).annotate(
+        count=Count('pk'),
+    )
+
+
+# 公開グループのスコアを計算する
+# 集計期間内のフォローとクイズの作成・更新を、経過時間に応じて半減させながら足し合わせる
+def compute_scores(now):
+    since = now - datetime.timedelta(days=settings.QUISAPI_TRENDING_WINDOW_DAYS)
+    half_life = settings.QUISAPI_TRENDING_HALF_LIFE_HOURS * 60 * 60
+
+    scores = collections.defaultdict(float)
+    for queryset, date_field, weight in (
+        (Follower.objects.all(), 'creation_date', 1.0),
+        (Quiz.objects.all(), 'update_date', QUIZ_WEIGHT),
+    ):
+        for row in count_by_day(queryset, date_field, since):
+            # 日の途中の時刻を代表値とする
+            age = max((now - row['day']).total_seconds() - 12 * 60 * 60, 0)
+            scores[row['quiz_group']] += weight * row['count'] * 0.5 ** (age / half_life)
+    return scores
+
+
+# ランキングを作り直す
+# 入れ替えは1トランザクションで行うため、閲覧中に空や途中の状態は見えない
+# 掲載したグループ数を返す
+def refresh_trending(now=None):
+    if now is None:
+        now = timezone.now()
+
+    scores = compute_scores(now)
+    ranking = sorted(scores.items(), key=lambda item: (-item[1], str(item[0])))
+    ranking = ranking[:settings.QUISAPI_TRENDING_SIZE]
+
+    with transaction.atomic():
+        TrendingScore.objects.all().delete()
+        TrendingScore.objects.bulk_create(
+            [
+                TrendingScore(
+                    quiz_group_id=quiz_group_pk,
+                    rank=rank,
+                    score=score,
+                    computed_at=now,
+                )
+                for rank, (quiz_group_pk, score) in enumerate(ranking, start=1)
+            ],
+            batch_size=BATCH_SIZE,
+        )
+    return len(ranking)
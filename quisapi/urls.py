@@ -1,7 +1,7 @@
 from django.urls import path, include
 from rest_framework import routers
 
-from quisapi import views
+from quisapi import views, async_views
 
 quiz_group_router = routers.SimpleRouter()
 quiz_group_router.register('quiz-group', views.QuizGroupCRUD)
@@ -13,7 +13,32 @@ urlpatterns = [
     path('', include(quiz_group_router.urls)),
     # クイズ
     path('', include(quiz_router.urls)),
+    # 署名付きトークンの発行・失効
+    path('token/', views.TokenView.as_view()),
+    path('token/revoke/', views.TokenRevokeView.as_view()),
     # フォロー
     path('follow/add/<pk>', views.FollowView.as_view()),
     path('follow/remove/<pk>', views.UnfollowView.as_view()),
+    # フォローの一括登録・解除・状態の取得
+    path('follow/add/', views.BatchFollowView.as_view()),
+    path('follow/remove/', views.BatchUnfollowView.as_view()),
+    path('follow/status/', views.FollowStatusView.as_view()),
+    # フィード
+    path('feed/', views.FeedView.as_view()),
+    # 人気ランキング
+    path('trending/', views.TrendingView.as_view()),
+    # エクスポート・インポート
+    path('export/', views.ExportView.as_view()),
+    path('import/', views.ImportView.as_view()),
+    # 解答の記録
+    path('attempts/', views.AttemptView.as_view()),
+    # 検索
+    path('search/', views.SearchView.as_view()),
+    # 非同期 (ASGI) 版
+    path('async/quiz-group/', async_views.AsyncQuizGroupView.as_view()),
+    path('async/quiz-group/<pk>/', async_views.AsyncQuizGroupView.as_view()),
+    path('async/quiz/', async_views.AsyncQuizView.as_view()),
+    path('async/quiz/<pk>/', async_views.AsyncQuizView.as_view()),
+    path('async/follow/add/<pk>', async_views.AsyncFollowView.as_view()),
+    path('async/follow/remove/<pk>', async_views.AsyncUnfollowView.as_view()),
 ]
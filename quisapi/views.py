@@ -1,200 +1,703 @@
-from django.db import transaction
-from django.db.models import Q
+import uuid as uuid_lib
+
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError, transaction
+from django.http import Http404, StreamingHttpResponse
+from django.db.models import Count, Max, Q, Sum
 from django.shortcuts import get_object_or_404
-from rest_framework import viewsets, views, status
-from rest_framework.pagination import PageNumberPagination
+from rest_framework import generics, viewsets, views, status, serializers
+from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated
 from rest_framework.response import Response
-
+from rest_framework.settings import api_settings
+
+from quisapi import cache, draw, feed, review, search, transfer
+from quisapi.authentication import issue_token
+from quisapi.cache import PublicResponseCacheMixin
+from quisapi.conditional import ConditionalGetMixin
+from quisapi.counters import add_followings, add_followings_many, add_quizzes
+from quisapi.metrics import measure_serialize
 from quisapi.models import QuizGroup, Quiz, Follower
-from quisapi.serializers import QuizGroupSerializer, QuizSerializer, FollowerSerializer
+from quisapi.pagination import StandardResultsSetPagination, KeysetPagination, KeysetPaginationMixin
+from quisapi.parsers import NDJSONParser
+from quisapi.permissions import IsOwnerOrReadOnly
+from quisapi.querybudget import QueryBudgetMixin
+from quisapi.serializers import (
+    QuizGroupSerializer,
+    QuizSerializer,
+    FollowBatchSerializer,
+    QuizBulkSerializer,
+    FeedSerializer,
+    SearchSerializer,
+    TrendingSerializer,
+    PracticeSerializer,
+    DrawQuerySerializer,
+    AttemptSerializer,
+    DueQuerySerializer,
+    TokenObtainSerializer,
+    compile_values_serializer,
+)
+from quisapi.visibility import quiz_group_branches, quiz_branches, combine
+
+
+# UUIDとして解釈できるか
+def is_valid_uuid(value):
+    try:
+        uuid_lib.UUID(str(value))
+    except ValueError:
+        return False
+    return True
+
+
+# 閲覧範囲の分岐を結合する
+# 一覧は UNION ALL、単一オブジェクトの取得は pk で絞り込むため OR で結合する
+class VisibilityMixin:
+    def get_visibility_branches(self, queryset):
+        raise NotImplementedError
 
+    def get_queryset(self):
+        branches = self.get_visibility_branches(super().get_queryset())
+        if self.action == 'list':
+            return combine(branches, self.keyset_ordering)
 
-# ページネーション
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 10
-    page_size_query_param = 'page_size'
-    max_page_size = 1000
+        return self.combine_or(branches).order_by(*self.keyset_ordering)
 
+    # 集計用 (OR で結合した1回の走査で済む)
+    def get_aggregate_queryset(self):
+        return self.combine_or(self.get_visibility_branches(super().get_queryset()))
 
-# クイズグループCRUD
-class QuizGroupCRUD(viewsets.ModelViewSet):
-    queryset = QuizGroup.objects.all()
-    serializer_class = QuizGroupSerializer
-    pagination_class = StandardResultsSetPagination
-    permission_classes = [IsAuthenticatedOrReadOnly]
+    def combine_or(self, branches):
+        first, *rest = branches
+        for branch in rest:
+            first = first | branch
+        return first
 
-    def get_queryset(self):
-        query_set = super().get_queryset()
-        if self.request.user.is_authenticated:
-            query_set = query_set.filter(
-                Q(user=self.request.user) |
-                Q(scope=True)
-            ).distinct()
-        else:
-            query_set = query_set.filter(
-                scope=True,
-            )
 
-        return query_set.order_by('quiz_group_name')
+# 一覧表示は values() の行を、事前にコンパイルした関数でシリアライズする
+class ValuesListMixin:
+    def list(self, request, *args, **kwargs):
+        columns, serialize = compile_values_serializer(self.get_serializer_class())
+        ordering = [field.lstrip('-') for field in self.keyset_ordering]
+        fields = list(dict.fromkeys([*columns, *ordering]))
+        queryset = self.filter_queryset(self.get_queryset()).values(*fields)
 
-    # クイズグループの作成者のみ編集可能
-    def update(self, request, *args, **kwargs):
-        quiz_group = get_object_or_404(
-            QuizGroup,
-            uuid=self.request.resolver_match.kwargs['pk'],
-        )
-        if quiz_group.user != self.request.user:
-            return Response(status.HTTP_403_FORBIDDEN)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            with measure_serialize():
+                data = [serialize(row) for row in page]
+            return self.get_paginated_response(data)
 
-        partial = kwargs.pop('partial', False)
-        instance = self.get_object()
-        serializer = self.get_serializer(instance, data=request.data, partial=partial)
-        serializer.is_valid(raise_exception=True)
-        self.perform_update(serializer)
+        rows = list(queryset)
+        with measure_serialize():
+            data = [serialize(row) for row in rows]
+        return Response(data)
 
-        if getattr(instance, '_prefetched_objects_cache', None):
-            # If 'prefetch_related' has been applied to a queryset, we need to
-            # forcibly invalidate the prefetch cache on the instance.
-            instance._prefetched_objects_cache = {}
 
+# クイズグループCRUD
+class QuizGroupCRUD(
+    QueryBudgetMixin,
+    ConditionalGetMixin,
+    PublicResponseCacheMixin,
+    ValuesListMixin,
+    VisibilityMixin,
+    KeysetPaginationMixin,
+    viewsets.ModelViewSet,
+):
+    queryset = QuizGroup.objects.all()
+    serializer_class = QuizGroupSerializer
+    pagination_class = StandardResultsSetPagination
+    keyset_ordering = ('quiz_group_name', 'uuid')
+    # クイズグループの作成者のみ編集・削除可能
+    permission_classes = [IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
+    owner_field = 'user_id'
+    bulk_max_items = 1000
+    # スロットリングのスコープ (アクションごとに上書きする)
+    throttle_scope = None
+    cache_namespace = 'quiz-group'
+    # アクションごとのクエリ数の上限
+    # 削除は関連テーブルの数だけカスケードの削除が、一括操作は SQLite では bulk_create の分割の分だけ増える
+    query_budget = {
+        'list': 4,
+        'retrieve': 3,
+        'create': 4,
+        'update': 6,
+        'partial_update': 6,
+        'destroy': 16,
+        'quizzes': 20,
+        'draw_quizzes': 8,
+        'due': 5,
+    }
+    # フォロー数・クイズ数の変更では update_date が更新されないため検証に含め、
+    # update_date だけの If-Modified-Since では判定しない
+    etag_fields = ('update_date', 'followings', 'quiz_count', 'last_quiz_activity')
+    use_last_modified = False
+    etag_aggregates = {
+        'last_modified': Max('update_date'),
+        'count': Count('pk'),
+        'followings': Sum('followings'),
+        'quiz_count': Sum('quiz_count'),
+        'last_quiz_activity': Max('last_quiz_activity'),
+    }
+
+    def get_visibility_branches(self, queryset):
+        return quiz_group_branches(self.request.user, queryset)
+
+    # クイズの一括登録・更新・削除 (クイズグループの作成者のみ)
+    # 作成者の確認は1回だけ行い、1トランザクションでまとめて書き込む
+    @action(
+        detail=True,
+        methods=['post', 'put', 'patch', 'delete'],
+        parser_classes=[JSONParser, NDJSONParser],
+        throttle_scope='bulk',
+    )
+    def quizzes(self, request, *args, **kwargs):
+        quiz_group = self.get_object()
+        if not isinstance(request.data, list):
+            raise ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: ['Expected a list of items.'],
+            })
+        if len(request.data) > self.bulk_max_items:
+            raise ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    'Ensure this list has no more than %d items.' % self.bulk_max_items,
+                ],
+            })
+
+        if request.method == 'DELETE':
+            return self.bulk_destroy_quizzes(request, quiz_group)
+
+        instance = None
+        if request.method in ('PUT', 'PATCH'):
+            uuids = [item.get('uuid') for item in request.data if isinstance(item, dict)]
+            instance = {
+                quiz.uuid: quiz
+                for quiz in Quiz.objects.filter(
+                    quiz_group=quiz_group,
+                    uuid__in=[uuid for uuid in uuids if is_valid_uuid(uuid)],
+                )
+            }
+
+        serializer = QuizBulkSerializer(
+            instance,
+            data=request.data,
+            many=True,
+            partial=request.method == 'PATCH',
+            context={
+                **self.get_serializer_context(),
+                'quiz_group': quiz_group,
+            },
+        )
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            serializer.save()
+            # bulk_create / bulk_update はシグナルを送らないため明示的に無効化・配信する
+            cache.invalidate_quiz(quiz_group.pk)
+            search.index_quizzes(serializer.instance, quiz_group)
+            # 最終更新日時は再計算 (reconcile_quizzes) と同じく、クイズの update_date にする
+            activity = max((quiz.update_date for quiz in serializer.instance), default=None)
+            if instance is None:
+                add_quizzes(quiz_group.pk, len(serializer.instance), activity)
+                feed.fan_out(quiz_group.pk, serializer.instance)
+            else:
+                add_quizzes(quiz_group.pk, 0, activity)
+
+        if instance is None:
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.data)
 
-    # クイズグループの作成者のみ削除可能
-    def destroy(self, request, *args, **kwargs):
-        quiz_group = get_object_or_404(
-            QuizGroup,
-            uuid=self.request.resolver_match.kwargs['pk'],
+    # クイズの無作為抽出 (?n=件数&exclude=出題済みのuuid,...)
+    # グループ全体を取得せず、重複しない n 件だけを返す
+    @action(detail=True, methods=['get'], url_path='draw')
+    def draw_quizzes(self, request, *args, **kwargs):
+        quiz_group = self.get_object()
+        params = DrawQuerySerializer(data={
+            'n': request.query_params.get('n', DrawQuerySerializer.default_items),
+            'exclude': [
+                uuid
+                for value in request.query_params.getlist('exclude')
+                for uuid in value.split(',')
+                if uuid
+            ],
+        })
+        params.is_valid(raise_exception=True)
+
+        columns, serialize = compile_values_serializer(PracticeSerializer)
+        rows = draw.draw(
+            Quiz.objects.values(*columns, 'draw_index'),
+            quiz_group,
+            params.validated_data['n'],
+            params.validated_data['exclude'],
         )
-        if quiz_group.user != self.request.user:
-            return Response(status.HTTP_403_FORBIDDEN)
+        return Response([serialize(row) for row in rows])
+
+    # 復習対象のクイズ (?n=件数)
+    # フォロー中 (または自分) のグループで、出題日時を過ぎたクイズと未解答のクイズを返す
+    @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
+    def due(self, request, *args, **kwargs):
+        quiz_group = self.get_object()
+        if quiz_group.user_id != request.user.pk and not Follower.objects.filter(
+            user=request.user,
+            quiz_group=quiz_group,
+        ).exists():
+            raise PermissionDenied('Follow this quiz group to review it.')
+
+        params = DueQuerySerializer(data={
+            'n': request.query_params.get('n', DueQuerySerializer.default_items),
+        })
+        params.is_valid(raise_exception=True)
+
+        columns, serialize = compile_values_serializer(PracticeSerializer)
+        rows = review.due(
+            Quiz.objects.values(*columns),
+            request.user,
+            quiz_group,
+            params.validated_data['n'],
+        )
+        return Response([serialize(row) for row in rows])
+
+    def bulk_destroy_quizzes(self, request, quiz_group):
+        serializer = serializers.ListField(
+            child=serializers.UUIDField(),
+        )
+        uuids = serializer.run_validation(request.data)
+
+        with transaction.atomic():
+            quizzes = Quiz.objects.filter(
+                quiz_group=quiz_group,
+                uuid__in=uuids,
+            )
+            found = set(quizzes.values_list('uuid', flat=True))
+            errors = {
+                index: {'uuid': ['Not found.']}
+                for index, uuid in enumerate(uuids)
+                if uuid not in found
+            }
+            if errors:
+                raise ValidationError(errors)
+            quizzes.delete()
 
-        instance = self.get_object()
-        self.perform_destroy(instance)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 # クイズCRUD
-class QuizCRUD(viewsets.ModelViewSet):
+class QuizCRUD(
+    QueryBudgetMixin,
+    ConditionalGetMixin,
+    PublicResponseCacheMixin,
+    ValuesListMixin,
+    VisibilityMixin,
+    KeysetPaginationMixin,
+    viewsets.ModelViewSet,
+):
     queryset = Quiz.objects.all()
     serializer_class = QuizSerializer
     pagination_class = StandardResultsSetPagination
-    permission_classes = [IsAuthenticatedOrReadOnly]
-
-    def get_queryset(self):
-        query_set = super().get_queryset()
-        if self.request.user.is_authenticated:
-            query_set = query_set.filter(
-                Q(quiz_group__user=self.request.user) |
-                Q(quiz_group__scope=True)
-            ).distinct()
-        else:
-            query_set = query_set.filter(
-                quiz_group__scope=True,
-            )
-
-        return query_set.order_by('quiz_title')
+    keyset_ordering = ('quiz_title', 'uuid')
+    # クイズの作成者のみ編集・削除可能
+    permission_classes = [IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
+    owner_field = 'quiz_group.user_id'
+    cache_namespace = 'quiz'
+    query_budget = {
+        'list': 4,
+        'retrieve': 3,
+        'create': 8,
+        'update': 10,
+        'partial_update': 10,
+        'destroy': 8,
+    }
+    cache_quiz_group_field = 'quiz_group'
+    etag_fields = ('update_date', 'quiz_group_id')
+    etag_aggregates = {
+        'last_modified': Max('update_date'),
+        'count': Count('pk'),
+    }
+
+    def get_visibility_branches(self, queryset):
+        if self.action != 'list':
+            # 権限の判定でクイズグループを参照するため同時に取得する
+            queryset = queryset.select_related('quiz_group')
+
+        return quiz_branches(self.request.user, queryset)
 
     # クイズグループの作成者のみクイズを追加可能
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        if serializer.validated_data['quiz_group'].user != self.request.user:
-            return Response(status.HTTP_403_FORBIDDEN)
+        # 作成者の判定は外部キーの値で行う (ユーザを取得しない)
+        if serializer.validated_data['quiz_group'].user_id != self.request.user.pk:
+            raise PermissionDenied()
 
-        self.perform_create(serializer)
+        # 抽選用連番の採番から保存までを1トランザクションで行う
+        with transaction.atomic():
+            self.perform_create(serializer)
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
-    # クイズの作成者のみ編集可能
-    def update(self, request, *args, **kwargs):
-        quiz = get_object_or_404(
-            Quiz,
-            uuid=self.request.resolver_match.kwargs['pk'],
-        )
-        if quiz.quiz_group.user != self.request.user:
-            return Response(status.HTTP_403_FORBIDDEN)
+    # 別のグループへの移動では移動先で採番するため、更新も1トランザクションで行う
+    # 移動先も自分のクイズグループに限る (IsOwnerOrReadOnly は移動元のグループで判定する)
+    @transaction.atomic
+    def perform_update(self, serializer):
+        quiz_group = serializer.validated_data.get('quiz_group')
+        if quiz_group is not None and quiz_group.user_id != self.request.user.pk:
+            raise PermissionDenied()
+        super().perform_update(serializer)
 
-        partial = kwargs.pop('partial', False)
-        instance = self.get_object()
-        serializer = self.get_serializer(instance, data=request.data, partial=partial)
-        serializer.is_valid(raise_exception=True)
-        self.perform_update(serializer)
 
-        if getattr(instance, '_prefetched_objects_cache', None):
-            # If 'prefetch_related' has been applied to a queryset, we need to
-            # forcibly invalidate the prefetch cache on the instance.
-            instance._prefetched_objects_cache = {}
+# フォロー
+# 同期・非同期のビューで共有する
+# 対象は URL のクイズグループ、フォローするのはリクエストのユーザ (本文は使わない)
+# 一括フォロー (follow_quiz_groups) と同じく、閲覧できないグループは存在しないものとして扱い、自分のグループはフォローできない
+@transaction.atomic
+def follow_quiz_group(user, pk):
+    if not is_valid_uuid(pk):
+        raise Http404
+    quiz_group = get_object_or_404(
+        QuizGroup.objects.filter(
+            Q(scope=True) | Q(user=user),
+        ).only(
+            'uuid',
+            'user_id',
+        ),
+        uuid=pk,
+    )
+    if quiz_group.user_id == user.pk:
+        raise ValidationError({
+            api_settings.NON_FIELD_ERRORS_KEY: ['The creator himself cannot be followed'],
+        })
+
+    try:
+        with transaction.atomic():
+            Follower.objects.create(
+                user=user,
+                quiz_group=quiz_group,
+            )
+    except IntegrityError:
+        raise ValidationError({
+            api_settings.NON_FIELD_ERRORS_KEY: ['duplicate key value violates unique constraint'],
+        })
+    add_followings(quiz_group.pk, 1)
+    feed.on_follow(user, [quiz_group.pk])
 
-        return Response(serializer.data)
 
-    # クイズの作成者のみ削除可能
-    def destroy(self, request, *args, **kwargs):
-        quiz = get_object_or_404(
-            Quiz,
-            uuid=self.request.resolver_match.kwargs['pk'],
+# フォロー解除
+@transaction.atomic
+def unfollow_quiz_group(user, pk):
+    quiz_group = get_object_or_404(
+        QuizGroup,
+        uuid=pk
+    )
+
+    get_object_or_404(
+        Follower,
+        user=user,
+        quiz_group=quiz_group,
+    ).delete()
+    add_followings(quiz_group.pk, -1)
+    feed.on_unfollow(user, [quiz_group.pk])
+
+
+# 複数のクイズグループをまとめてフォローする
+# 一意制約 (user, quiz_group) で既にフォロー中のものを読み飛ばし、新たにフォローしたグループを返す
+# 対象のグループ数によらずクエリの回数は一定
+@transaction.atomic
+def follow_quiz_groups(user, quiz_group_pks):
+    quiz_group_pks = list(dict.fromkeys(quiz_group_pks))
+    # 閲覧できないグループ (他人の非公開グループ) は存在しないものとして扱う
+    authors = dict(
+        QuizGroup.objects.filter(
+            Q(scope=True) | Q(user=user),
+            uuid__in=quiz_group_pks,
+        ).values_list(
+            'uuid',
+            'user_id',
+        )
+    )
+    errors = {}
+    for index, quiz_group_pk in enumerate(quiz_group_pks):
+        if quiz_group_pk not in authors:
+            errors[index] = ['Not found.']
+        elif authors[quiz_group_pk] == user.pk:
+            errors[index] = ['The creator himself cannot be followed']
+    if errors:
+        raise ValidationError({'quiz_groups': errors})
+
+    followers = [
+        Follower(user=user, quiz_group_id=quiz_group_pk)
+        for quiz_group_pk in quiz_group_pks
+    ]
+    Follower.objects.bulk_create(followers, ignore_conflicts=True)
+    # 読み飛ばされた行は主キーが一致しないため、実際に作成した行だけが見つかる
+    created = list(
+        Follower.objects.filter(
+            pk__in=[follower.pk for follower in followers],
+        ).values_list(
+            'quiz_group_id',
+            flat=True,
         )
-        if quiz.quiz_group.user != self.request.user:
-            return Response(status.HTTP_403_FORBIDDEN)
+    )
+
+    # bulk_create はシグナルを送らないため明示的に無効化する
+    add_followings_many(created, 1)
+    cache.invalidate_followings(*created)
+    feed.on_follow(user, created)
+    return created
+
+
+# 複数のクイズグループのフォローをまとめて解除し、解除したグループを返す
+# フォローしていないグループは読み飛ばす
+@transaction.atomic
+def unfollow_quiz_groups(user, quiz_group_pks):
+    followers = dict(
+        Follower.objects.select_for_update().filter(
+            user=user,
+            quiz_group__in=quiz_group_pks,
+        ).values_list(
+            'pk',
+            'quiz_group_id',
+        )
+    )
+    Follower.objects.filter(
+        pk__in=list(followers),
+    ).delete()
+
+    deleted = list(followers.values())
+    add_followings_many(deleted, -1)
+    feed.on_unfollow(user, deleted)
+    return deleted
+
+
+# 署名付きトークンの発行 (ユーザ名・パスワードによる)
+# 以降のリクエストでは Authorization: Bearer <トークン> を付ける
+class TokenView(views.APIView):
+    authentication_classes = []
+    permission_classes = []
+
+    def post(self, request, *args, **kwargs):
+        serializer = TokenObtainSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        token, expires = issue_token(serializer.validated_data['user'])
+        return Response({'token': token, 'expires': expires})
 
-        instance = self.get_object()
-        self.perform_destroy(instance)
+
+# 発行済みのトークンを全て失効させる
+class TokenRevokeView(views.APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        request.user.revoke_tokens()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 # フォロー
-class FollowView(views.APIView):
+class FollowView(QueryBudgetMixin, views.APIView):
     permission_classes = [IsAuthenticated]
+    throttle_scope = 'follow'
+    # フィードのタイムラインを作成する場合を含む
+    query_budget = 12
+
+    def put(self, request, pk, *args, **kwargs):
+        follow_quiz_group(request.user, pk)
+        return Response(status.HTTP_200_OK)
+
+
+# フォロー解除
+class UnfollowView(QueryBudgetMixin, views.APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'follow'
+    # フォロー数をシャードに分散する場合を含む
+    query_budget = 8
 
-    @transaction.atomic
     def put(self, request, pk, *args, **kwargs):
-        quiz_group = get_object_or_404(
-            QuizGroup,
-            uuid=pk
+        unfollow_quiz_group(request.user, pk)
+        return Response(status.HTTP_200_OK)
+
+
+# フォローの一括登録
+class BatchFollowView(QueryBudgetMixin, views.APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'follow'
+    # フィードのタイムラインを作成する場合を含む
+    query_budget = 12
+
+    def put(self, request, *args, **kwargs):
+        serializer = FollowBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        created = follow_quiz_groups(request.user, serializer.validated_data['quiz_groups'])
+        return Response({'followed': created})
+
+
+# フォローの一括解除
+class BatchUnfollowView(QueryBudgetMixin, views.APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'follow'
+    query_budget = 8
+
+    def put(self, request, *args, **kwargs):
+        serializer = FollowBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        deleted = unfollow_quiz_groups(request.user, serializer.validated_data['quiz_groups'])
+        return Response({'unfollowed': deleted})
+
+
+# フォロー状態の一括取得 (?quiz_groups=uuid,...)
+# 指定したグループごとにフォロー中かどうかを返す
+class FollowStatusView(QueryBudgetMixin, views.APIView):
+    permission_classes = [IsAuthenticated]
+    query_budget = 1
+
+    def get(self, request, *args, **kwargs):
+        serializer = FollowBatchSerializer(data={
+            'quiz_groups': [
+                uuid
+                for value in request.query_params.getlist('quiz_groups')
+                for uuid in value.split(',')
+                if uuid
+            ],
+        })
+        serializer.is_valid(raise_exception=True)
+        quiz_group_pks = serializer.validated_data['quiz_groups']
+
+        following = set(
+            Follower.objects.filter(
+                user=request.user,
+                quiz_group__in=quiz_group_pks,
+            ).values_list(
+                'quiz_group_id',
+                flat=True,
+            )
         )
-        serializer = FollowerSerializer(
-            instance=quiz_group,
+        return Response({
+            str(quiz_group_pk): quiz_group_pk in following
+            for quiz_group_pk in quiz_group_pks
+        })
+
+
+# 解答の一括記録
+class AttemptView(QueryBudgetMixin, views.APIView):
+    permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser, NDJSONParser]
+    throttle_scope = 'bulk'
+    bulk_max_items = 1000
+    # 件数によらず一定
+    query_budget = 6
+
+    def post(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            raise ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: ['Expected a list of items.'],
+            })
+        if len(request.data) > self.bulk_max_items:
+            raise ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    'Ensure this list has no more than %d items.' % self.bulk_max_items,
+                ],
+            })
+
+        serializer = AttemptSerializer(
             data=request.data,
+            many=True,
+            context={'request': request},
         )
         serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        Follower.objects.create(
-            user=request.user,
-            quiz_group=get_object_or_404(
-                QuizGroup,
-                uuid=serializer.validated_data['quiz_group'],
-            ),
-        )
-        QuizGroup.objects.values().filter(
-            uuid=pk
-        ).update(
-            followings=quiz_group.followings + 1,
+
+# 自分のクイズグループ・クイズのエクスポート (NDJSON)
+class ExportView(views.APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'bulk'
+
+    def get(self, request, *args, **kwargs):
+        lines = transfer.export_lines(request.user)
+        if isinstance(request._request, ASGIRequest):
+            # ASGI では同期イテレータは全体を読み込んでから送られるため非同期にする
+            lines = transfer.aiterate(lines)
+
+        return StreamingHttpResponse(
+            lines,
+            content_type=NDJSONParser.media_type,
+            headers={
+                'Content-Disposition': 'attachment; filename="quisapi-export.ndjson"',
+            },
         )
 
-        return Response(status.HTTP_200_OK)
 
+# クイズグループ・クイズのインポート (NDJSON)
+# 本文を1行ずつ読み、一定件数ごとに書き込む (request.data は使わない)
+class ImportView(views.APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'bulk'
+
+    def post(self, request, *args, **kwargs):
+        importer = transfer.Importer(request.user)
+        stream = request.stream
+        with transaction.atomic():
+            if stream is not None:
+                lines = NDJSONParser().iter_parse_lines(stream, request.parser_context)
+                for line_number, data in lines:
+                    importer.feed(line_number, data)
+            importer.finish()
+
+        return Response(
+            {
+                'quiz_groups': importer.created_groups,
+                'quizzes': importer.created_quizzes,
+                'errors': importer.errors,
+            },
+            status=status.HTTP_201_CREATED,
+        )
 
-# フォロー解除
-class UnfollowView(views.APIView):
+
+# フィード (フォロー中のクイズグループの新着クイズ)
+class FeedView(QueryBudgetMixin, ValuesListMixin, generics.ListAPIView):
+    serializer_class = FeedSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-feed_date', '-uuid')
     permission_classes = [IsAuthenticated]
+    query_budget = 3
+
+    def get_queryset(self):
+        return feed.feed_queryset(self.request.user)
 
-    @transaction.atomic
-    def put(self, request, pk, *args, **kwargs):
-        quiz_group = get_object_or_404(
-            QuizGroup,
-            uuid=pk
-        )
 
-        QuizGroup.objects.values().filter(
-            uuid=pk
-        ).update(
-            followings=quiz_group.followings - 1,
+# クイズの全文検索 (?q=)
+# 関連度の高い順に、キーセットページネーションで返す
+class SearchView(QueryBudgetMixin, ValuesListMixin, VisibilityMixin, generics.ListAPIView):
+    queryset = Quiz.objects.all()
+    serializer_class = SearchSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-rank', 'uuid')
+    permission_classes = [IsAuthenticatedOrReadOnly]
+    query_budget = 2
+
+    def get_visibility_branches(self, queryset):
+        return quiz_branches(self.request.user, queryset)
+
+    def get_queryset(self):
+        queryset = search.search(
+            self.get_aggregate_queryset(),
+            self.request.query_params.get('q', ''),
         )
-        get_object_or_404(
-            Follower,
-            user=request.user,
-            quiz_group=quiz_group,
-        ).delete()
+        return queryset.order_by(*self.keyset_ordering)
 
-        return Response(status.HTTP_200_OK)
+
+# 人気のクイズグループ
+# 事前に作成したランキングテーブルを順位の索引で読む (リクエストごとに集計しない)
+class TrendingView(QueryBudgetMixin, ValuesListMixin, generics.ListAPIView):
+    serializer_class = TrendingSerializer
+    pagination_class = KeysetPagination
+    keyset_ordering = ('trendingscore__rank',)
+    permission_classes = [IsAuthenticatedOrReadOnly]
+    query_budget = 2
+
+    def get_queryset(self):
+        # ランキング作成後に非公開になったグループは表示しない
+        return QuizGroup.objects.filter(
+            scope=True,
+            trendingscore__isnull=False,
+        )
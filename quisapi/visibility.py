@@ -0,0 +1,62 @@
+from django.db.models import QuerySet
+
+from quisapi.models import QuizGroup, Quiz
+
+
+# 閲覧可能なクイズグループ
+# 自分のグループ / 他人の公開グループ の互いに素な2つの分岐に分けることで、
+# OR + DISTINCT を使わずにそれぞれの分岐でインデックスを使えるようにする
+def quiz_group_branches(user, queryset=None):
+    if queryset is None:
+        queryset = QuizGroup.objects.all()
+
+    if not user.is_authenticated:
+        return [queryset.filter(scope=True)]
+
+    return [
+        queryset.filter(user=user),
+        queryset.filter(scope=True).exclude(user=user),
+    ]
+
+
+# 閲覧可能なクイズ
+def quiz_branches(user, queryset=None):
+    if queryset is None:
+        queryset = Quiz.objects.all()
+
+    if not user.is_authenticated:
+        return [queryset.filter(quiz_group__scope=True)]
+
+    return [
+        queryset.filter(quiz_group__user=user),
+        queryset.filter(quiz_group__scope=True).exclude(quiz_group__user=user),
+    ]
+
+
+# 分岐を UNION ALL で結合する
+# 分岐同士は重複しないため DISTINCT は不要
+def combine(branches, ordering=()):
+    first, *rest = branches
+    if rest:
+        queryset = first.union(*rest, all=True)
+    else:
+        queryset = first
+    return queryset.order_by(*ordering)
+
+
+# UNION ALL で結合済みのクエリセットに対して、各分岐へ条件を押し込んで再結合する
+# (結合済みのクエリセットは filter() できないため)
+def filter_combined(queryset, *args, **kwargs):
+    query = queryset.query
+    if not query.combinator:
+        return queryset.filter(*args, **kwargs)
+
+    branches = [
+        QuerySet(model=queryset.model, query=combined.clone()).filter(*args, **kwargs)
+        for combined in query.combined_queries
+    ]
+    combined_queryset = combine(branches, query.order_by)
+    # values() で列を絞っている場合は結合し直した後も同じ列にする
+    if queryset._fields is not None:
+        combined_queryset = combined_queryset.values(*queryset._fields)
+    return combined_queryset